@@ -1,42 +1,264 @@
-from logging.handlers import RotatingFileHandler  # pylint: disable=W0611
+from functools import partial
 from os import environ
-import logging
 from flask import Flask
 from flask_migrate import Migrate
 
 from views import blueprint
 from models import db
 from service import login_manager
-from rest import api, UserApi, CoinApi, BalanceApi
+from service import users as user_service
+from service import coins as coin_service
+from service import balances as balance_service
+from service import prices as price_service
+from service import passwords
+from service.cassette import cassette_fetcher
+from service.database import configure_database
+from service.stream import price_broadcaster
+from service.http import http_client
+from service.logs import configure_logging
+from service.metrics import init_metrics
+from service.commands import ledger_cli, prices_cli, snapshots_cli
+from service.poller import PricePoller
+from service.snapshots import SnapshotScheduler
+from rest import init_api
 
 
-def create_app():
+PRICE_API_URL = 'https://www.binance.me/api/v3/ticker/price'
+
+
+def mysql_database_uri() -> str:
     """
-    Initialized app
+    Builds the uri of the MySQL database from the environment
+    """
+    return f'mysql+pymysql://{environ.get("DB_USERNAME")}:' \
+           f'{environ.get("DB_PASSWORD")}@localhost/CRYPTEX'
+
+
+def database_uri() -> str:
+    """
+    Builds the uri of the primary database, `DATABASE_URL` or the local MySQL database
+    """
+    return environ.get('DATABASE_URL') or mysql_database_uri()
+
+
+def configure_services(app, config: dict = None):  # pylint: disable=R0915
+    """
+    Sets the service settings shared by both app factories
+
+    Settings are read from the environment, then overridden by `config`,
+    and applied to the per-worker service objects.
+
+    Args:
+        app: The Flask app to configure.
+        config(dict): Optional configuration that overrides the defaults.
     """
+    # database connection pools, the replica serves the reads of `read_replica` blocks
+    app.config['DATABASE_REPLICA_URL'] = environ.get('DATABASE_REPLICA_URL', '')
+    app.config['DB_POOL_SIZE'] = int(environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(environ.get('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(environ.get('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = environ.get('DB_POOL_PRE_PING', '1') == '1'
+    app.config['DB_CONNECT_TIMEOUT'] = float(environ.get('DB_CONNECT_TIMEOUT', 10))
+    # milliseconds, 0 for no limit
+    app.config['DB_STATEMENT_TIMEOUT'] = int(environ.get('DB_STATEMENT_TIMEOUT', 0))
+
+    # price provider
+    app.config['PRICE_API_URL'] = environ.get('PRICE_API_URL', PRICE_API_URL)
+    app.config['PRICE_API_TIMEOUT'] = float(environ.get('PRICE_API_TIMEOUT', 5))
+    # connections to the price API pooled by a worker of the ASGI app
+    app.config['PRICE_API_MAX_CONNECTIONS'] = int(environ.get('PRICE_API_MAX_CONNECTIONS', 100))
+
+    # record the price API answers to a cassette file, or replay them without the network
+    app.config['PRICE_API_CASSETTE'] = environ.get('PRICE_API_CASSETTE', '')
+    app.config['PRICE_API_CASSETTE_MODE'] = environ.get('PRICE_API_CASSETTE_MODE', 'replay')
+    # replay speed relative to the recording, 0 serves the next recorded call on every fetch
+    app.config['PRICE_API_CASSETTE_SPEED'] = \
+        float(environ.get('PRICE_API_CASSETTE_SPEED', 1))
+
+    # pooled HTTP client of the outbound calls, with retries and a circuit breaker per host
+    app.config['HTTP_POOL_SIZE'] = int(environ.get('HTTP_POOL_SIZE', 10))
+    app.config['HTTP_RETRIES'] = int(environ.get('HTTP_RETRIES', 2))
+    app.config['HTTP_RETRY_BACKOFF'] = float(environ.get('HTTP_RETRY_BACKOFF', 0.1))
+    app.config['HTTP_CIRCUIT_FAILURES'] = int(environ.get('HTTP_CIRCUIT_FAILURES', 5))
+    app.config['HTTP_CIRCUIT_RESET'] = float(environ.get('HTTP_CIRCUIT_RESET', 30))
 
-    logger = logging.getLogger()
+    # price cache, 'memory' is per worker, 'sqlite' is shared by the workers of a host
+    app.config['PRICE_CACHE_BACKEND'] = environ.get('PRICE_CACHE_BACKEND', 'memory')
+    app.config['PRICE_CACHE_PATH'] = environ.get('PRICE_CACHE_PATH', 'prices.sqlite3')
+    app.config['PRICE_CACHE_TTL'] = float(environ.get('PRICE_CACHE_TTL', 10))
+    app.config['PRICE_CACHE_STALE_TTL'] = float(environ.get('PRICE_CACHE_STALE_TTL', 60))
 
-    log_format = logging.Formatter(
-        "%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
+    # background price poller, started by the app or run with `flask prices poll`
+    app.config['PRICE_POLLER_ENABLED'] = environ.get('PRICE_POLLER_ENABLED', '0') == '1'
+    app.config['PRICE_POLLER_INTERVAL'] = float(environ.get('PRICE_POLLER_INTERVAL', 10))
+    app.config['PRICE_POLLER_MAX_BACKOFF'] = float(environ.get('PRICE_POLLER_MAX_BACKOFF', 300))
+    app.config['PRICE_HISTORY_RECORD'] = environ.get('PRICE_HISTORY_RECORD', '0') == '1'
+
+    # daily portfolio snapshots, rolled up by `flask snapshots rollup` or a background thread
+    app.config['SNAPSHOT_SCHEDULER_ENABLED'] = \
+        environ.get('SNAPSHOT_SCHEDULER_ENABLED', '0') == '1'
+    app.config['SNAPSHOT_INTERVAL'] = float(environ.get('SNAPSHOT_INTERVAL', 3600))
+    app.config['SNAPSHOT_BATCH_SIZE'] = int(environ.get('SNAPSHOT_BATCH_SIZE', 500))
+
+    # coin catalog reload interval, and how long clients may cache the coin list
+    app.config['COIN_CATALOG_TTL'] = float(environ.get('COIN_CATALOG_TTL', 300))
+    app.config['COIN_CACHE_MAX_AGE'] = int(environ.get('COIN_CACHE_MAX_AGE', 60))
+
+    # number of balances per page of the home page
+    app.config['BALANCES_PAGE_SIZE'] = int(environ.get('BALANCES_PAGE_SIZE', 100))
+    # number of balances inserted per transaction by the bulk import
+    app.config['BALANCES_IMPORT_BATCH_SIZE'] = int(
+        environ.get('BALANCES_IMPORT_BATCH_SIZE', 1000)
+    )
+
+    # password hashing method and cost, outdated hashes are upgraded on login
+    app.config['PASSWORD_HASH_METHOD'] = environ.get(
+        'PASSWORD_HASH_METHOD', passwords.DEFAULT_METHOD
+    )
+
+    # user loader cache
+    app.config['USER_CACHE_SIZE'] = int(environ.get('USER_CACHE_SIZE', 1024))
+    app.config['USER_CACHE_TTL'] = float(environ.get('USER_CACHE_TTL', 60))
+
+    # server-sent portfolio events, with one price poll per interval shared by the streams
+    app.config['PRICE_STREAM_INTERVAL'] = float(environ.get('PRICE_STREAM_INTERVAL', 1))
+    app.config['PRICE_STREAM_HEARTBEAT'] = float(environ.get('PRICE_STREAM_HEARTBEAT', 15))
+    app.config['PRICE_STREAM_RELOAD'] = float(environ.get('PRICE_STREAM_RELOAD', 60))
+
+    # logging, 'queue' writes the records from a background thread, 'json' writes one JSON
+    # object per line, and only a share of the INFO and DEBUG records is kept if sampled
+    app.config['LOG_MODE'] = environ.get('LOG_MODE', 'sync')
+    app.config['LOG_FORMAT'] = environ.get('LOG_FORMAT', 'text')
+    app.config['LOG_LEVEL'] = environ.get('LOG_LEVEL', 'WARNING')
+    app.config['LOG_PATH'] = environ.get('LOG_PATH', 'logs.log')
+    app.config['LOG_SAMPLE_RATE'] = float(environ.get('LOG_SAMPLE_RATE', 1))
+    app.config['LOG_QUEUE_SIZE'] = int(environ.get('LOG_QUEUE_SIZE', 10000))
+
+    # request metrics served at /metrics, and the Server-Timing header of every response
+    app.config['METRICS_ENABLED'] = environ.get('METRICS_ENABLED', '1') == '1'
+
+    # rendered portfolio grids of the home page, also dropped on balance or price changes
+    app.config['PORTFOLIO_CACHE_SIZE'] = int(environ.get('PORTFOLIO_CACHE_SIZE', 1024))
+    app.config['PORTFOLIO_CACHE_TTL'] = float(environ.get('PORTFOLIO_CACHE_TTL', 30))
+
+    app.config.update(config or {})
+
+    configure_database(app.config)
+    http_client.configure(
+        pool_size=app.config['HTTP_POOL_SIZE'],
+        retries=app.config['HTTP_RETRIES'],
+        backoff=app.config['HTTP_RETRY_BACKOFF'],
+        circuit_failures=app.config['HTTP_CIRCUIT_FAILURES'],
+        circuit_reset=app.config['HTTP_CIRCUIT_RESET'],
+    )
+    coin_service.coin_catalog.configure(ttl=app.config['COIN_CATALOG_TTL'])
+    user_service.user_cache.configure(
+        maxsize=app.config['USER_CACHE_SIZE'],
+        ttl=app.config['USER_CACHE_TTL'],
+    )
+    price_broadcaster.configure(
+        source=price_service.price_cache.get_prices,
+        interval=app.config['PRICE_STREAM_INTERVAL'],
     )
+    balance_service.portfolio_cache.configure(
+        maxsize=app.config['PORTFOLIO_CACHE_SIZE'],
+        ttl=app.config['PORTFOLIO_CACHE_TTL'],
+    )
+    fetcher = partial(
+        price_service.fetch_prices,
+        url=app.config['PRICE_API_URL'],
+        timeout=app.config['PRICE_API_TIMEOUT'],
+    )
+    if app.config['PRICE_API_CASSETTE']:
+        fetcher = cassette_fetcher(
+            fetcher,
+            app.config['PRICE_API_CASSETTE'],
+            mode=app.config['PRICE_API_CASSETTE_MODE'],
+            speed=app.config['PRICE_API_CASSETTE_SPEED'],
+        )
+    price_service.price_cache.configure(
+        store=price_service.create_store(
+            app.config['PRICE_CACHE_BACKEND'],
+            app.config['PRICE_CACHE_PATH'],
+        ),
+        fetcher=fetcher,
+        ttl=app.config['PRICE_CACHE_TTL'],
+        stale_ttl=app.config['PRICE_CACHE_STALE_TTL'],
+    )
+
+    app.cli.add_command(prices_cli)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(snapshots_cli)
+
+
+def instrument(app):
+    """
+    Instruments the requests of an app if metrics are enabled in the app config
+
+    Args:
+        app: The Flask app to instrument.
+    """
+    if app.config['METRICS_ENABLED']:
+        init_metrics(
+            app,
+            caches={
+                'users': user_service.user_cache,
+                'portfolio': balance_service.portfolio_cache,
+            },
+            http_client=http_client,
+        )
+
+
+def start_background_jobs(app):
+    """
+    Starts the background jobs enabled in the app config
+
+    Args:
+        app: The Flask app the jobs work for.
+    """
+    if app.config['PRICE_POLLER_ENABLED']:
+        poller = PricePoller(
+            app,
+            interval=app.config['PRICE_POLLER_INTERVAL'],
+            max_backoff=app.config['PRICE_POLLER_MAX_BACKOFF'],
+            record_history=app.config['PRICE_HISTORY_RECORD'],
+        )
+        poller.start()
+        app.extensions['price_poller'] = poller
+    if app.config['SNAPSHOT_SCHEDULER_ENABLED']:
+        scheduler = SnapshotScheduler(
+            app,
+            interval=app.config['SNAPSHOT_INTERVAL'],
+            batch_size=app.config['SNAPSHOT_BATCH_SIZE'],
+        )
+        scheduler.start()
+        app.extensions['snapshot_scheduler'] = scheduler
 
-    console_log = logging.StreamHandler()
-    console_log.setFormatter(log_format)
-    console_log.setLevel('DEBUG')
-    logger.addHandler(console_log)
 
-    file_log = logging.handlers.RotatingFileHandler('logs.log', maxBytes=1024*1000)
-    file_log.setFormatter(log_format)
-    logger.addHandler(file_log)
+def create_app(config: dict = None):
+    """
+    Initialized app
+
+    Args:
+        config(dict): Optional configuration that overrides the defaults.
+    """
 
     app = Flask(__name__)
     app.config['SECRET_KEY'] = environ.get('SECRET_KEY', 'test_secret')
 
     # adding database
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{environ.get("DB_USERNAME")}:'\
-                                            f'{environ.get("DB_PASSWORD")}@localhost/CRYPTEX'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+
+    configure_services(app, config)
+    configure_logging(
+        mode=app.config['LOG_MODE'],
+        fmt=app.config['LOG_FORMAT'],
+        level=app.config['LOG_LEVEL'],
+        path=app.config['LOG_PATH'],
+        sample_rate=app.config['LOG_SAMPLE_RATE'],
+        queue_size=app.config['LOG_QUEUE_SIZE'],
+    )
 
     app.register_blueprint(blueprint)
 
@@ -49,23 +271,47 @@ def create_app():
     login_manager.init_app(app)
     login_manager.login_view = 'blueprint.login'
 
-    api.add_resource(UserApi, '/api/v1/users', '/api/v1/users/<int:id>')
-    api.add_resource(CoinApi, '/api/v1/coins')
-    api.add_resource(BalanceApi, '/api/v1/balances', '/api/v1/balances/<int:id>')
-    api.init_app(app)
+    init_api(app)
+    instrument(app)
+
+    start_background_jobs(app)
 
     return app
 
 
-def create_test_app():
+def create_asgi_app(config: dict = None):
+    """
+    Initialized async (ASGI) app serving the REST API, see `rest.asgi`
+
+    Settings are the same as the ones of `create_app`. Needs the 'asgi' extra, run it with
+    `uvicorn --factory app:create_asgi_app`.
+
+    Args:
+        config(dict): Optional configuration that overrides the defaults.
+    """
+    from rest.asgi import create_asgi_app as create_rest_app  # pylint: disable=C0415
+
+    settings = Flask(__name__)
+    settings.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    configure_services(settings, config)
+
+    return create_rest_app(settings.config, settings.instance_path)
+
+
+def create_test_app(config: dict = None):
     """
     Initialized app for testing
+
+    Args:
+        config(dict): Optional configuration that overrides the defaults.
     """
     test_app = Flask(__name__)
 
     test_app.config['SECRET_KEY'] = environ.get('SECRET_KEY')
 
     test_app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///app.db'
+    configure_services(test_app, config)
+
     test_app.register_blueprint(blueprint)
 
     db.init_app(test_app)
@@ -76,9 +322,7 @@ def create_test_app():
     login_manager.init_app(test_app)
     login_manager.login_view = 'blueprint.login'
 
-    api.add_resource(UserApi, '/api/v1/users', '/api/v1/users/<int:id>')
-    api.add_resource(CoinApi, '/api/v1/coins')
-    api.add_resource(BalanceApi, '/api/v1/balances', '/api/v1/balances/<int:id>')
-    api.init_app(test_app)
+    init_api(test_app)
+    instrument(test_app)
 
     return test_app
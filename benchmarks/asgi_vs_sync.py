@@ -0,0 +1,177 @@
+"""
+Compares the sync (gunicorn) and async (ASGI) deployment modes of the REST API under
+concurrent requests that all wait for a slow price API.
+
+The price cache is disabled (`PRICE_CACHE_TTL=0`), so every balances request goes
+upstream. A sync worker is held for the whole upstream call, so the sync mode serves
+at most `workers / price_latency` requests per second, while a single ASGI process
+only holds a coroutine per waiting request. Both servers run as separate processes
+on the same seeded SQLite database. Needs the 'asgi' extra and gunicorn.
+
+Usage:
+    python -m benchmarks.asgi_vs_sync --concurrency 200 --requests 2000 --price-latency 0.5
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from threading import local
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+from app import create_test_app
+from benchmarks.common import PriceStubServer, seed_database, percentile
+
+
+def parse_args():
+    """
+    Function that parses the command line arguments of the benchmark
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--balances', type=int, default=20, help='balances per user')
+    parser.add_argument('--coins', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4, help='sync gunicorn workers')
+    parser.add_argument('--price-latency', type=float, default=0.5,
+                        help='seconds the stub price API waits before answering')
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    """
+    Function that finds a free local port
+
+    Returns:
+        int: The port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, config: dict, port: int, workers: int, env: dict):
+    """
+    Function that starts the app in a subprocess and waits until it answers
+
+    Args:
+        mode(str): Either 'sync' (gunicorn sync workers) or 'async' (a uvicorn process).
+        config(dict): The configuration that overrides the app defaults.
+        port(int): The local port to listen on.
+        workers(int): The number of gunicorn workers of the sync mode.
+        env(dict): The environment of the server process.
+
+    Returns:
+        Popen: The server process.
+    """
+    if mode == 'sync':
+        command = [
+            sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+            '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+            f'app:create_test_app({config!r})',
+        ]
+    else:
+        command = [
+            sys.executable, '-c',
+            'import uvicorn, app; '
+            f'uvicorn.run(app.create_asgi_app({config!r}), host="127.0.0.1", port={port}, '
+            'log_level="warning")',
+        ]
+    process = subprocess.Popen(command, env=env)  # pylint: disable=consider-using-with
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/v1/coins', timeout=1)
+            return process
+        except requests.RequestException:  # still booting
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'The {mode} server did not start')
+
+
+def load(url: str, users: int, total: int, concurrency: int) -> tuple:
+    """
+    Function that sends balance requests with the given concurrency
+
+    Args:
+        url(str): The root url of the app.
+        users(int): The number of seeded users the requests are spread over.
+        total(int): The number of requests to send.
+        concurrency(int): The number of requests in flight at a time.
+
+    Returns:
+        tuple: The latencies of the successful requests, the number of failed
+        requests and the elapsed seconds.
+    """
+    sessions = local()
+
+    def timed_get(number: int):
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = sessions.session.get(
+                f'{url}api/v1/balances/{number % users + 1}', timeout=60
+            )
+            response.raise_for_status()
+        except requests.RequestException:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed_get, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency in results if latency is not None]
+    return latencies, len(results) - len(latencies), elapsed
+
+
+def main():
+    """
+    Function that runs the benchmark and prints its report
+    """
+    args = parse_args()
+    with TemporaryDirectory() as directory, PriceStubServer(args.price_latency) as stub:
+        config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directory, "bench.db")}'}
+        seed_database(create_test_app(config), args.users, args.balances, args.coins)
+        env = {
+            **os.environ,
+            'SECRET_KEY': 'benchmark',
+            'PRICE_API_URL': stub.url,
+            'PRICE_CACHE_TTL': '0',
+            'PRICE_CACHE_STALE_TTL': '0',
+        }
+
+        print(f'requests: {args.requests} at concurrency {args.concurrency}, '
+              f'price API latency {args.price_latency * 1000:.0f} ms')
+        print(f'{"mode":<22}{"req/s":>9}{"p50":>10}{"p95":>10}{"p99":>10}'
+              f'{"errors":>8}{"upstream":>10}')
+        for mode, label in (('sync', f'sync ({args.workers} workers)'),
+                            ('async', 'async (1 process)')):
+            port = free_port()
+            process = start_server(mode, config, port, args.workers, env)
+            calls = stub.calls
+            try:
+                latencies, errors, elapsed = load(
+                    f'http://127.0.0.1:{port}/', args.users, args.requests, args.concurrency
+                )
+            finally:
+                process.terminate()
+                process.wait()
+            print(f'{label:<22}{len(latencies) / elapsed:>9.1f}'
+                  f'{percentile(latencies, 0.50) * 1000:>8.0f}ms'
+                  f'{percentile(latencies, 0.95) * 1000:>8.0f}ms'
+                  f'{percentile(latencies, 0.99) * 1000:>8.0f}ms'
+                  f'{errors:>8}{stub.calls - calls:>10}')
+
+
+if __name__ == '__main__':
+    main()
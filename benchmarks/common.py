@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+import json
+import logging
+import math
+import random
+import time
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from models import db, User, Coin, Balance
+
+
+class PriceStubServer:  # pylint: disable=too-many-instance-attributes
+    """
+    A local HTTP server that stands in for the Binance ticker price API.
+
+    It answers `GET /api/v3/ticker/price?symbols=[...]` with a deterministic price
+    for every requested symbol, optionally after a delay, or with a random share of
+    `503 Service Unavailable` errors. Like Binance, a request with an invalid symbol
+    is answered with a `400 Bad Request` error.
+
+    Attributes:
+        latency(float): The number of seconds to wait before answering.
+        error_rate(float): The fraction of requests answered with an error.
+        url(str): The ticker url to use as `PRICE_API_URL`.
+        calls(int): The number of requests served so far.
+        errors(int): The number of requests answered with an error so far.
+        connections(set): The client addresses of the connections served so far.
+        invalid(set): The symbols that are not listed by the stub.
+    """
+
+    def __init__(self, latency: float = 0.0, port: int = 0, error_rate: float = 0.0,
+                 seed: int = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self.connections = set()
+        self.invalid = set()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self.url = f'http://127.0.0.1:{self._server.server_port}/api/v3/ticker/price'
+
+    @staticmethod
+    def price(symbol: str) -> Decimal:
+        """
+        Function that gives the deterministic price of a symbol
+
+        Args:
+            symbol(str): The coin index (e.g. 'BTCUSDT').
+
+        Returns:
+            Decimal: The price of the symbol.
+        """
+        return Decimal(sum(map(ord, symbol)) % 1000 + 1) / 10
+
+    def fails(self) -> bool:
+        """
+        Function that draws whether the next request is answered with an error
+
+        Returns:
+            bool: True for a share of `error_rate` of the calls.
+        """
+        return bool(self.error_rate) and self._random.random() < self.error_rate
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):  # pylint: disable=too-few-public-methods
+            """Request handler of the stub server, keeping connections alive"""
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Answers a ticker price request"""
+                stub.calls += 1
+                stub.connections.add(self.client_address)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.fails():
+                    stub.errors += 1
+                    self.send_error(503)
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                symbols = json.loads(query.get('symbols', ['[]'])[0])
+                if stub.invalid.intersection(symbols):
+                    status, answer = 400, {'code': -1121, 'msg': 'Invalid symbol.'}
+                else:
+                    status, answer = 200, [
+                        {'symbol': symbol, 'price': str(stub.price(symbol))}
+                        for symbol in symbols
+                    ]
+                body = json.dumps(answer).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Silences the default access log"""
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class AppServer:
+    """
+    Serves a Flask app on a local port from a background thread.
+
+    Attributes:
+        url(str): The root url of the served app.
+    """
+
+    def __init__(self, app, port: int = 0):
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self._server = make_server('127.0.0.1', port, app, threaded=True)
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self.url = f'http://127.0.0.1:{self._server.server_port}/'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+
+
+def seed_database(app, users: int, balances: int, coins: int,  # pylint: disable=R0913
+                  password: str = 'password', days: int = 365, batch_size: int = 50000):
+    """
+    Function that recreates the database of the app and fills it with generated data
+
+    Every user gets the same password, `user<N>@example.com` as email and
+    `balances` balances spread over the `coins` coins and the past `days` days.
+    Rows are inserted `batch_size` at a time, so millions of balances fit in memory.
+
+    Args:
+        app: The Flask app whose database to seed.
+        users(int): The number of users to create.
+        balances(int): The number of balances per user.
+        coins(int): The number of coins to create.
+        password(str): The password of every user.
+        days(int): The number of past days the balances are spread over.
+        batch_size(int): The number of rows inserted per statement.
+    """
+    password_hash = generate_password_hash(password)
+    now = datetime.utcnow()
+    rows = (
+        {
+            'user_id': user_id,
+            'coin_id': random.randint(1, coins),
+            'amount': Decimal(random.randint(1, 10 ** 7)) / 10 ** 4,
+            'date_added': now - timedelta(seconds=random.randint(0, days * 86400)),
+        }
+        for user_id in range(1, users + 1)
+        for _ in range(balances)
+    )
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(Coin), [
+            {'index': f'C{number}USDT', 'abbreviation': f'C{number}'}
+            for number in range(1, coins + 1)
+        ])
+        db.session.execute(insert(User), [
+            {'email': f'user{number}@example.com', 'password_hash': password_hash}
+            for number in range(1, users + 1)
+        ])
+        while batch := list(islice(rows, batch_size)):
+            db.session.execute(insert(Balance), batch)
+        db.session.commit()
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """
+    Function that computes a percentile of the samples with the nearest-rank method
+
+    Args:
+        samples(list): The measured values.
+        fraction(float): The percentile as a fraction (e.g. 0.95).
+
+    Returns:
+        float: The percentile, or 0 if there are no samples.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
@@ -0,0 +1,303 @@
+"""
+Load tests the main pages and endpoints of the app and writes a JSON report that can
+be compared between commits.
+
+The app is booted against a database seeded with `--users` users holding `--balances`
+balances each over `--coins` coins, a temporary SQLite database by default or the
+`--database-url` database (e.g. MySQL), which is dropped and recreated. The Binance
+API is replaced by a local stub answering after `--price-latency` seconds, with a
+share of `--price-error-rate` errors, which every valuation waits for with
+`--no-price-cache`. Its answers can be recorded with `--record-prices` and replayed
+from memory with `--replay-prices`, for runs that do not depend on upstream timing.
+Every scenario then sends `--requests` requests, `--concurrency` at a time, after
+`--warmup` unmeasured ones:
+
+- home: the home page of a logged in user
+- balances: `/api/v1/balances/<id>`
+- coins: `/api/v1/coins`
+- login: the login form, a password hash per request
+
+Usage:
+    python -m benchmarks.load_test --users 50 --concurrency 16 --output report.json
+    python -m benchmarks.load_test --baseline report.json --output report-new.json
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import count
+from tempfile import TemporaryDirectory
+from threading import local
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import requests
+from sqlalchemy.engine import make_url
+
+from app import create_test_app
+from benchmarks.common import PriceStubServer, AppServer, seed_database, percentile
+
+
+PASSWORD = 'password'
+
+
+def home(session: requests.Session, url: str, user: int) -> bool:  # pylint: disable=W0613
+    """
+    Function that gets the home page of the user logged in the session
+    """
+    return session.get(url, allow_redirects=False, timeout=60).status_code == 200
+
+
+def balances(session: requests.Session, url: str, user: int) -> bool:
+    """
+    Function that gets the valued balances of a user
+    """
+    response = session.get(f'{url}api/v1/balances/{user}', allow_redirects=False, timeout=60)
+    return response.status_code == 200
+
+
+def coins(session: requests.Session, url: str, user: int) -> bool:  # pylint: disable=W0613
+    """
+    Function that gets the listed coins
+    """
+    return session.get(f'{url}api/v1/coins', allow_redirects=False, timeout=60).status_code == 200
+
+
+def login(session: requests.Session, url: str, user: int) -> bool:
+    """
+    Function that logs a user in, which redirects to the home page on success
+    """
+    response = session.post(
+        f'{url}login',
+        data={'email': f'user{user}@example.com', 'password': PASSWORD},
+        allow_redirects=False,
+        timeout=60,
+    )
+    return response.status_code == 302
+
+
+# scenarios by name, each sends one request and tells whether it succeeded
+SCENARIOS = {'home': home, 'balances': balances, 'coins': coins, 'login': login}
+
+
+def parse_args():
+    """
+    Function that parses the command line arguments of the benchmark
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--balances', type=int, default=50, help='balances per user')
+    parser.add_argument('--coins', type=int, default=5)
+    parser.add_argument('--database-url', default=None,
+                        help='database to seed, it is dropped first (temporary SQLite by '
+                             'default)')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='unmeasured requests sent before each scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--price-latency', type=float, default=0.05,
+                        help='seconds the stub price API waits before answering')
+    parser.add_argument('--price-error-rate', type=float, default=0.0,
+                        help='fraction of the stub price API calls answered with a 503')
+    parser.add_argument('--no-price-cache', action='store_true',
+                        help='call the stub price API on every valuation')
+    parser.add_argument('--record-prices', metavar='CASSETTE', default=None,
+                        help='record the stub price API answers to a cassette file')
+    parser.add_argument('--replay-prices', metavar='CASSETTE', default=None,
+                        help='serve the prices of a recorded cassette instead of the stub, '
+                             'one recorded call per fetch')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the stub price API errors')
+    parser.add_argument('--output', default='benchmark-report.json',
+                        help='path of the JSON report')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON report of an earlier run to compare with')
+    return parser.parse_args()
+
+
+def git_commit() -> dict:
+    """
+    Function that describes the checked out commit of the repository
+
+    Returns:
+        dict: The 'commit' hash and whether the working tree is 'dirty', None values
+        outside of a git repository.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                check=True, text=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, check=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': bool(status.strip())}
+
+
+def cassette_config(args) -> dict:
+    """
+    Function that gives the price cassette settings of the app
+
+    Args:
+        args(Namespace): The parsed arguments of the benchmark.
+
+    Returns:
+        dict: The settings that record to or replay from a cassette, if any.
+    """
+    if args.replay_prices:
+        return {'PRICE_API_CASSETTE': args.replay_prices, 'PRICE_API_CASSETTE_MODE': 'replay',
+                'PRICE_API_CASSETTE_SPEED': 0}
+    if args.record_prices:
+        return {'PRICE_API_CASSETTE': args.record_prices, 'PRICE_API_CASSETTE_MODE': 'record'}
+    return {}
+
+
+def run_scenario(url: str, name: str, args) -> dict:
+    """
+    Function that sends the requests of a scenario with the given concurrency
+
+    Every thread keeps its own HTTP session, logged in as one of the seeded users for
+    the home page.
+
+    Args:
+        url(str): The root url of the app.
+        name(str): The name of the scenario, a key of `SCENARIOS`.
+        args(Namespace): The parsed arguments of the benchmark.
+
+    Returns:
+        dict: The number of requests and errors, the error rate, the requests per
+        second and the p50, p95, p99 and mean latencies of the successful requests in
+        milliseconds.
+    """
+    scenario = SCENARIOS[name]
+    sessions = local()
+    threads = count()
+
+    def session() -> requests.Session:
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+            if name == 'home':
+                login(sessions.session, url, next(threads) % args.users + 1)
+        return sessions.session
+
+    def timed_request(number: int):
+        client = session()
+        start = time.perf_counter()
+        try:
+            succeeded = scenario(client, url, number % args.users + 1)
+        except requests.RequestException:
+            succeeded = False
+        return time.perf_counter() - start if succeeded else None
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        list(executor.map(timed_request, range(args.warmup)))
+        start = time.perf_counter()
+        results = list(executor.map(timed_request, range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency in results if latency is not None]
+    errors = len(results) - len(latencies)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else 0.0,
+        'rps': round(len(results) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def compare(baseline: dict, report: dict) -> list:
+    """
+    Function that compares the scenarios of two reports
+
+    Args:
+        baseline(dict): The report of the earlier run.
+        report(dict): The report of the current run.
+
+    Returns:
+        list: A line per scenario of both reports with the relative change of its
+        throughput and tail latencies, positive when the current run is slower for
+        the latencies or faster for the throughput.
+    """
+    def change(old: float, new: float) -> str:
+        return f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+
+    lines = [f'{"scenario":<12}{"req/s":>10}{"p95":>10}{"p99":>10}{"errors":>10}']
+    for name, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        lines.append(
+            f'{name:<12}{change(previous["rps"], current["rps"]):>10}'
+            f'{change(previous["p95_ms"], current["p95_ms"]):>10}'
+            f'{change(previous["p99_ms"], current["p99_ms"]):>10}'
+            f'{current["errors"] - previous["errors"]:>+10}'
+        )
+    return lines
+
+
+def main():
+    """
+    Function that runs the benchmark, prints and writes its report
+    """
+    args = parse_args()
+    with TemporaryDirectory() as directory, \
+            PriceStubServer(args.price_latency, error_rate=args.price_error_rate,
+                            seed=args.seed) as stub:
+        database_url = (args.database_url
+                        or f'sqlite:///{os.path.join(directory, "bench.db")}')
+        app = create_test_app({
+            'SECRET_KEY': 'benchmark',
+            'SQLALCHEMY_DATABASE_URI': database_url,
+            'PRICE_API_URL': stub.url,
+            'WTF_CSRF_ENABLED': False,
+            **({'PRICE_CACHE_TTL': 0, 'PRICE_CACHE_STALE_TTL': 0, 'PORTFOLIO_CACHE_TTL': 0}
+               if args.no_price_cache else {}),
+            **cassette_config(args),
+        })
+        seed_database(app, args.users, args.balances, args.coins, password=PASSWORD)
+
+        scenarios = {}
+        with AppServer(app) as server:
+            for name in args.scenarios:
+                scenarios[name] = run_scenario(server.url, name, args)
+
+    report = {
+        **git_commit(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': make_url(database_url).get_backend_name(),
+        'parameters': {
+            key: value for key, value in vars(args).items()
+            if key not in ('database_url', 'output', 'baseline', 'record_prices')
+        },
+        'upstream': {'calls': stub.calls, 'errors': stub.errors},
+        'scenarios': scenarios,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    print(f'{"scenario":<12}{"req/s":>10}{"p50":>10}{"p95":>10}{"p99":>10}{"errors":>8}')
+    for name, result in scenarios.items():
+        print(f'{name:<12}{result["rps"]:>10.1f}{result["p50_ms"]:>8.1f}ms'
+              f'{result["p95_ms"]:>8.1f}ms{result["p99_ms"]:>8.1f}ms{result["errors"]:>8}')
+    print(f'upstream calls: {stub.calls}, errors: {stub.errors}, report: {args.output}')
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        print(f'\nchange since {baseline.get("commit") or "the baseline"}:')
+        print('\n'.join(compare(baseline, report)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Measures the latency of the home page and estimates the number of sync workers it needs.
+
+Every page is served in-process by the balance service, so a request occupies a
+single worker for its whole duration, and by Little's law the number of workers
+needed for a target throughput is `target_rps * mean_latency`. To compare with
+another commit, run the benchmark on both checkouts, or use `benchmarks.load_test`
+with `--baseline`.
+
+Usage:
+    python -m benchmarks.page_latency --users 20 --balances 50 --concurrency 8
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+import math
+import os
+import statistics
+import time
+
+import requests
+
+from app import create_test_app
+from benchmarks.common import PriceStubServer, AppServer, seed_database, percentile
+
+
+def parse_args():
+    """
+    Function that parses the command line arguments of the benchmark
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--balances', type=int, default=50, help='balances per user')
+    parser.add_argument('--coins', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--price-latency', type=float, default=0.05,
+                        help='seconds the stub price API waits before answering')
+    parser.add_argument('--target-rps', type=float, default=100)
+    return parser.parse_args()
+
+
+def login(url: str, user: int) -> requests.Session:
+    """
+    Function that logs in a seeded user
+
+    Args:
+        url(str): The root url of the app.
+        user(int): The number of the seeded user.
+
+    Returns:
+        Session: A session carrying the login cookie.
+    """
+    session = requests.Session()
+    session.post(
+        f'{url}login',
+        data={'email': f'user{user}@example.com', 'password': 'password'},
+        timeout=30
+    )
+    return session
+
+
+def main():
+    """
+    Function that runs the benchmark and prints its report
+    """
+    args = parse_args()
+    with TemporaryDirectory() as directory, PriceStubServer(args.price_latency) as stub:
+        app = create_test_app({
+            'SECRET_KEY': 'benchmark',
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directory, "bench.db")}',
+            'PRICE_API_URL': stub.url,
+            'WTF_CSRF_ENABLED': False,
+        })
+        seed_database(app, args.users, args.balances, args.coins)
+
+        with AppServer(app) as server:
+            sessions = [login(server.url, user) for user in range(1, args.users + 1)]
+
+            def timed_get(number: int) -> float:
+                start = time.perf_counter()
+                response = sessions[number % len(sessions)].get(server.url, timeout=30)
+                response.raise_for_status()
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                latencies = list(executor.map(timed_get, range(args.requests)))
+            elapsed = time.perf_counter() - start
+
+    mean = statistics.mean(latencies)
+    print(f'requests:          {args.requests} at concurrency {args.concurrency}')
+    print(f'throughput:        {args.requests / elapsed:.1f} req/s')
+    print(f'latency p50:       {percentile(latencies, 0.50) * 1000:.1f} ms')
+    print(f'latency p95:       {percentile(latencies, 0.95) * 1000:.1f} ms')
+    print(f'latency p99:       {percentile(latencies, 0.99) * 1000:.1f} ms')
+    print(f'workers needed:    {math.ceil(args.target_rps * mean)} '
+          f'for {args.target_rps:g} req/s (one worker per page)')
+
+
+if __name__ == '__main__':
+    main()
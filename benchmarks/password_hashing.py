@@ -0,0 +1,86 @@
+"""
+Measures how many logins per second a single worker can verify at each password hashing cost.
+
+Verifying a password costs as much CPU as hashing it, and a worker is busy for the whole
+verification, so the logins per second reported here are the ceiling of one sync worker
+during a login burst. Divide the expected burst rate by it to size the number of cores.
+
+Usage:
+    python -m benchmarks.password_hashing --rounds 20
+    python -m benchmarks.password_hashing --method pbkdf2:sha256:600000 --method scrypt:32768:8:1
+"""
+from argparse import ArgumentParser
+import math
+import statistics
+import time
+
+from service import passwords
+
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'argon2:2:19456:1',
+    'argon2:3:65536:4',
+]
+
+
+def parse_args():
+    """
+    Function that parses the command line arguments of the benchmark
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--method', action='append', dest='methods',
+                        help='hashing method to measure, can be repeated')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='verifications measured per method')
+    parser.add_argument('--burst', type=float, default=50,
+                        help='logins per second the cores are sized for')
+    return parser.parse_args()
+
+
+def measure(method: str, rounds: int) -> float:
+    """
+    Function that measures the median time of a password verification
+
+    Args:
+        method(str): The hashing method.
+        rounds(int): The number of verifications to measure.
+
+    Returns:
+        float: The median verification time in seconds.
+    """
+    password_hash = passwords.hash_password('password', method)
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        passwords.verify_password(password_hash, 'password')
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    """
+    Function that runs the benchmark and prints its report
+    """
+    args = parse_args()
+    methods = args.methods or DEFAULT_METHODS
+    print(f'{"method":<26}{"verify":>10}{"logins/s/worker":>18}{"cores":>8}')
+    for method in methods:
+        if method.startswith('argon2') and passwords.argon2 is None:
+            print(f'{method:<26}{"skipped, argon2-cffi is not installed":>36}')
+            continue
+        seconds = measure(method, args.rounds)
+        print(f'{method:<26}{seconds * 1000:>8.1f}ms{1 / seconds:>18.1f}'
+              f'{math.ceil(args.burst * seconds):>8}')
+    print(f'cores: needed to verify {args.burst:g} logins/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Micro-benchmarks of the portfolio valuation, per batch size and share of coins quoted
+in another currency than USDT.
+
+Compares `service.valuation.value_holdings` with the former inline valuation, which
+multiplied the price of every holding without conversion (so it only values USDT pairs
+and fails on a missing price). Both run on the same holdings and price snapshot.
+
+Usage:
+    python -m benchmarks.valuation --sizes 1000 10000 100000 --coins 200 --cross 0.25
+"""
+from argparse import ArgumentParser
+from decimal import Decimal
+from functools import partial
+import random
+import statistics
+import time
+
+from service.valuation import QUOTE_CURRENCY, required_symbols, value_holdings
+
+CROSS_QUOTES = ('BTC', 'ETH', 'BNB')
+
+
+def parse_args():
+    """
+    Function that parses the command line arguments of the benchmark
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    parser = ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                        help='numbers of holdings valued at once')
+    parser.add_argument('--coins', type=int, default=200, help='distinct coins')
+    parser.add_argument('--cross', type=float, default=0.25,
+                        help='share of the coins quoted in BTC, ETH or BNB')
+    parser.add_argument('--rounds', type=int, default=5)
+    return parser.parse_args()
+
+
+def make_snapshot(coins: int, cross: float, rng: random.Random) -> tuple:
+    """
+    Function that builds coin indexes and a price snapshot of them
+
+    Args:
+        coins(int): The number of distinct coins.
+        cross(float): The share of the coins quoted in another currency than USDT.
+        rng(Random): The random generator.
+
+    Returns:
+        tuple: The coin indexes and the price snapshot, which has the prices of the
+        bridge currencies too.
+    """
+    indexes = [
+        f'C{number}{rng.choice(CROSS_QUOTES) if rng.random() < cross else QUOTE_CURRENCY}'
+        for number in range(coins)
+    ]
+    prices = {
+        symbol: Decimal(rng.randint(1, 10 ** 12)).scaleb(-8)
+        for symbol in required_symbols(indexes)
+    }
+    return indexes, prices
+
+
+def inline_valuation(holdings: list, prices: dict) -> Decimal:
+    """
+    Function that values holdings like the code before the valuation module
+    """
+    return sum(prices[index] * amount for index, amount in holdings)
+
+
+def measure(function, rounds: int) -> float:
+    """
+    Function that measures the median time of a call
+
+    Args:
+        function: The function to call without arguments.
+        rounds(int): The number of calls to measure.
+
+    Returns:
+        float: The median time in seconds.
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    """
+    Function that runs the benchmarks and prints their report
+    """
+    args = parse_args()
+    rng = random.Random(42)
+    indexes, prices = make_snapshot(args.coins, args.cross, rng)
+    usdt_indexes = [index for index in indexes if index.endswith(QUOTE_CURRENCY)]
+
+    print(f'{args.coins} coins, {args.cross:.0%} quoted in {"/".join(CROSS_QUOTES)}')
+    print(f'{"":>10}{"valuation":>14}{"valuation":>14}{"inline":>14}')
+    print(f'{"holdings":>10}{"mixed quotes":>14}{"USDT only":>14}{"USDT only":>14}'
+          f'{"per holding":>14}')
+    for size in args.sizes:
+        amounts = [Decimal(rng.randint(1, 10 ** 12)).scaleb(-7) for _ in range(size)]
+        holdings = [(rng.choice(indexes), amount) for amount in amounts]
+        usdt_holdings = [(rng.choice(usdt_indexes), amount) for amount in amounts]
+
+        mixed = measure(partial(value_holdings, holdings, prices), args.rounds)
+        valued = measure(partial(value_holdings, usdt_holdings, prices), args.rounds)
+        inline = measure(partial(inline_valuation, usdt_holdings, prices), args.rounds)
+        print(f'{size:>10}{mixed * 1000:>12.2f}ms{valued * 1000:>12.2f}ms'
+              f'{inline * 1000:>12.2f}ms{mixed / size * 1e6:>12.2f}us')
+
+
+if __name__ == '__main__':
+    main()
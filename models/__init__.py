@@ -2,10 +2,26 @@ from datetime import datetime
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 
+from service import passwords
+from service.database import RoutingSession
 
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def format_amount(amount) -> str:
+    """
+    Function that formats a coin amount without trailing zeros
+
+    Args:
+        amount (decimal): The amount to format.
+
+    Returns:
+        str: The amount with up to 7 digits after the decimal point.
+    """
+    amount = f"{amount:.7f}".rstrip('0')
+    return amount.rstrip('.') if amount.endswith('.') else amount
 
 
 class User(db.Model, UserMixin):
@@ -43,22 +59,21 @@ class User(db.Model, UserMixin):
         Function that generates a hashed password for user
 
         This function generates a secure hashed password using the provided password and the
-        'sha256' algorithm. The hashed password is then stored in the user object's 'password_hash'
-        attribute.
+        method of the `PASSWORD_HASH_METHOD` setting. The hashed password is then stored in the
+        user object's 'password_hash' attribute.
 
         Args:
             password (str): The plaintext password to hash.
         """
 
-        self.password_hash = generate_password_hash(password, 'sha256')
+        self.password_hash = passwords.hash_password(password)
 
     def verify_password(self, password):
         """
         Function that verify a user's password
 
         This function checks whether the provided password matches the hashed password stored in
-        the user object's 'password_hash' attribute. It uses the 'check_password_hash' function from
-        the Flask-Bcrypt library to perform the verification.
+        the user object's 'password_hash' attribute, whatever method it was hashed with.
 
         Args:
             password (str): The plaintext password to verify.
@@ -67,7 +82,20 @@ class User(db.Model, UserMixin):
             bool: True if the password is correct, False otherwise.
         """
 
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify_password(self.password_hash, password)
+
+    def needs_rehash(self):
+        """
+        Function that checks whether the user's password hash is outdated
+
+        A hash is outdated when it was made with another method or cost than
+        the `PASSWORD_HASH_METHOD` setting.
+
+        Returns:
+            bool: True if the password should be hashed again on the next login.
+        """
+
+        return passwords.needs_rehash(self.password_hash)
 
     def to_dict(self):
         """
@@ -104,6 +132,8 @@ class Coin(db.Model):  # pylint: disable=too-few-public-methods
         balances (One-to-Many): Defines a one-to-many relationship between the `Coin`
         model and the `Balance` model. This relationship allows a cryptocurrency to
         have multiple balance objects associated with it.
+        price_ticks (One-to-Many): Defines a dynamic one-to-many relationship between the
+        `Coin` model and the `PriceTick` model, the price history of the cryptocurrency.
 
     """
 
@@ -112,6 +142,7 @@ class Coin(db.Model):  # pylint: disable=too-few-public-methods
     abbreviation = db.Column(db.String(30))
 
     balances = db.relationship('Balance', backref='coin')
+    price_ticks = db.relationship('PriceTick', backref='coin', lazy='dynamic')
 
     def to_dict(self):
         """
@@ -148,8 +179,17 @@ class Balance(db.Model):  # pylint: disable=too-few-public-methods
         coin_id (int): A foreign key to the `Coin` model, indicating which coin the balance
         is associated with.
 
+    Indexes:
+        (`user_id`, `date_added`) serves the listings of a user's balances by date range,
+        and `coin_id` the lookups of the balances of a coin.
+
     """
 
+    __table_args__ = (
+        db.Index('ix_balance_user_id_date_added', 'user_id', 'date_added'),
+        db.Index('ix_balance_coin_id', 'coin_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.DECIMAL(15, 7))
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
@@ -167,11 +207,184 @@ class Balance(db.Model):  # pylint: disable=too-few-public-methods
         Returns:
             dict: a dictionary representation of the balance object.
         """
-        # amount = "{:.7f}".format(self.amount).rstrip('0')
-        amount = f"{self.amount:.7f}".rstrip('0')
         return {
             'id': self.id,
             'user': self.user_id,
             'coin': self.coin.abbreviation,
-            'amount': amount.rstrip('.') if amount.endswith('.') else amount,
+            'amount': format_amount(self.amount),
+        }
+
+
+class Trade(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Defines a SQLAlchemy model for an entry of the trade ledger.
+
+    The ledger is append-only: trades are never updated or deleted, a mistake is
+    corrected with an opposite trade. Every trade moves the `Position` of its user
+    and coin in the transaction that records it.
+
+    Attributes:
+        id (int): The primary key for the trade, increasing with the order of the trades.
+        kind (str): Either 'buy', 'sell', 'transfer_in' or 'transfer_out'.
+        quantity (decimal): The traded amount of the coin, always positive.
+        price (decimal): The price of one unit in the quote currency of the coin,
+            None for transfers.
+        timestamp (datetime): The date and time of the trade (UTC).
+
+    Foreign Keys:
+        user_id (int): A foreign key to the `User` model, indicating which user account
+        the trade is associated with.
+        coin_id (int): A foreign key to the `Coin` model, indicating which coin was traded.
+
+    Indexes:
+        (`user_id`, `timestamp`) serves the listings of a user's trades by date range.
+
+    """
+
+    __table_args__ = (
+        db.Index('ix_trade_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(12), nullable=False)
+    quantity = db.Column(db.DECIMAL(15, 7), nullable=False)
+    price = db.Column(db.DECIMAL(24, 8))
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id'), nullable=False)
+
+    def to_dict(self):
+        """
+        Function that converts the trade object to a dictionary
+
+        Returns:
+            dict: a dictionary representation of the trade object.
+        """
+
+        return {
+            'id': self.id,
+            'user': self.user_id,
+            'coin_id': self.coin_id,
+            'kind': self.kind,
+            'quantity': format_amount(self.quantity),
+            'price': None if self.price is None else str(self.price),
+            'timestamp': self.timestamp.isoformat(),
+        }
+
+
+class Position(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Defines a SQLAlchemy model for the current amount of a coin held by a user.
+
+    Positions are derived from the trade ledger: every trade updates one position in
+    its own transaction, so the holdings of a user are read from one row per coin
+    instead of being summed over the whole history. `flask ledger rebuild` recomputes
+    them from the ledger.
+
+    Attributes:
+        id (int): The primary key for the position.
+        quantity (decimal): The amount of the coin held.
+        last_trade_id (int): The ID of the last trade applied to the position.
+        updated_at (datetime): The date and time the position last changed (UTC).
+
+    Foreign Keys:
+        user_id (int): A foreign key to the `User` model, indicating which user account
+        the position is associated with.
+        coin_id (int): A foreign key to the `Coin` model, indicating which coin is held.
+
+    Indexes:
+        The unique (`user_id`, `coin_id`) constraint serves the listings of a user's
+        positions.
+
+    """
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'coin_id', name='uq_position_user_id_coin_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.DECIMAL(22, 7), nullable=False, default=0)
+    last_trade_id = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id'), nullable=False)
+
+
+class PriceTick(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Defines a SQLAlchemy model for a historical coin price.
+
+    This model defines the price of a coin at a point in time. Ticks are looked up by
+    coin and time range, which the composite index on (`coin_id`, `timestamp`) serves.
+
+    Attributes:
+        id (int): The primary key for the price tick.
+        timestamp (datetime): The date and time the price was observed at (UTC).
+        price (decimal): The price of the coin in its quote currency.
+
+    Foreign Keys:
+        coin_id (int): A foreign key to the `Coin` model, indicating which coin the price
+        is associated with.
+
+    """
+
+    __table_args__ = (
+        db.Index('ix_price_tick_coin_id_timestamp', 'coin_id', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    price = db.Column(db.DECIMAL(24, 8), nullable=False)
+
+    def to_dict(self):
+        """
+        Function that converts the price tick object to a dictionary
+
+        Returns:
+            dict: a dictionary representation of the price tick object.
+        """
+
+        return {
+            'coin_id': self.coin_id,
+            'timestamp': self.timestamp.isoformat(),
+            'price': str(self.price),
         }
+
+
+class PortfolioSnapshot(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Defines a SQLAlchemy model for the value of a user's portfolio at the end of a day.
+
+    Snapshots are computed by the daily rollup (`flask snapshots rollup`) from the
+    balances and price ticks, so history charts read one row per day.
+
+    Attributes:
+        id (int): The primary key for the snapshot.
+        day (date): The day whose closing value the snapshot holds (UTC).
+        value (decimal): The value of the balances added before the end of the day, at
+            the last price of their coins before the end of the day.
+        computed_at (datetime): The date and time the snapshot was computed at (UTC).
+
+    Foreign Keys:
+        user_id (int): A foreign key to the `User` model, indicating which user account
+        the snapshot is associated with.
+
+    Indexes:
+        The unique (`user_id`, `day`) constraint serves the listings of a user's
+        snapshots by date range.
+
+    """
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', name='uq_portfolio_snapshot_user_id_day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    value = db.Column(db.DECIMAL(24, 2), nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
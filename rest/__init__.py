@@ -1,14 +1,61 @@
-from decimal import Decimal
-import requests
+from datetime import datetime, timedelta
+from io import TextIOWrapper
+import json
 
-from flask import request, current_app
+from flask import request, current_app, Response, stream_with_context
 from flask_restful import Resource, Api, abort
 
-from models import User, Coin, Balance
-from models import db
+from service import users as user_service
+from service import coins as coin_service
+from service import balances as balance_service
+from service import bulk as bulk_service
+from service import history as history_service
+from service import ledger as ledger_service
+from service import portfolio as portfolio_service
+from service import snapshots as snapshot_service
+from service import stream as stream_service
+from service.database import read_replica
 
 
-api = Api()
+def init_api(app):
+    """
+    Function that registers the REST API resources on an app
+
+    A new `Api` is created for every app, so that several apps can live
+    in the same process (e.g. in tests and benchmarks).
+
+    Args:
+        app: The Flask app to register the resources on.
+
+    Returns:
+        Api: The API of the app.
+    """
+    api = Api(app)
+    api.add_resource(UserApi, '/api/v1/users', '/api/v1/users/<int:id>')
+    api.add_resource(CoinApi, '/api/v1/coins')
+    api.add_resource(PriceHistoryApi, '/api/v1/coins/<int:id>/history')
+    api.add_resource(BalanceApi, '/api/v1/balances', '/api/v1/balances/<int:id>')
+    api.add_resource(BulkBalanceApi, '/api/v1/balances/bulk')
+    api.add_resource(HoldingsApi, '/api/v1/balances/<int:id>/holdings')
+    api.add_resource(PortfolioStreamApi, '/api/v1/balances/<int:id>/stream')
+    api.add_resource(PortfolioHistoryApi, '/api/v1/portfolio/<int:id>/history')
+    api.add_resource(PortfolioSnapshotApi, '/api/v1/portfolio/<int:id>/daily')
+    api.add_resource(TradeApi, '/api/v1/trades', '/api/v1/trades/<int:id>')
+    api.add_resource(PositionApi, '/api/v1/positions/<int:id>')
+    return api
+
+
+def request_args() -> dict:
+    """
+    Function that collects the arguments of the current request
+
+    Query string arguments are merged with the JSON body, if any, so that
+    GET requests can be parametrised either way.
+
+    Returns:
+        dict: The request arguments.
+    """
+    return {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
 
 
 class UserApi(Resource):
@@ -47,7 +94,7 @@ class UserApi(Resource):
         """
 
         response = {}
-        user = User.query.get(id)
+        user = user_service.get_user(id)
         if user:
             response = user.to_dict()
         return {'user': response}, 200
@@ -80,8 +127,8 @@ class UserApi(Resource):
 
         """
 
-        current_app.logger.info(f"REST - Login request start with for "
-                                f"email: {request.json.get('email')}")
+        current_app.logger.info("REST - Login request start with for email: %s",
+                                request.json.get('email'))
 
         email = request.json.get('email')
         password = request.json.get('password')
@@ -89,24 +136,62 @@ class UserApi(Resource):
             current_app.logger.info("REST - Failed missing arguments")
             abort(422)  # missing arguments
 
-        if User.query.filter_by(email=email).first() is not None:
-            current_app.logger.info(f"REST - User found for email {email}")
-            user = User.query.filter_by(email=email).first()
-            if user.verify_password(password):
-                current_app.logger.info("REST - User password OK")
-                return {'email': user.email}, 200, \
-                    {'Location': f"{request.url_root}api/v1/users/{user.id}"}
-
+        user, created = user_service.login_or_register(email, password)
+        if user is None:
             current_app.logger.info("REST - User password FAIL")
             abort(401)  # wrong password
 
-        user = User(email=email)
-        user.hash_password(password)
-        db.session.add(user)
-        db.session.commit()
-
         current_app.logger.info("REST - Login request end")
-        return {'email': user.email}, 201, {'Location': f"{request.url_root}api/v1/users/{user.id}"}
+        return {'email': user.email}, 201 if created else 200, \
+            {'Location': user_service.user_url(user.id)}
+
+
+def parse_datetime(value: str):
+    """
+    Function that parses an ISO 8601 date or date and time request argument
+
+    Args:
+        value(str): The argument value, if any.
+
+    Returns:
+        datetime: The parsed value, or None if the argument is empty.
+
+    Raises:
+        werkzeug.exceptions.BadRequest: If the value is not an ISO 8601 date.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return abort(400, message=f"Invalid date '{value}'")
+
+
+def parse_int(value, name: str, minimum: int = None, maximum: int = None):
+    """
+    Function that parses an integer request argument
+
+    Args:
+        value: The argument value, if any.
+        name(str): The name of the argument, for the error message.
+        minimum(int): The smallest accepted value, if any.
+        maximum(int): The greatest accepted value, if any.
+
+    Returns:
+        int: The parsed value, or None if the argument is empty.
+
+    Raises:
+        werkzeug.exceptions.BadRequest: If the value is not an integer within bounds.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return abort(400, message=f"'{name}' must be an integer")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        return abort(400, message=f"'{name}' must be between {minimum} and {maximum}")
+    return value
 
 
 class CoinApi(Resource):
@@ -124,25 +209,258 @@ class CoinApi(Resource):
         get().
     """
 
+    @read_replica()
     def get(self):
         """
-        Retrieves a list of all coins in the database
+        Retrieves a list of all coins from the coin catalog
+
+        The catalog is loaded from the read replica, if one is configured.
+
+        The response carries an ETag of the coins, the time they last changed
+        and a public Cache-Control max-age, so clients and proxies can reuse it
+        and revalidate it with 'If-None-Match' or 'If-Modified-Since', which are
+        answered with an empty 304 response while the coins are unchanged.
 
         Args:
             None
 
         Returns:
-            A tuple containing a list of coin dictionaries and HTTP status code.
+            A response with a list of coin dictionaries.
             Each dictionary represents a coin and contains the following keys:
             - id: The coin's unique identifier.
-            - name: The coin's name.
-            - symbol: The coin's symbol.
-            - price: The current price of the coin.
+            - abbreviation: The coin's abbreviation.
+
+        """
+
+        catalog = coin_service.coin_catalog.snapshot()
+        response = current_app.response_class(
+            json.dumps([coin.to_dict() for coin in catalog.coins]),
+            mimetype='application/json',
+        )
+        response.set_etag(catalog.etag)
+        response.last_modified = catalog.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['COIN_CACHE_MAX_AGE']
+        return response.make_conditional(request)
+
+
+class PriceHistoryApi(Resource):
+    """
+    Defines an API resource for retrieving the price history of a coin.
+
+    The stored price ticks of the coin are downsampled into OHLC candles
+    of a minute, an hour or a day.
+
+    Attributes:
+        None
+
+    Methods:
+        get().
+    """
+
+    def get(self, id: int = None):
+        """
+        Retrieves the OHLC price series of the coin with the specified ID
+
+        Args:
+            id(int): The ID of the coin.
+
+        Returns:
+            A tuple containing a list of candle dictionaries and HTTP status code.
+            Each dictionary contains the following keys:
+            - time: The ISO 8601 start of the candle.
+            - open, high, low, close: The prices of the candle, as strings.
+
+            The 'interval' ('minute', 'hour' or 'day'), 'from_date' and 'to_date'
+            request arguments select the candle size and time range.
+
+            The response status code is 400 if an argument is invalid.
+        """
+        args = request_args()
+        try:
+            series = history_service.ohlc(
+                id,
+                interval=args.get('interval', 'hour'),
+                from_date=parse_datetime(args.get('from_date')),
+                to_date=parse_datetime(args.get('to_date')),
+            )
+        except ValueError as error:
+            abort(400, message=str(error))
+        return [
+            {
+                'time': candle['time'].isoformat(),
+                **{key: str(candle[key]) for key in ('open', 'high', 'low', 'close')},
+            }
+            for candle in series
+        ], 200
+
+
+class HoldingsApi(Resource):
+    """
+    Defines an API resource for retrieving the holdings of a user per coin.
+
+    Attributes:
+        None
+
+    Methods:
+        get().
+    """
+
+    @read_replica()
+    def get(self, id: int = None):
+        """
+        Retrieves the balances of the user with the specified ID summed per coin,
+        optionally filtered by date range, from the read replica if one is configured
+
+        Args:
+            id(int): The ID of the user.
+
+        Returns:
+            A tuple containing a dictionary and HTTP status code.
+            The dictionary contains the following keys:
+            - holdings: A list of dictionaries with the following keys, one per coin:
+              * coin_id (int): The ID of the coin.
+              * coin (str): The abbreviation of the coin.
+              * amount (str): The total amount of the coin.
+              * balances (int): The number of balances of the coin.
+              * value (str): The value of the total amount at the latest price.
+            - total: The total value of the holdings.
+
+            If 'from_date' and/or 'to_date' parameters are provided, only the
+            balances added within the date range are summed.
+        """
+        args = request_args()
+        return balance_service.list_holdings(
+            id,
+            from_date=args.get('from_date'),
+            to_date=args.get('to_date'),
+        ), 200
+
+
+class PortfolioHistoryApi(Resource):
+    """
+    Defines an API resource for retrieving the value of a user's portfolio over time.
+
+    Attributes:
+        None
+
+    Methods:
+        get().
+    """
+
+    def get(self, id: int = None):
+        """
+        Retrieves the total value of the portfolio of the user with the specified ID
+        as a time series
+
+        Args:
+            id(int): The ID of the user.
+
+        Returns:
+            A tuple containing a list of point dictionaries and HTTP status code.
+            Each dictionary contains the following keys:
+            - time: The ISO 8601 time of the point.
+            - value: The total value of the balances added up to that time, valued
+              at the last stored price of their coins.
+
+            The 'from_date' and 'to_date' request arguments select the range, the last
+            30 days by default, and 'interval' ('minute', 'hour' or 'day') the distance
+            between two points, an hour by default.
+
+            The response status code is 400 if an argument is invalid.
+        """
+        args = request_args()
+        to_date = parse_datetime(args.get('to_date')) or datetime.utcnow()
+        from_date = parse_datetime(args.get('from_date')) or to_date - timedelta(days=30)
+        try:
+            series = portfolio_service.value_history(
+                id, from_date, to_date, interval=args.get('interval', 'hour')
+            )
+        except ValueError as error:
+            abort(400, message=str(error))
+        return [{'time': time.isoformat(), 'value': value} for time, value in series], 200
+
+
+class PortfolioSnapshotApi(Resource):
+    """
+    Defines an API resource for retrieving the daily closing value of a user's portfolio.
+
+    Attributes:
+        None
+
+    Methods:
+        get().
+    """
+
+    @read_replica()
+    def get(self, id: int = None):
+        """
+        Retrieves the precomputed daily snapshots of the portfolio of the user with the
+        specified ID, from the read replica if one is configured
+
+        Args:
+            id(int): The ID of the user.
+
+        Returns:
+            A tuple containing a list of point dictionaries and HTTP status code.
+            Each dictionary contains the following keys:
+            - day: The ISO 8601 date of the point.
+            - value: The value of the balances added before the end of the day, at the
+              last stored price of their coins before the end of the day.
 
+            The 'from_date' and 'to_date' request arguments select the days, the last
+            365 days by default. Days that were not rolled up yet are missing.
         """
+        args = request_args()
+        to_date = parse_datetime(args.get('to_date')) or datetime.utcnow()
+        from_date = parse_datetime(args.get('from_date')) or to_date - timedelta(days=365)
+        series = snapshot_service.snapshot_history(id, from_date.date(), to_date.date())
+        return [{'day': day.isoformat(), 'value': str(value)} for day, value in series], 200
+
+
+class PortfolioStreamApi(Resource):
+    """
+    Defines an API resource for pushing the valued holdings of a user as
+    Server-Sent Events.
+
+    Attributes:
+        None
 
-        coins = Coin.query.all()
-        return [coin.to_dict() for coin in coins], 200
+    Methods:
+        get().
+    """
+
+    def get(self, id: int = None):
+        """
+        Streams the holdings of the user with the specified ID, valued at the
+        latest prices, as 'portfolio' events
+
+        An event is sent on connect and whenever the price of a held coin or the
+        holdings of the user change. The prices of every open stream of a worker
+        come from a single shared price source.
+
+        Args:
+            id(int): The ID of the user.
+
+        Returns:
+            A 'text/event-stream' response. The data of every event is a JSON
+            object with the following keys:
+            - prices: The latest price of every held coin, by coin abbreviation.
+            - holdings: The holdings of the user per coin, like the holdings resource,
+              with a null value for coins without a known price.
+            - total: The total value of the holdings.
+        """
+        current_app.logger.info("REST - Portfolio stream of user '%s' opened", id)
+        events = stream_service.stream_portfolio(
+            id,
+            heartbeat=current_app.config['PRICE_STREAM_HEARTBEAT'],
+            reload=current_app.config['PRICE_STREAM_RELOAD'],
+        )
+        return Response(
+            stream_with_context(events),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
 
 
 class BalanceApi(Resource):
@@ -159,10 +477,11 @@ class BalanceApi(Resource):
     Methods:
         get(), post(), put(), delete().
     """
+    @read_replica()
     def get(self, id: int = None):
         """
         This function gets the balances for a user with the specified id,
-        optionally filtered by date range.
+        optionally filtered by date range, from the read replica if one is configured.
 
         Args:
             id(int): The id of the user whose balances to retrieve
@@ -183,37 +502,39 @@ class BalanceApi(Resource):
             latest price for the coins in the balances from Binance API
             and calculates the total value of each balance using these prices.
 
+            If a 'limit' (1 to 1000) and/or 'cursor' parameter is provided, a single
+            page of balances ordered by id is returned, starting after the balance
+            whose id is the cursor. The cursor of the next page is returned in the
+            'X-Next-Cursor' header, which is missing on the last page.
+
+            If the 'stream' parameter is '1', every balance is streamed as JSON lines
+            ('application/x-ndjson') from a server-side cursor instead.
+
             The response status code is 200 if balances are found
             and status code is 404 if not.
 
         """
-        from_date = request.json.get('from_date')
-        to_date = request.json.get('to_date')
-
-        balances = Balance.query.filter(Balance.user_id == id)
-        if from_date:
-            balances = balances.filter(Balance.date_added >= from_date)
-        if to_date:
-            balances = balances.filter(Balance.date_added <= to_date)
-
-        coind_indexes = "%22,%22".join({balance.coin.index for balance in balances})
-        if coind_indexes == '':
-            return []
-        binance_api_url = f"https://www.binance.me/api/v3/ticker/price" \
-                          f"?symbols=%5B%22{coind_indexes}%22%5D"
-        indexes = requests.get(binance_api_url, timeout=5).json()
-        prices = {index['symbol']: Decimal(index['price']) for index in indexes}
-
-        response = []
-        for balance in balances:
-            price = prices[balance.coin.index]
-            response.append(
-                {
-                    **balance.to_dict(),
-                    # 'value': '{:,.2f}'.format(price * balance.amount),
-                    'value': f'{price * balance.amount:,.2f}'
-                }
+        args = request_args()
+        from_date = args.get('from_date')
+        to_date = args.get('to_date')
+
+        if str(args.get('stream')) in ('1', 'true', 'True'):
+            balances = balance_service.stream_balances(id, from_date=from_date, to_date=to_date)
+            lines = (json.dumps(balance) + '\n' for balance in balances)
+            return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+        if 'limit' in args or 'cursor' in args:
+            balances, next_cursor = balance_service.page_balances(
+                id,
+                from_date=from_date,
+                to_date=to_date,
+                cursor=parse_int(args.get('cursor'), 'cursor'),
+                limit=parse_int(args.get('limit'), 'limit', 1, 1000) or 100,
             )
+            headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+            return balances, 200, headers
+
+        response = balance_service.list_balances(id, from_date=from_date, to_date=to_date)
         return response, 200
 
     def delete(self, id: int = None):
@@ -231,8 +552,8 @@ class BalanceApi(Resource):
             The response status code is 204 if the balances was deleted
             and 404 if balance with specified id was not found.
         """
-        Balance.query.filter_by(id=id).delete()
-        db.session.commit()
+        if not balance_service.delete_balance(id):
+            abort(404)
         return {}, 204
 
     def put(self, id: int = None):
@@ -253,11 +574,13 @@ class BalanceApi(Resource):
             The response status code is 204 if the balances was updated
             and 404 if balance with specified id was not found.
         """
-        balance = Balance.query.get(id)
-        balance.amount = Decimal(request.json.get('amount'))
-        balance.coin_id = request.json.get('coin_id')
-        db.session.add(balance)
-        db.session.commit()
+        balance = balance_service.update_balance(
+            id,
+            coin_id=request.json.get('coin_id'),
+            amount=request.json.get('amount'),
+        )
+        if balance is None:
+            abort(404)
         return balance.to_dict(), 201
 
     def post(self):
@@ -289,12 +612,199 @@ class BalanceApi(Resource):
             current_app.logger.info("REST - Failed missing arguments")
             abort(422)  # missing arguments
 
-        balance = Balance(
-            amount=Decimal(amount),
-            user_id=user_id,
-            coin_id=coin_id,
+        balance_service.create_balance(user_id, coin_id, amount)
+        return {}, 201
+
+
+class BulkBalanceApi(Resource):
+    """
+    Defines an API resource for importing and exporting balances in bulk.
+
+    Balances are imported from and exported to CSV (with a header line) or
+    JSON Lines, both streamed, with the columns 'user_id', 'coin_id', 'coin',
+    'amount' and 'date_added'.
+
+    Attributes:
+        None
+
+    Methods:
+        get(), post().
+    """
+    def get(self):
+        """
+        This function streams every balance of a user in the import format.
+
+        The user is given by the 'user_id' parameter, and the format by the
+        'format' parameter, 'csv' (the default) or 'jsonl'.
+
+        Returns:
+            A streamed response of the balances of the user, in id order.
+        """
+        args = request_args()
+        user_id = parse_int(args.get('user_id'), 'user_id')
+        if user_id is None:
+            abort(400, message="'user_id' is required")
+        fmt = args.get('format', 'csv')
+        if fmt not in bulk_service.MEDIA_TYPES:
+            abort(400, message=f"Unsupported format '{fmt}'")
+
+        lines = bulk_service.export_balances(user_id, fmt)
+        return Response(
+            stream_with_context(lines),
+            mimetype=bulk_service.MEDIA_TYPES[fmt],
+            headers={'Content-Disposition': f'attachment; filename=balances-{user_id}.{fmt}'},
         )
-        db.session.add(balance)
-        db.session.commit()
 
-        return {}, 201
+    def post(self):
+        """
+        This function imports balances from the request body.
+
+        The body is read as a stream in the format given by the 'format'
+        parameter or else by the Content-Type header ('text/csv' or
+        'application/x-ndjson'). Rows are validated with the same rules as the
+        balance form, and the valid ones are inserted in batched transactions of
+        `BALANCES_IMPORT_BATCH_SIZE` rows. The rows without a 'user_id' belong
+        to the user given by the 'user_id' parameter, if any.
+
+        Returns:
+            Tuple containing a dictionary and HTTP status code.
+
+            The dictionary holds the number of 'imported' balances, the number of
+            'failed' rows and the 'errors' of the first invalid rows with their line.
+            The response status code is 201 if any balance was imported, 422 if
+            every row was invalid and 200 if the body was empty.
+        """
+        fmt = request.args.get('format') or next(
+            (name for name, mimetype in bulk_service.MEDIA_TYPES.items()
+             if mimetype == request.mimetype),
+            'jsonl' if request.mimetype == 'application/jsonl' else None
+        )
+        if fmt not in bulk_service.READERS:
+            abort(415, message="Balances can be imported from 'text/csv' or "
+                               "'application/x-ndjson' bodies")
+
+        current_app.logger.info("REST - Bulk balance import started")
+        lines = TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        result = bulk_service.import_balances(
+            bulk_service.READERS[fmt](lines),
+            user_id=parse_int(request.args.get('user_id'), 'user_id'),
+            batch_size=current_app.config['BALANCES_IMPORT_BATCH_SIZE'],
+        )
+        current_app.logger.info(
+            "REST - Bulk balance import ended, %s imported, %s failed",
+            result['imported'], result['failed']
+        )
+        if result['imported']:
+            return result, 201
+        return result, 422 if result['failed'] else 200
+
+
+class TradeApi(Resource):
+    """
+    Defines an API resource for recording and listing the trades of the ledger.
+
+    The ledger is append-only, so trades can't be updated or deleted; a mistake
+    is corrected with an opposite trade.
+
+    Attributes:
+        None
+
+    Methods:
+        get(), post().
+    """
+
+    @read_replica()
+    def get(self, id: int = None):
+        """
+        This function gets a page of the trades of the user with the specified id,
+        from the read replica if one is configured.
+
+        Args:
+            id(int): The id of the user whose trades to retrieve.
+
+        Returns:
+            Tuple containing a list of trade dictionaries in ledger order, the HTTP
+            status code and headers. Each dictionary contains the 'id', 'user',
+            'coin_id', 'kind', 'quantity', 'price' and 'timestamp' keys.
+
+            Pages hold up to 'limit' (1 to 1000, 100 by default) trades, starting after
+            the trade whose id is the 'cursor'. The cursor of the next page is returned
+            in the 'X-Next-Cursor' header, which is missing on the last page.
+        """
+        args = request_args()
+        trades, next_cursor = ledger_service.list_trades(
+            id,
+            cursor=parse_int(args.get('cursor'), 'cursor'),
+            limit=parse_int(args.get('limit'), 'limit', 1, 1000) or 100,
+        )
+        headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+        return trades, 200, headers
+
+    def post(self):
+        """
+        This function records a trade and updates the position of its user and coin.
+
+        The request JSON data must include the 'user_id', 'coin_id', 'kind' ('buy',
+        'sell', 'transfer_in' or 'transfer_out') and 'quantity' fields, and a 'price'
+        for buys and sells, or a 422 Unprocessable Entity response will be returned.
+        An optional 'timestamp' (ISO 8601, UTC) dates the trade.
+
+        Returns:
+            Tuple containing the trade dictionary and HTTP status code.
+
+            The response status code is 201 if the trade was recorded and 400 if it is
+            invalid or takes more than the user holds.
+        """
+        args = request.get_json(silent=True) or {}
+        if any(args.get(key) is None for key in ('user_id', 'coin_id', 'kind', 'quantity')):
+            current_app.logger.info("REST - Failed missing arguments")
+            abort(422)  # missing arguments
+
+        try:
+            trade = ledger_service.record_trade(
+                args['user_id'],
+                args['coin_id'],
+                args['kind'],
+                args['quantity'],
+                price=args.get('price'),
+                timestamp=parse_datetime(args.get('timestamp')),
+            )
+        except ValueError as error:
+            abort(400, message=str(error))
+        return trade.to_dict(), 201
+
+
+class PositionApi(Resource):
+    """
+    Defines an API resource for retrieving the current positions of a user.
+
+    Attributes:
+        None
+
+    Methods:
+        get().
+    """
+
+    @read_replica()
+    def get(self, id: int = None):
+        """
+        Retrieves the open positions of the user with the specified ID, from the read
+        replica if one is configured
+
+        Positions are maintained with every trade, so this reads one row per coin
+        held however long the trade history is.
+
+        Args:
+            id(int): The ID of the user.
+
+        Returns:
+            A tuple containing a dictionary and HTTP status code.
+            The dictionary contains the following keys:
+            - positions: A list of dictionaries with the following keys, one per coin:
+              * coin_id (int): The ID of the coin.
+              * coin (str): The abbreviation of the coin.
+              * quantity (str): The amount of the coin held.
+              * value (str): The value of the amount at the latest price.
+            - total: The total value of the positions.
+        """
+        return ledger_service.list_positions(id), 200
@@ -0,0 +1,331 @@
+"""
+Async (ASGI) variant of the REST API.
+
+It serves the `/api/v1/users`, `/api/v1/coins` and `/api/v1/balances` routes of the
+Flask-RESTful API with the same requests and responses, on Starlette, async SQLAlchemy
+and a pooled `httpx.AsyncClient`. A request waiting for the price API or the database
+only holds a coroutine, so a single process serves hundreds of concurrent slow requests.
+
+Needs the 'asgi' extra: `pip install CRYPTEX[asgi]`.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+import asyncio
+import logging
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.endpoints import HTTPEndpoint
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from service import aio
+from service.database import engine_options
+from service.prices import price_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+async def request_args(request) -> dict:
+    """
+    Function that collects the arguments of a request
+
+    Query string arguments are merged with the JSON body, if any, so that
+    GET requests can be parametrised either way.
+
+    Args:
+        request: The Starlette request.
+
+    Returns:
+        dict: The request arguments.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    return {**request.query_params, **(body if isinstance(body, dict) else {})}
+
+
+def parse_datetime(value: str):
+    """
+    Function that parses an ISO 8601 date or date and time request argument
+
+    Args:
+        value(str): The argument value, if any.
+
+    Returns:
+        datetime: The parsed value, or None if the argument is empty.
+
+    Raises:
+        HTTPException: If the value is not an ISO 8601 date.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(400, f"Invalid date '{value}'") from None
+
+
+def parse_int(value, name: str, minimum: int = None, maximum: int = None):
+    """
+    Function that parses an integer request argument
+
+    Args:
+        value: The argument value, if any.
+        name(str): The name of the argument, for the error message.
+        minimum(int): The smallest accepted value, if any.
+        maximum(int): The greatest accepted value, if any.
+
+    Returns:
+        int: The parsed value, or None if the argument is empty.
+
+    Raises:
+        HTTPException: If the value is not an integer within bounds.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(400, f"'{name}' must be an integer") from None
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise HTTPException(400, f"'{name}' must be between {minimum} and {maximum}")
+    return value
+
+
+async def http_error(request, error):  # pylint: disable=unused-argument
+    """
+    Function that renders HTTP errors as JSON, like Flask-RESTful does
+
+    Args:
+        request: The Starlette request.
+        error(HTTPException): The raised error.
+
+    Returns:
+        JSONResponse: The error response.
+    """
+    return JSONResponse({'message': error.detail}, error.status_code, headers=error.headers)
+
+
+class UserEndpoint(HTTPEndpoint):
+    """
+    Defines an async API endpoint for getting, logging in and registering users,
+    see `rest.UserApi`.
+    """
+
+    async def get(self, request):
+        """
+        This function gets a user by ID
+
+        Returns:
+            JSONResponse: The user dictionary, empty if no user is found.
+        """
+        async with request.app.state.sessions() as session:
+            user = await aio.get_user(session, request.path_params.get('id'))
+            return JSONResponse({'user': user.to_dict() if user else {}})
+
+    async def post(self, request):
+        """
+        This function logs in an existing user or registers a new one
+
+        Returns:
+            JSONResponse: The email of the user, with status code 201 if the user was
+            created and 200 otherwise, and the url of the user in the Location header.
+
+        Raises:
+            HTTPException: 422 if the email or password are missing, 401 if the
+            password is wrong.
+        """
+        args = await request_args(request)
+        email, password = args.get('email'), args.get('password')
+        logger.info("REST - Login request start with for email: %s", email)
+        if email is None or password is None:
+            raise HTTPException(422)
+
+        async with request.app.state.sessions() as session:
+            user, created = await aio.login_or_register(
+                session, email, password, request.app.state.config['PASSWORD_HASH_METHOD']
+            )
+            if user is None:
+                logger.info("REST - User password FAIL")
+                raise HTTPException(401)
+            return JSONResponse(
+                {'email': user.email},
+                201 if created else 200,
+                headers={'Location': f"{request.base_url}api/v1/users/{user.id}"},
+            )
+
+
+class CoinEndpoint(HTTPEndpoint):
+    """
+    Defines an async API endpoint for listing coins, see `rest.CoinApi`.
+    """
+
+    async def get(self, request):
+        """
+        Retrieves a list of all coins in the database
+
+        Returns:
+            JSONResponse: The list of coin dictionaries.
+        """
+        async with request.app.state.sessions() as session:
+            coins = await aio.list_coins(session)
+            return JSONResponse([coin.to_dict() for coin in coins])
+
+
+class BalanceEndpoint(HTTPEndpoint):
+    """
+    Defines an async API endpoint for balances CRUD operations, see `rest.BalanceApi`.
+    """
+
+    async def get(self, request):
+        """
+        This function gets the valued balances of a user, optionally filtered by date
+        range, and paged if a 'limit' or 'cursor' is given
+
+        Returns:
+            JSONResponse: The list of balance dictionaries, with the cursor of the next
+            page in the 'X-Next-Cursor' header when paged.
+        """
+        args = await request_args(request)
+        user_id = request.path_params.get('id')
+        from_date = parse_datetime(args.get('from_date'))
+        to_date = parse_datetime(args.get('to_date'))
+        state = request.app.state
+
+        async with state.sessions() as session:
+            if 'limit' in args or 'cursor' in args:
+                balances, next_cursor = await aio.page_balances(
+                    session, state.price_cache, user_id,
+                    from_date=from_date,
+                    to_date=to_date,
+                    cursor=parse_int(args.get('cursor'), 'cursor'),
+                    limit=parse_int(args.get('limit'), 'limit', 1, 1000) or 100,
+                )
+                headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+                return JSONResponse(balances, headers=headers)
+
+            balances = await aio.list_balances(
+                session, state.price_cache, user_id, from_date=from_date, to_date=to_date
+            )
+            return JSONResponse(balances)
+
+    async def delete(self, request):
+        """
+        This function deletes the balance with the specified ID
+
+        Returns:
+            Response: An empty response with status code 204.
+
+        Raises:
+            HTTPException: 404 if no balance is found.
+        """
+        async with request.app.state.sessions() as session:
+            if not await aio.delete_balance(session, request.path_params.get('id')):
+                raise HTTPException(404)
+        return Response(status_code=204)
+
+    async def put(self, request):
+        """
+        This function updates the coin and amount of the balance with the specified ID
+
+        Returns:
+            JSONResponse: The updated balance dictionary with status code 201.
+
+        Raises:
+            HTTPException: 404 if no balance is found.
+        """
+        args = await request_args(request)
+        async with request.app.state.sessions() as session:
+            balance = await aio.update_balance(
+                session,
+                request.path_params.get('id'),
+                coin_id=args.get('coin_id'),
+                amount=args.get('amount'),
+            )
+        if balance is None:
+            raise HTTPException(404)
+        return JSONResponse(balance, 201)
+
+    async def post(self, request):
+        """
+        This function creates a new balance record
+
+        Returns:
+            JSONResponse: An empty dictionary with status code 201.
+
+        Raises:
+            HTTPException: 422 if the amount, user_id or coin_id are missing.
+        """
+        args = await request_args(request)
+        amount, user_id, coin_id = args.get('amount'), args.get('user_id'), args.get('coin_id')
+        if amount is None or user_id is None or coin_id is None:
+            logger.info("REST - Failed missing arguments")
+            raise HTTPException(422)
+
+        async with request.app.state.sessions() as session:
+            await aio.create_balance(session, user_id, coin_id, amount)
+        return JSONResponse({}, 201)
+
+
+def create_asgi_app(config, instance_path: str = None) -> Starlette:
+    """
+    Function that creates the ASGI app of the REST API
+
+    The database engine and the HTTP client are created on startup and closed
+    on shutdown, once per worker process.
+
+    Args:
+        config: The app settings, see `app.configure_services`.
+        instance_path(str): The instance folder relative SQLite paths are resolved in.
+
+    Returns:
+        Starlette: The ASGI app.
+    """
+    @asynccontextmanager
+    async def lifespan(app):
+        state = app.state
+        uri = aio.async_database_uri(config['SQLALCHEMY_DATABASE_URI'], instance_path)
+        state.engine = create_async_engine(uri, **engine_options(uri, config))
+        state.sessions = async_sessionmaker(state.engine, expire_on_commit=False)
+        state.http = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=config['PRICE_API_MAX_CONNECTIONS'],
+            max_keepalive_connections=config['PRICE_API_MAX_CONNECTIONS'],
+        ))
+        fetcher = partial(
+            aio.fetch_prices,
+            state.http,
+            url=config['PRICE_API_URL'],
+            timeout=config['PRICE_API_TIMEOUT'],
+        )
+        if config['PRICE_API_CASSETTE']:
+            # the cassette fetcher of the sync price cache records or replays
+            fetcher = partial(asyncio.to_thread, price_cache.fetcher)
+        state.price_cache = aio.AsyncPriceCache(
+            store=price_cache.store,
+            fetcher=fetcher,
+            ttl=config['PRICE_CACHE_TTL'],
+            stale_ttl=config['PRICE_CACHE_STALE_TTL'],
+        )
+        yield
+        await state.http.aclose()
+        await state.engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route('/api/v1/users', UserEndpoint),
+            Route('/api/v1/users/{id:int}', UserEndpoint),
+            Route('/api/v1/coins', CoinEndpoint),
+            Route('/api/v1/balances', BalanceEndpoint),
+            Route('/api/v1/balances/{id:int}', BalanceEndpoint),
+        ],
+        exception_handlers={HTTPException: http_error},
+        lifespan=lifespan,
+    )
+    app.state.config = config
+    return app
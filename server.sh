@@ -3,4 +3,5 @@
 # shellcheck disable=SC2046
 export $(cat .env | xargs)
 
-gunicorn -w 3 -b 127.0.0.1:5000 'app:create_app()'
+# threaded workers, every open live price stream of the home page holds a thread
+gunicorn -w 3 --worker-class gthread --threads "${GUNICORN_THREADS:-50}" -b 127.0.0.1:5000 'app:create_app()'
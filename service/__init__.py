@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-import requests
 
 from flask_login import LoginManager
 
@@ -30,31 +29,33 @@ class CustomUser:
         """
         Function that gets id of the user
 
+        The id is what Flask-Login keeps in the session to load the user back.
+
         Returns:
             str: The id of a user
         """
-        return self.url
+        return str(self.id)
 
     @classmethod
-    def create_from_api(
+    def create_from_dict(
         cls,
+        user: dict,
         url: str
     ):
         """
-        Function that creates a custom user object from an API response
+        Function that creates a custom user object from a user dictionary
 
         Args:
+            user(dict): a dictionary representation of the user, as returned by `User.to_dict`.
             url(str): the url of the user's API endpoint.
 
         Returns:
             CustomUser: a custom user object.
         """
-        response = requests.get(url=url, timeout=5).json()['user']
-        user = cls(
-            id=response['id'],
-            email=response['email'],
-            is_active=response['is_active'],
-            is_authenticated=response['is_authenticated'],
+        return cls(
+            id=user['id'],
+            email=user['email'],
+            is_active=user['is_active'],
+            is_authenticated=user['is_authenticated'],
             url=url
         )
-        return user
@@ -0,0 +1,412 @@
+import asyncio
+from decimal import Decimal
+import json
+import logging
+import math
+import os
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import make_url
+
+from models import Balance, Coin, User
+from service import passwords
+from service.balances import _balances_query, _value_balances
+from service.prices import INVALID_SYMBOL_STATUS, SQLitePriceStore, parse_prices
+from service.valuation import required_symbols
+
+
+logger = logging.getLogger(__name__)
+
+# async drivers of the supported databases, by backend name
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_uri(uri: str, instance_path: str = None) -> str:
+    """
+    Function that converts a database uri to the uri of the async driver of its backend
+
+    Relative SQLite paths are resolved in the instance folder, like Flask-SQLAlchemy does,
+    so both deployment modes open the same file.
+
+    Args:
+        uri(str): The `SQLALCHEMY_DATABASE_URI` of the app.
+        instance_path(str): The instance folder of the app, if any.
+
+    Returns:
+        str: The database uri with an async driver.
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    url = url.set(drivername=ASYNC_DRIVERS.get(backend, url.drivername))
+    if (backend == 'sqlite' and instance_path and url.database
+            and url.database != ':memory:' and not os.path.isabs(url.database)):
+        url = url.set(database=os.path.join(instance_path, url.database))
+    return url.render_as_string(hide_password=False)
+
+
+async def fetch_prices(client, symbols, url: str, timeout: float = 5) -> dict:
+    """
+    Function that retrieves the latest prices for the given symbols from Binance API
+    without blocking the event loop
+
+    Args:
+        client(httpx.AsyncClient): The pooled HTTP client to send the request with.
+        symbols: An iterable of coin indexes (e.g. 'BTCUSDT').
+        url(str): The url of the ticker price endpoint.
+        timeout(float): The number of seconds to wait for the response.
+
+    Like `service.prices.fetch_prices`, the symbols are fetched one by one, concurrently,
+    when a symbol Binance does not list fails the call, and the unlisted ones are left out.
+
+    Returns:
+        dict: A dictionary that maps a coin index to its price as a Decimal.
+
+    Raises:
+        httpx.HTTPError: If the call failed or was answered with an error.
+        ValueError: If the answer is not a list of prices.
+    """
+    symbols = sorted(set(symbols))
+    if not symbols:
+        return {}
+    response = await _get_prices(client, symbols, url, timeout)
+    if response.status_code != INVALID_SYMBOL_STATUS or len(symbols) == 1:
+        response.raise_for_status()
+        return parse_prices(response.json())
+
+    prices = {}
+    responses = await asyncio.gather(
+        *(_get_prices(client, [symbol], url, timeout) for symbol in symbols)
+    )
+    for symbol, response in zip(symbols, responses):
+        if response.status_code == INVALID_SYMBOL_STATUS:
+            logger.warning("PRICES - The price API does not list %s", symbol)
+            continue
+        response.raise_for_status()
+        prices.update(parse_prices(response.json()))
+    return prices
+
+
+async def _get_prices(client, symbols: list, url: str, timeout: float):
+    return await client.get(
+        url,
+        params={'symbols': json.dumps(symbols, separators=(',', ':'))},
+        timeout=timeout
+    )
+
+
+class AsyncPriceCache:  # pylint: disable=too-many-instance-attributes
+    """
+    The asyncio counterpart of `service.prices.PriceCache`.
+
+    It serves prices from the same store with the same freshness rules, so it can share
+    a SQLite store with the poller and the sync workers. Concurrent requests for the same
+    symbols await a single in-flight upstream request, and stale prices are refreshed by
+    a background task instead of a thread. A SQLite store is read and written in a
+    thread, so waiting for its file lock does not block the event loop.
+
+    As in the sync cache, prices that cannot be fetched are left out, and symbols the
+    upstream does not answer for are not asked for again for `ttl + stale_ttl` seconds.
+
+    Attributes:
+        store: The price store, either a `MemoryPriceStore` or a `SQLitePriceStore`.
+        fetcher: A coroutine function that takes a set of symbols and returns their prices.
+        ttl(float): The number of seconds a price is fresh.
+        stale_ttl(float): The number of seconds a price is still served after it went stale.
+    """
+
+    def __init__(self, store, fetcher, ttl: float = 10.0,  # pylint: disable=R0913
+                 stale_ttl: float = 60.0, timer=time.time):
+        self.store = store
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._timer = timer
+        self._inflight = {}
+        self._unknown = {}
+        self._tasks = set()
+
+    async def _call_store(self, method: str, *args):
+        """
+        Function that calls a method of the store, in a thread for a SQLite store
+        """
+        call = getattr(self.store, method)
+        if isinstance(self.store, SQLitePriceStore):
+            return await asyncio.to_thread(call, *args)
+        return call(*args)
+
+    async def get_prices(self, symbols) -> dict:
+        """
+        Function that gets the prices of the given symbols
+
+        Args:
+            symbols: An iterable of coin indexes.
+
+        Returns:
+            dict: A dictionary that maps a coin index to its price as a Decimal.
+        """
+        symbols = set(symbols)
+        if not symbols:
+            return {}
+
+        now = self._timer()
+        prices, stale = {}, set()
+        for symbol, (price, fetched_at) in (await self._call_store('get_many', symbols)).items():
+            age = now - fetched_at
+            if age < self.ttl + self.stale_ttl:
+                prices[symbol] = price
+                if age >= self.ttl:
+                    stale.add(symbol)
+        missing = {
+            symbol for symbol in symbols - prices.keys()
+            if now - self._unknown.get(symbol, -math.inf) >= self.ttl + self.stale_ttl
+        }
+
+        stale -= self._inflight.keys()
+        if stale:
+            task = asyncio.create_task(self._background_refresh(stale))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if missing:
+            try:
+                prices.update(await self.refresh(missing))
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("PRICES - Fetching %s failed, serving without them",
+                                 sorted(missing))
+        return prices
+
+    async def refresh(self, symbols) -> dict:
+        """
+        Function that fetches the prices of the given symbols from upstream and stores them
+
+        Symbols that are already being fetched by another task are not fetched again,
+        their result is awaited instead.
+
+        Args:
+            symbols: An iterable of coin indexes.
+
+        Returns:
+            dict: A dictionary that maps a coin index to its price as a Decimal.
+        """
+        symbols = set(symbols)
+        awaited = {symbol: self._inflight[symbol] for symbol in symbols & self._inflight.keys()}
+        owned = symbols - awaited.keys()
+
+        prices = {}
+        if owned:
+            future = asyncio.get_running_loop().create_future()
+            for symbol in owned:
+                self._inflight[symbol] = future
+            try:
+                fetched = await self.fetcher(owned)
+                fetched_at = self._timer()
+                await self._call_store('set_many', fetched, fetched_at)
+                future.set_result(fetched)
+                for symbol in owned:
+                    if symbol in fetched:
+                        self._unknown.pop(symbol, None)
+                    else:
+                        self._unknown[symbol] = fetched_at
+            except Exception as error:
+                future.set_exception(error)
+                # retrieved here, so that a failure nobody else awaited is not reported
+                future.exception()
+                raise
+            finally:
+                for symbol in owned:
+                    self._inflight.pop(symbol, None)
+            prices.update(fetched)
+
+        for symbol, pending in awaited.items():
+            result = await pending
+            if symbol in result:
+                prices[symbol] = result[symbol]
+        return prices
+
+    async def _background_refresh(self, symbols):
+        try:
+            await self.refresh(symbols)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("PRICES - Background refresh failed for %s", sorted(symbols))
+
+
+async def get_user(session, user_id: int):
+    """
+    Function that gets a user by ID
+
+    Args:
+        session(AsyncSession): The database session.
+        user_id(int): The ID of the user to retrieve.
+
+    Returns:
+        User: The user object, or None if no user is found.
+    """
+    return await session.get(User, user_id)
+
+
+async def login_or_register(session, email: str, password: str, method: str):
+    """
+    Function that logs in an existing user or registers a new one with a single lookup
+
+    Hashing is CPU bound, so it runs in a worker thread and the event loop keeps
+    serving the other requests meanwhile. Outdated hashes are upgraded on login.
+
+    Args:
+        session(AsyncSession): The database session.
+        email(str): The email address of the user.
+        password(str): The plaintext password of the user.
+        method(str): The password hashing method of the app.
+
+    Returns:
+        tuple: The user object (None if the password is wrong) and a boolean
+        indicating whether the user was created.
+    """
+    user = (await session.execute(select(User).where(User.email == email))).scalars().first()
+    if user is None:
+        user = User(email=email)
+        user.password_hash = await asyncio.to_thread(passwords.hash_password, password, method)
+        session.add(user)
+        await session.commit()
+        return user, True
+
+    if not await asyncio.to_thread(passwords.verify_password, user.password_hash, password):
+        return None, False
+    if passwords.needs_rehash(user.password_hash, method):
+        user.password_hash = await asyncio.to_thread(passwords.hash_password, password, method)
+        await session.commit()
+    return user, False
+
+
+async def list_coins(session) -> list:
+    """
+    Function that retrieves all coins from the database
+
+    Args:
+        session(AsyncSession): The database session.
+
+    Returns:
+        list: A list of coin objects.
+    """
+    return (await session.execute(select(Coin))).scalars().all()
+
+
+async def list_balances(session, cache, user_id: int,  # pylint: disable=R0913
+                        from_date=None, to_date=None, cursor: int = None,
+                        limit: int = None) -> list:
+    """
+    Function that gets the balances of a user, optionally filtered by date range,
+    valued at the latest cached price of their coins.
+
+    Args:
+        session(AsyncSession): The database session.
+        cache(AsyncPriceCache): The price cache.
+        user_id(int): The id of the user whose balances to retrieve.
+        from_date(datetime): The lower bound of the balance `date_added`, if any.
+        to_date(datetime): The upper bound of the balance `date_added`, if any.
+        cursor(int): Only balances with a greater id are returned, if given.
+        limit(int): The maximum number of balances to return, if given.
+
+    Returns:
+        list: A list of balance dictionaries ordered by id, each with an extra 'value' key.
+    """
+    query = _balances_query(user_id, from_date, to_date)
+    if cursor is not None:
+        query = query.where(Balance.id > cursor)
+    if limit is not None:
+        query = query.limit(limit)
+    balances = (await session.execute(query)).all()
+    if not balances:
+        return []
+
+    prices = await cache.get_prices(required_symbols(balance.index for balance in balances))
+    return _value_balances(balances, prices)
+
+
+async def page_balances(session, cache, user_id: int,  # pylint: disable=R0913
+                        from_date=None, to_date=None, cursor: int = None,
+                        limit: int = 100) -> tuple:
+    """
+    Function that gets a page of the balances of a user with keyset pagination
+
+    Args:
+        session(AsyncSession): The database session.
+        cache(AsyncPriceCache): The price cache.
+        user_id(int): The id of the user whose balances to retrieve.
+        from_date(datetime): The lower bound of the balance `date_added`, if any.
+        to_date(datetime): The upper bound of the balance `date_added`, if any.
+        cursor(int): The id of the last balance of the previous page, None for the first page.
+        limit(int): The number of balances per page.
+
+    Returns:
+        tuple: The list of balance dictionaries of the page, and the cursor of the next page
+        (None on the last page).
+    """
+    balances = await list_balances(session, cache, user_id, from_date, to_date,
+                                   cursor=cursor, limit=limit + 1)
+    if len(balances) > limit:
+        return balances[:limit], balances[limit - 1]['id']
+    return balances, None
+
+
+async def create_balance(session, user_id: int, coin_id: int, amount):
+    """
+    Function that creates a new balance record
+
+    Args:
+        session(AsyncSession): The database session.
+        user_id(int): The ID of the user the balance belongs to.
+        coin_id(int): The ID of the coin of the balance.
+        amount: The amount of the coin, anything accepted by `Decimal`.
+
+    Returns:
+        Balance: The newly created balance object.
+    """
+    balance = Balance(amount=Decimal(amount), user_id=user_id, coin_id=coin_id)
+    session.add(balance)
+    await session.commit()
+    return balance
+
+
+async def update_balance(session, balance_id: int, coin_id: int, amount) -> dict:
+    """
+    Function that updates the coin and amount of a balance
+
+    Args:
+        session(AsyncSession): The database session.
+        balance_id(int): The ID of the balance to update.
+        coin_id(int): The new coin ID of the balance.
+        amount: The new amount of the coin, anything accepted by `Decimal`.
+
+    Returns:
+        dict: The dictionary representation of the updated balance, or None if no
+        balance is found.
+    """
+    balance = await session.get(Balance, balance_id)
+    if balance is None:
+        return None
+    balance.amount = Decimal(amount)
+    balance.coin_id = coin_id
+    await session.commit()
+    # loads the coin into the identity map, so the relationship needs no lazy load
+    await session.get(Coin, coin_id)
+    return balance.to_dict()
+
+
+async def delete_balance(session, balance_id: int) -> int:
+    """
+    Function that deletes a balance by ID
+
+    Args:
+        session(AsyncSession): The database session.
+        balance_id(int): The ID of the balance to delete.
+
+    Returns:
+        int: The number of deleted balances.
+    """
+    result = await session.execute(delete(Balance).where(Balance.id == balance_id))
+    await session.commit()
+    return result.rowcount
@@ -0,0 +1,423 @@
+from decimal import Decimal
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, object_session
+
+from models import Balance, Coin, db, format_amount
+from service.cache import TTLCache, VersionCounter
+from service.coins import coin_catalog
+from service.prices import price_cache
+from service.valuation import format_value, required_symbols, unit_prices, value_holdings
+
+
+# versions of the balances of every user, bumped on every commit writing their balances
+balance_versions = VersionCounter()
+
+# rendered portfolio fragments of the home page, keyed by user ID, balance version,
+# price snapshot version and page
+portfolio_cache = TTLCache()
+
+
+# key of the users whose balances a session wrote in its transaction, in `Session.info`
+PENDING_VERSIONS = 'balance_versions'
+
+# pending key of the bulk writes that don't tell whose balances they change
+_EVERY_USER = object()
+
+
+def _pending_versions(session) -> set:
+    """
+    Function that gets the users whose balance versions to bump when a session commits
+    """
+    return session.info.setdefault(PENDING_VERSIONS, set())
+
+
+@event.listens_for(Balance, 'after_insert')
+@event.listens_for(Balance, 'after_update')
+@event.listens_for(Balance, 'after_delete')
+def bump_balance_version(mapper, connection, target):  # pylint: disable=unused-argument
+    """
+    Function that marks the balance version of the user of a written balance to be
+    bumped once the transaction commits
+
+    Bumping at flush would let a concurrent request cache the balances it still
+    reads from before the commit under the new version.
+
+    Args:
+        mapper: The mapper of the `Balance` model.
+        connection: The connection the change was flushed on.
+        target(Balance): The written balance.
+    """
+    _pending_versions(object_session(target)).add(target.user_id)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def bump_balance_version_on_bulk_write(orm_execute_state):
+    """
+    Function that marks balance versions to be bumped on bulk writes to balances, which
+    skip the mapper events. Bulk inserts mark the versions of the users of the inserted
+    rows, other bulk writes don't tell whose balances they change, so they mark every
+    version.
+
+    Args:
+        orm_execute_state(ORMExecuteState): The statement being executed.
+    """
+    if orm_execute_state.bind_mapper is not Balance.__mapper__:
+        return
+    pending = _pending_versions(orm_execute_state.session)
+    parameters = orm_execute_state.parameters
+    if orm_execute_state.is_insert and isinstance(parameters, list):
+        pending.update(row.get('user_id') for row in parameters)
+    elif orm_execute_state.is_insert or orm_execute_state.is_update \
+            or orm_execute_state.is_delete:
+        pending.add(_EVERY_USER)
+
+
+@event.listens_for(Session, 'after_commit')
+def bump_committed_balance_versions(session):
+    """
+    Function that bumps the balance versions of the users whose balances the committed
+    transaction wrote
+
+    Args:
+        session(Session): The session that committed.
+    """
+    pending = session.info.pop(PENDING_VERSIONS, set())
+    if _EVERY_USER in pending:
+        balance_versions.bump_all()
+        return
+    for user_id in pending:
+        balance_versions.bump(user_id)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def forget_balance_versions(session, transaction):
+    """
+    Function that forgets the balance versions to bump once the whole transaction of a
+    session ended without committing them, e.g. rolled back
+
+    Args:
+        session(Session): The session whose transaction ended.
+        transaction(SessionTransaction): The transaction that ended.
+    """
+    if transaction.parent is None:
+        session.info.pop(PENDING_VERSIONS, None)
+
+
+def validate_amount(amount: Decimal) -> Decimal:
+    """
+    Function that validates a balance amount.
+    It checks if the number of digits after the decimal point is within the
+    supported range and if the amount is within the allowed range.
+
+    Args:
+        amount(Decimal): The amount of a coin to create a balance of.
+
+    Returns:
+        Decimal: The valid amount.
+
+    Raises:
+        ValueError: If the amount is not supported, with an appropriate error message.
+    """
+    if not amount.is_finite():
+        raise ValueError("Sadly we only support values from range 0.0000001 to 100000")
+    digits_len = abs(amount.as_tuple().exponent)
+    if digits_len > 7:
+        raise ValueError("Sadly we only support only 7 values after comma")
+    if amount > 100000 or amount < Decimal('0.0000001'):
+        raise ValueError("Sadly we only support values from range 0.0000001 to 100000")
+    return amount
+
+
+def _filter_balances(query, user_id: int, from_date=None, to_date=None):
+    """
+    Function that restricts a balance query to a user and a date range
+    """
+    query = query.where(Balance.user_id == user_id)
+    if from_date:
+        query = query.where(Balance.date_added >= from_date)
+    if to_date:
+        query = query.where(Balance.date_added <= to_date)
+    return query
+
+
+def _balances_query(user_id: int, from_date=None, to_date=None):
+    """
+    Function that builds the query of the balances of a user joined with their coin,
+    selecting only the columns of the response, in keyset (`id`) order
+    """
+    return _filter_balances(
+        select(Balance.id, Balance.user_id, Balance.amount, Coin.index, Coin.abbreviation)
+        .join(Coin, Balance.coin_id == Coin.id),
+        user_id, from_date, to_date
+    ).order_by(Balance.id)
+
+
+def _balance_dict(balance, value) -> dict:
+    """
+    Function that converts a row of the balances query to a valued balance dictionary
+    """
+    return {
+        'id': balance.id,
+        'user': balance.user_id,
+        'coin': balance.abbreviation,
+        'amount': format_amount(balance.amount),
+        'value': format_value(value),
+    }
+
+
+def _value_balances(balances: list, prices: dict) -> list:
+    """
+    Function that values rows of the balances query in a single pass
+    """
+    valuation = value_holdings(
+        ((balance.index, balance.amount) for balance in balances),
+        prices,
+        bases={balance.index: balance.abbreviation for balance in balances},
+    )
+    return [_balance_dict(balance, value) for balance, value in zip(balances, valuation.values)]
+
+
+def list_balances(user_id: int, from_date=None, to_date=None, cursor: int = None,
+                  limit: int = None) -> list:
+    """
+    Function that gets the balances of a user, optionally filtered by date range,
+    valued at the latest cached price of their coins.
+
+    The balances are read with a single query joined with their coin, selecting only
+    the columns of the response, so the number of queries does not grow with the
+    number of balances.
+
+    Args:
+        user_id(int): The id of the user whose balances to retrieve.
+        from_date: The lower bound of the balance `date_added`, if any.
+        to_date: The upper bound of the balance `date_added`, if any.
+        cursor(int): Only balances with a greater id are returned, if given.
+        limit(int): The maximum number of balances to return, if given.
+
+    Returns:
+        list: A list of balance dictionaries ordered by id, each with an extra 'value' key,
+        None if the price of the coin is unknown.
+    """
+    query = _balances_query(user_id, from_date, to_date)
+    if cursor is not None:
+        query = query.where(Balance.id > cursor)
+    if limit is not None:
+        query = query.limit(limit)
+    balances = db.session.execute(query).all()
+    if not balances:
+        return []
+
+    prices = price_cache.get_prices(required_symbols(balance.index for balance in balances))
+    return _value_balances(balances, prices)
+
+
+def page_balances(user_id: int, from_date=None, to_date=None, cursor: int = None,
+                  limit: int = 100) -> tuple:
+    """
+    Function that gets a page of the balances of a user with keyset pagination
+
+    Pages are selected by the id of the last balance of the previous page rather than
+    an offset, so every page costs the same index range scan however deep it is.
+
+    Args:
+        user_id(int): The id of the user whose balances to retrieve.
+        from_date: The lower bound of the balance `date_added`, if any.
+        to_date: The upper bound of the balance `date_added`, if any.
+        cursor(int): The id of the last balance of the previous page, None for the first page.
+        limit(int): The number of balances per page.
+
+    Returns:
+        tuple: The list of balance dictionaries of the page, and the cursor of the next page
+        (None on the last page).
+    """
+    balances = list_balances(user_id, from_date, to_date, cursor=cursor, limit=limit + 1)
+    if len(balances) > limit:
+        return balances[:limit], balances[limit - 1]['id']
+    return balances, None
+
+
+def stream_balances(user_id: int, from_date=None, to_date=None, batch_size: int = 1000):
+    """
+    Function that lazily yields every balance of a user, optionally filtered by date range,
+    valued at the latest cached price of their coins.
+
+    The coins of the balances are looked up first, in the coin catalog, to fetch their
+    prices at once, then the balances are read from a server-side cursor `batch_size`
+    rows at a time, so memory does not grow with the number of balances.
+
+    Args:
+        user_id(int): The id of the user whose balances to retrieve.
+        from_date: The lower bound of the balance `date_added`, if any.
+        to_date: The upper bound of the balance `date_added`, if any.
+        batch_size(int): The number of rows fetched from the database at a time.
+
+    Yields:
+        dict: A balance dictionary with an extra 'value' key (None if the price of the
+        coin is unknown), in id order.
+    """
+    coin_ids = db.session.execute(
+        _filter_balances(select(Balance.coin_id).distinct(), user_id, from_date, to_date)
+    ).scalars().all()
+    bases = {coin.index: coin.abbreviation for coin in coin_catalog.by_id(coin_ids).values()}
+    prices = price_cache.get_prices(required_symbols(bases))
+    units = unit_prices(bases, prices, bases=bases)
+
+    balances = db.session.execute(
+        _balances_query(user_id, from_date, to_date).execution_options(yield_per=batch_size)
+    )
+    for balance in balances:  # pylint: disable=not-an-iterable
+        unit = units.get(balance.index)
+        yield _balance_dict(balance, None if unit is None else unit * balance.amount)
+
+
+def holding_amounts(user_id: int, from_date=None, to_date=None) -> list:
+    """
+    Function that sums the balances of a user per coin, optionally filtered by date range
+
+    Args:
+        user_id(int): The id of the user whose balances to sum.
+        from_date: The lower bound of the balance `date_added`, if any.
+        to_date: The upper bound of the balance `date_added`, if any.
+
+    Returns:
+        list: A list of (coin, amount, balances) tuples ordered by coin abbreviation,
+        with the catalog coin, the summed amount and the number of summed balances.
+        Balances of coins that are no longer listed are left out.
+    """
+    query = (
+        select(
+            Balance.coin_id,
+            func.sum(Balance.amount).label('amount'),  # pylint: disable=not-callable
+            func.count(Balance.id).label('balances'),  # pylint: disable=not-callable
+        )
+        .group_by(Balance.coin_id)
+    )
+    rows = db.session.execute(
+        _filter_balances(query, user_id, from_date, to_date)
+    ).all()
+    coins = coin_catalog.by_id(row.coin_id for row in rows)
+    return sorted(
+        ((coins[row.coin_id], row.amount, row.balances) for row in rows
+         if row.coin_id in coins),
+        key=lambda holding: holding[0].abbreviation or ''
+    )
+
+
+def list_holdings(user_id: int, from_date=None, to_date=None) -> dict:
+    """
+    Function that gets the holdings of a user per coin, optionally filtered by date range,
+    valued at the latest cached price of their coins.
+
+    The amounts of the balances are summed per coin by the database, so the size of the
+    result and the valuation work grow with the number of distinct coins rather than
+    the number of balances. Coins are looked up in the coin catalog instead of joined.
+
+    Args:
+        user_id(int): The id of the user whose holdings to retrieve.
+        from_date: The lower bound of the balance `date_added`, if any.
+        to_date: The upper bound of the balance `date_added`, if any.
+
+    Returns:
+        dict: A dictionary with the following keys:
+        - holdings: A list of dictionaries with 'coin_id', 'coin', 'amount', 'balances'
+          (the number of summed balances) and 'value' (None if the price of the coin is
+          unknown) keys, one per coin.
+        - total: The total value of the holdings with a known price.
+    """
+    holdings = holding_amounts(user_id, from_date, to_date)
+    prices = price_cache.get_prices(required_symbols(coin.index for coin, _, _ in holdings))
+    valuation = value_holdings(
+        ((coin.index, amount) for coin, amount, _ in holdings),
+        prices,
+        bases={coin.index: coin.abbreviation for coin, _, _ in holdings},
+    )
+    return {
+        'holdings': [
+            {
+                'coin_id': coin.id,
+                'coin': coin.abbreviation,
+                'amount': format_amount(amount),
+                'balances': balances,
+                'value': format_value(value),
+            }
+            for (coin, amount, balances), value in zip(holdings, valuation.values)
+        ],
+        'total': format_value(valuation.total),
+    }
+
+
+def get_balance(balance_id: int):
+    """
+    Function that gets a balance by ID
+
+    Args:
+        balance_id(int): The ID of the balance to retrieve.
+
+    Returns:
+        Balance: The balance object, or None if no balance is found.
+    """
+    return db.session.get(Balance, balance_id)
+
+
+def create_balance(user_id: int, coin_id: int, amount):
+    """
+    Function that creates a new balance record
+
+    Args:
+        user_id(int): The ID of the user the balance belongs to.
+        coin_id(int): The ID of the coin of the balance.
+        amount: The amount of the coin, anything accepted by `Decimal`.
+
+    Returns:
+        Balance: The newly created balance object.
+    """
+    balance = Balance(
+        amount=Decimal(amount),
+        user_id=user_id,
+        coin_id=coin_id,
+    )
+    db.session.add(balance)
+    db.session.commit()
+    return balance
+
+
+def update_balance(balance_id: int, coin_id: int, amount):
+    """
+    Function that updates the coin and amount of a balance
+
+    Args:
+        balance_id(int): The ID of the balance to update.
+        coin_id(int): The new coin ID of the balance.
+        amount: The new amount of the coin, anything accepted by `Decimal`.
+
+    Returns:
+        Balance: The updated balance object, or None if no balance is found.
+    """
+    balance = get_balance(balance_id)
+    if balance is None:
+        return None
+    balance.amount = Decimal(amount)
+    balance.coin_id = coin_id
+    db.session.add(balance)
+    db.session.commit()
+    return balance
+
+
+def delete_balance(balance_id: int) -> int:
+    """
+    Function that deletes a balance by ID
+
+    Args:
+        balance_id(int): The ID of the balance to delete.
+
+    Returns:
+        int: The number of deleted balances.
+    """
+    # deleted through the session, so only the balance version of its user is bumped
+    balance = db.session.get(Balance, balance_id)
+    if balance is None:
+        return 0
+    db.session.delete(balance)
+    db.session.commit()
+    return 1
@@ -0,0 +1,225 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from io import StringIO
+import csv
+import json
+
+from sqlalchemy import insert, select
+
+from models import Balance, Coin, User, db, format_amount
+from service.balances import validate_amount
+from service.coins import coin_catalog
+
+
+# columns of the exported balances, which are also the columns accepted by the import
+COLUMNS = ('user_id', 'coin_id', 'coin', 'amount', 'date_added')
+
+# media types of the supported formats, by format name
+MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# the number of row errors reported in full, the others are only counted
+MAX_ERRORS = 100
+
+
+def read_csv(lines):
+    """
+    Function that lazily parses CSV balance rows with a header line
+
+    Args:
+        lines: An iterable of text lines, e.g. a text file.
+
+    Yields:
+        tuple: The line number and the row dictionary, or the line number and a
+        ValueError if the line could not be parsed.
+    """
+    reader = csv.DictReader(lines)
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except csv.Error as error:
+        yield reader.line_num, ValueError(str(error))
+
+
+def read_jsonl(lines):
+    """
+    Function that lazily parses JSON Lines balance rows, skipping blank lines
+
+    Args:
+        lines: An iterable of text lines, e.g. a text file.
+
+    Yields:
+        tuple: The line number and the row dictionary, or the line number and a
+        ValueError if the line could not be parsed.
+    """
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield line_num, ValueError(f'Invalid JSON: {error}')
+            continue
+        if not isinstance(row, dict):
+            yield line_num, ValueError('Expected a JSON object')
+        else:
+            yield line_num, row
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def _parse_row(row: dict, coins, user_id: int = None) -> dict:
+    """
+    Function that validates an imported row and converts it to balance column values
+
+    Raises:
+        ValueError: If the row is not a valid balance.
+    """
+    try:
+        row_user_id = int(row.get('user_id') or user_id)
+    except (TypeError, ValueError):
+        raise ValueError("'user_id' must be an integer") from None
+
+    if row.get('coin_id') not in (None, ''):
+        try:
+            coin_id = int(row['coin_id'])
+        except (TypeError, ValueError):
+            raise ValueError("'coin_id' must be an integer") from None
+        if coin_id not in coins.by_id:
+            raise ValueError(f"Unknown coin id {coin_id}")
+    elif row.get('coin') in coins.by_abbreviation:
+        coin_id = coins.by_abbreviation[row['coin']].id
+    else:
+        raise ValueError(f"Unknown coin '{row.get('coin') or ''}'")
+
+    try:
+        amount = Decimal(str(row.get('amount')).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount '{row.get('amount')}'") from None
+    values = {'user_id': row_user_id, 'coin_id': coin_id, 'amount': validate_amount(amount)}
+
+    if row.get('date_added'):
+        try:
+            values['date_added'] = datetime.fromisoformat(row['date_added'])
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid date '{row['date_added']}'") from None
+    return values
+
+
+def _insert_batch(batch: list, errors: list) -> int:
+    """
+    Function that inserts a batch of parsed rows in a single transaction,
+    reporting the rows of unknown users as errors
+
+    Returns:
+        int: The number of inserted balances.
+    """
+    user_ids = {values['user_id'] for _, values in batch}
+    known = set(db.session.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+    rows = []
+    for line_num, values in batch:
+        if values['user_id'] in known:
+            values.setdefault('date_added', datetime.utcnow())
+            rows.append(values)
+        else:
+            errors.append({'line': line_num, 'error': f"Unknown user id {values['user_id']}"})
+    if rows:
+        db.session.execute(insert(Balance), rows)
+        db.session.commit()
+    return len(rows)
+
+
+def import_balances(rows, user_id: int = None, batch_size: int = 1000) -> dict:
+    """
+    Function that bulk imports balances, validating every row with the rules of the
+    balance form.
+
+    Valid rows are inserted with a single multi-row statement and committed every
+    `batch_size` rows, so a large import costs a few round trips and transactions
+    instead of one per balance. Invalid rows are skipped and reported with their line.
+
+    Args:
+        rows: An iterable of (line number, row dictionary or ValueError) tuples, as
+            produced by `read_csv` or `read_jsonl`. A row has a 'user_id', a 'coin_id'
+            or 'coin' abbreviation, an 'amount' and optionally an ISO 'date_added'.
+        user_id(int): The user of the rows without a 'user_id', if any.
+        batch_size(int): The number of balances inserted per transaction.
+
+    Returns:
+        dict: A dictionary with the following keys:
+        - imported: The number of imported balances.
+        - failed: The number of invalid rows.
+        - errors: The line and error message of the first invalid rows.
+    """
+    coins = coin_catalog.snapshot()
+    imported = 0
+    errors = []
+    batch = []
+    for line_num, row in rows:
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            batch.append((line_num, _parse_row(row, coins, user_id)))
+        except ValueError as error:
+            errors.append({'line': line_num, 'error': str(error)})
+        if len(batch) >= batch_size:
+            imported += _insert_batch(batch, errors)
+            batch = []
+    if batch:
+        imported += _insert_batch(batch, errors)
+
+    errors.sort(key=lambda error: error['line'])
+    return {'imported': imported, 'failed': len(errors), 'errors': errors[:MAX_ERRORS]}
+
+
+def export_balances(user_id: int, fmt: str = 'csv', batch_size: int = 1000):
+    """
+    Function that lazily exports every balance of a user in the import format
+
+    The balances are read from a server-side cursor `batch_size` rows at a time, so
+    memory does not grow with the number of balances.
+
+    Args:
+        user_id(int): The id of the user whose balances to export.
+        fmt(str): The format of the export, 'csv' (with a header line) or 'jsonl'.
+        batch_size(int): The number of rows fetched from the database at a time.
+
+    Yields:
+        str: A line of the export.
+    """
+    balances = db.session.execute(
+        select(Balance.user_id, Balance.coin_id, Coin.abbreviation, Balance.amount,
+               Balance.date_added)
+        .join(Coin, Balance.coin_id == Coin.id)
+        .where(Balance.user_id == user_id)
+        .order_by(Balance.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writerow(COLUMNS)
+        yield buffer.getvalue()
+
+    for balance in balances:  # pylint: disable=not-an-iterable
+        values = (
+            balance.user_id,
+            balance.coin_id,
+            balance.abbreviation,
+            format_amount(balance.amount),
+            balance.date_added.isoformat() if balance.date_added else None,
+        )
+        if fmt == 'csv':
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(values)
+            yield buffer.getvalue()
+        else:
+            yield json.dumps(dict(zip(COLUMNS, values))) + '\n'
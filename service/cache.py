@@ -0,0 +1,178 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A thread-safe, size-bounded LRU cache whose entries expire after a time-to-live.
+
+    The cache lives in the memory of a single worker process, so every gunicorn worker
+    keeps its own copy. Hits and misses are counted to be able to tell how well it works.
+
+    Attributes:
+        maxsize(int): The maximum number of entries, the least recently used is evicted first.
+        ttl(float): The number of seconds an entry stays valid.
+        hits(int): The number of lookups answered from the cache.
+        misses(int): The number of lookups that were not in the cache or expired.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def configure(self, maxsize: int = None, ttl: float = None):
+        """
+        Function that changes the size and time-to-live of the cache and empties it
+
+        Args:
+            maxsize(int): The new maximum number of entries, if given.
+            ttl(float): The new time-to-live in seconds, if given.
+        """
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._data.clear()
+
+    def get(self, key, default=None):
+        """
+        Function that gets a value from the cache
+
+        Args:
+            key: The key of the value.
+            default: The value to return on a miss.
+
+        Returns:
+            The cached value, or `default` if the key is missing or expired.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > self._timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Function that puts a value into the cache, evicting the least recently used
+        entries if the cache is full
+
+        Args:
+            key: The key of the value.
+            value: The value to cache.
+        """
+        with self._lock:
+            self._data[key] = (value, self._timer() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        """
+        Function that gets a value from the cache, computing and caching it on a miss
+
+        A `None` result of the factory is returned but not cached.
+
+        Args:
+            key: The key of the value.
+            factory: A callable without arguments that computes the value.
+
+        Returns:
+            The cached or computed value.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        """
+        Function that removes a value from the cache
+
+        Args:
+            key: The key of the value to remove.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Function that removes every value from the cache
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Function that reports the usage of the cache
+
+        Returns:
+            dict: The number of hits, misses and current entries.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+class VersionCounter:
+    """
+    Thread-safe version numbers of keyed data sets, e.g. the balances of each user.
+
+    A version changes whenever its data set is written, so it can be part of the key
+    of anything derived from the data set and cached, which then never has to be
+    invalidated explicitly. Versions live in the memory of a single worker process.
+
+    Attributes:
+        generation(int): A version shared by every key, bumped when unknown keys changed.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self._versions = {}
+        self._lock = Lock()
+
+    def get(self, key) -> tuple:
+        """
+        Function that gets the version of a key
+
+        Args:
+            key: The key of the data set.
+
+        Returns:
+            tuple: The generation and the version of the key.
+        """
+        with self._lock:
+            return self.generation, self._versions.get(key, 0)
+
+    def bump(self, key):
+        """
+        Function that changes the version of a key
+
+        Args:
+            key: The key of the written data set.
+        """
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def bump_all(self):
+        """
+        Function that changes the version of every key
+        """
+        with self._lock:
+            self.generation += 1
@@ -0,0 +1,247 @@
+from bisect import bisect_right
+from decimal import Decimal
+from threading import Lock
+import atexit
+import gzip
+import json
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# version of the on-disk cassette format
+CASSETTE_VERSION = 1
+
+# recorders of the process by cassette path, each saved once when the process exits
+_recorders = {}
+
+
+class PriceCassette:
+    """
+    Ticker responses of the price API, recorded over time.
+
+    Only the changes of a price are kept, so polling a quiet market for hours stays
+    small on disk. A cassette is saved as JSON, gzipped when its path ends with '.gz':
+
+        {"version": 1, "calls": [0.0, 10.0, ...],
+         "prices": {"BTCUSDT": [[0.0, "27000.1"], [10.0, "27001.5"]], ...}}
+
+    Attributes:
+        calls(list): The offsets in seconds of the recorded calls, from the first one.
+        prices(dict): A dictionary that maps a symbol to its (offset, Decimal price)
+        changes, in recording order.
+    """
+
+    def __init__(self, calls: list = None, prices: dict = None):
+        self.calls = calls or []
+        self.prices = prices or {}
+
+    @property
+    def duration(self) -> float:
+        """
+        The offset in seconds of the last recorded call.
+        """
+        return self.calls[-1] if self.calls else 0.0
+
+    def add(self, offset: float, prices: dict):
+        """
+        Function that records the answer of a call
+
+        Args:
+            offset(float): The number of seconds since the first call, not smaller than
+                the offset of the previous call.
+            prices(dict): A dictionary that maps a symbol to its price as a Decimal.
+        """
+        self.calls.append(offset)
+        for symbol, price in prices.items():
+            changes = self.prices.setdefault(symbol, [])
+            if not changes or changes[-1][1] != price:
+                changes.append((offset, price))
+
+    def prices_at(self, offset: float, symbols) -> dict:
+        """
+        Function that gets the prices recorded last at an offset
+
+        Args:
+            offset(float): The number of seconds since the first call.
+            symbols: An iterable of coin indexes.
+
+        Returns:
+            dict: A dictionary that maps a symbol to its price as a Decimal. Symbols that
+            were never recorded are missing, the first recorded price of a symbol is
+            served before it was recorded.
+        """
+        prices = {}
+        for symbol in symbols:
+            changes = self.prices.get(symbol)
+            if changes:
+                position = bisect_right(changes, offset, key=lambda change: change[0])
+                prices[symbol] = changes[max(position - 1, 0)][1]
+        return prices
+
+    def save(self, path: str):
+        """
+        Function that writes the cassette to a file
+
+        Args:
+            path(str): The path of the file, gzipped if it ends with '.gz'.
+        """
+        document = {
+            'version': CASSETTE_VERSION,
+            'calls': [round(offset, 3) for offset in self.calls],
+            'prices': {
+                symbol: [[round(offset, 3), str(price)] for offset, price in changes]
+                for symbol, changes in sorted(self.prices.items())
+            },
+        }
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as file:
+            json.dump(document, file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str) -> 'PriceCassette':
+        """
+        Function that reads a cassette from a file
+
+        Args:
+            path(str): The path of the file, gzipped if it ends with '.gz'.
+
+        Returns:
+            PriceCassette: The recorded cassette.
+
+        Raises:
+            ValueError: If the file has an unknown format version.
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as file:
+            document = json.load(file)
+        if document.get('version') != CASSETTE_VERSION:
+            raise ValueError(f"Unknown price cassette version '{document.get('version')}'")
+        return cls(
+            calls=document['calls'],
+            prices={
+                symbol: [(offset, Decimal(price)) for offset, price in changes]
+                for symbol, changes in document['prices'].items()
+            },
+        )
+
+
+class RecordingFetcher:  # pylint: disable=too-few-public-methods
+    """
+    A price fetcher that records the answers of another fetcher into a cassette.
+
+    Attributes:
+        fetcher: A callable that takes a set of symbols and returns their prices.
+        cassette(PriceCassette): The cassette the answers are recorded into.
+    """
+
+    def __init__(self, fetcher, cassette: PriceCassette = None, clock=time.monotonic):
+        self.fetcher = fetcher
+        self.cassette = cassette or PriceCassette()
+        self._clock = clock
+        self._start = None
+        self._lock = Lock()
+
+    def __call__(self, symbols) -> dict:
+        prices = self.fetcher(symbols)
+        with self._lock:
+            now = self._clock()
+            if self._start is None:
+                self._start = now - self.cassette.duration
+            self.cassette.add(now - self._start, prices)
+        return prices
+
+
+class ReplayFetcher:
+    """
+    A price fetcher that serves the prices of a cassette from memory.
+
+    With a `speed`, the prices follow the recording in time, `speed` times faster
+    than recorded, and keep the last recorded prices once it is over. With a speed of
+    0, every call is answered with the prices of the next recorded call instead, so
+    replays do not depend on timing.
+
+    Attributes:
+        cassette(PriceCassette): The recorded cassette.
+        speed(float): The replay speed relative to the recording, 0 to step through
+            the recorded calls.
+    """
+
+    def __init__(self, cassette: PriceCassette, speed: float = 1.0, clock=time.monotonic):
+        self.cassette = cassette
+        self.speed = speed
+        self._clock = clock
+        self._start = None
+        self._calls = 0
+        self._lock = Lock()
+
+    def offset(self) -> float:
+        """
+        Function that gives the offset of the recording to serve the next call from
+
+        Returns:
+            float: The number of recorded seconds since the first call.
+        """
+        with self._lock:
+            if not self.speed:
+                calls = self.cassette.calls
+                offset = calls[min(self._calls, len(calls) - 1)] if calls else 0.0
+                self._calls += 1
+                return offset
+            if self._start is None:
+                self._start = self._clock()
+            return min((self._clock() - self._start) * self.speed, self.cassette.duration)
+
+    def rewind(self):
+        """
+        Function that starts the replay over from the first recorded call
+        """
+        with self._lock:
+            self._start = None
+            self._calls = 0
+
+    def __call__(self, symbols) -> dict:
+        symbols = set(symbols)
+        prices = self.cassette.prices_at(self.offset(), symbols)
+        if len(prices) < len(symbols):
+            logger.warning("PRICES - No recorded price for %s",
+                           sorted(symbols - prices.keys()))
+        return prices
+
+
+def cassette_fetcher(fetcher, path: str, mode: str = 'replay', speed: float = 1.0):
+    """
+    Function that records the answers of a price fetcher to a cassette, or replays a
+    cassette in its place
+
+    A recorded cassette is saved when the process exits, prices recorded before are
+    kept, so record from a single process, e.g. `flask prices poll`. Recording again
+    to the same path, e.g. from another app of the process, keeps recording into the
+    same cassette with the new fetcher.
+
+    Args:
+        fetcher: A callable that takes a set of symbols and returns their prices.
+        path(str): The path of the cassette file, gzipped if it ends with '.gz'.
+        mode(str): Either 'record' or 'replay'.
+        speed(float): The replay speed relative to the recording, 0 to step through
+            the recorded calls.
+
+    Returns:
+        The recording or replaying fetcher.
+    """
+    if mode == 'replay':
+        return ReplayFetcher(PriceCassette.load(path), speed=speed)
+    if mode == 'record':
+        recorder = _recorders.get(path)
+        if recorder is not None:
+            recorder.fetcher = fetcher
+            return recorder
+        try:
+            cassette = PriceCassette.load(path)
+        except FileNotFoundError:
+            cassette = PriceCassette()
+        recorder = _recorders[path] = RecordingFetcher(fetcher, cassette)
+        atexit.register(cassette.save, path)
+        return recorder
+    raise ValueError(f"Unknown price cassette mode '{mode}'")
@@ -0,0 +1,248 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from threading import Lock
+import hashlib
+import json
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import Coin, db
+from service.valuation import QUOTE_CURRENCY, split_symbol
+
+
+@dataclass(frozen=True)
+class CatalogCoin:
+    """
+    A read-only copy of a listed coin, safe to share between requests and threads.
+
+    Attributes:
+        id(int): The ID of the coin.
+        index(str): The symbol of the coin at the price provider (e.g. 'BTCUSDT').
+        abbreviation(str): The abbreviation of the coin (e.g. 'BTC').
+    """
+    id: int  # pylint: disable=C0103
+    index: str
+    abbreviation: str
+
+    def to_dict(self) -> dict:
+        """
+        Function that converts the coin to a dictionary, like `Coin.to_dict`
+
+        Returns:
+            dict: a dictionary representation of the coin.
+        """
+        return {
+            'id': self.id,
+            'abbreviation': self.abbreviation,
+        }
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:  # pylint: disable=too-many-instance-attributes
+    """
+    The listed coins at a catalog version, with their lookup indexes.
+
+    Attributes:
+        version(int): The catalog version the snapshot was loaded at.
+        coins(tuple): The coins, in id order.
+        by_id(dict): The coins by ID.
+        by_index(dict): The coins by symbol at the price provider.
+        by_abbreviation(dict): The coins by abbreviation.
+        etag(str): A hash of the coins, the same in every worker for the same coins.
+        last_modified(datetime): When this worker first saw the coins as they are (UTC).
+        loaded_at(float): The monotonic time the snapshot was loaded at.
+    """
+    version: int
+    coins: tuple
+    etag: str
+    last_modified: datetime
+    loaded_at: float
+    by_id: dict = field(default_factory=dict)
+    by_index: dict = field(default_factory=dict)
+    by_abbreviation: dict = field(default_factory=dict)
+
+
+class CoinCatalog:
+    """
+    A per-worker, in-memory catalog of the listed coins.
+
+    Coins only change when `sql/add_coins.py` runs, so they are loaded with a single
+    query and then looked up in dictionaries. Writes to coins made by the worker bump
+    the catalog version, which makes the next lookup reload them. Writes made elsewhere
+    are picked up once the snapshot is `ttl` seconds old.
+
+    Attributes:
+        ttl(float): The number of seconds a snapshot is used before it is reloaded.
+        version(int): The catalog version, bumped on every write to coins.
+    """
+
+    def __init__(self, ttl: float = 300.0, timer=time.monotonic):
+        self.ttl = ttl
+        self.version = 0
+        self._timer = timer
+        self._snapshot = None
+        self._lock = Lock()
+
+    def configure(self, ttl: float = None):
+        """
+        Function that changes the time-to-live of the catalog and invalidates it
+
+        Args:
+            ttl(float): The new time-to-live in seconds, if given.
+        """
+        if ttl is not None:
+            self.ttl = ttl
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Function that bumps the catalog version, so the coins are reloaded on next use
+        """
+        with self._lock:
+            self.version += 1
+
+    def snapshot(self) -> CatalogSnapshot:
+        """
+        Function that gets the current snapshot of the coins, reloading it if it is
+        outdated or expired
+
+        Returns:
+            CatalogSnapshot: The coins and their lookup indexes.
+        """
+        snapshot = self._snapshot
+        if (snapshot is None or snapshot.version != self.version
+                or self._timer() - snapshot.loaded_at >= self.ttl):
+            snapshot = self.reload()
+        return snapshot
+
+    def reload(self) -> CatalogSnapshot:
+        """
+        Function that loads the coins from the database with a single query
+
+        The catalog is shared by the whole worker, so it is read from the primary
+        database even in a `read_replica` block, never from a lagging replica.
+
+        Returns:
+            CatalogSnapshot: The coins and their lookup indexes.
+        """
+        version = self.version
+        coins = tuple(
+            CatalogCoin(*row) for row in db.session.execute(
+                select(Coin.id, Coin.index, Coin.abbreviation).order_by(Coin.id),
+                bind_arguments={'bind': db.engine},
+            ).all()
+        )
+        etag = hashlib.sha1(
+            json.dumps([(coin.id, coin.index, coin.abbreviation) for coin in coins]).encode()
+        ).hexdigest()
+
+        previous = self._snapshot
+        last_modified = previous.last_modified if previous and previous.etag == etag else \
+            datetime.utcnow().replace(microsecond=0)
+        snapshot = CatalogSnapshot(
+            version=version,
+            coins=coins,
+            etag=etag,
+            last_modified=last_modified,
+            loaded_at=self._timer(),
+            by_id={coin.id: coin for coin in coins},
+            by_index={coin.index: coin for coin in coins},
+            by_abbreviation={coin.abbreviation: coin for coin in coins},
+        )
+        self._snapshot = snapshot
+        return snapshot
+
+    def by_id(self, coin_ids) -> dict:
+        """
+        Function that looks coins up by ID, reloading the catalog once if some are missing,
+        e.g. when they were listed by another process
+
+        Args:
+            coin_ids: An iterable of coin IDs.
+
+        Returns:
+            dict: The coins found, by ID.
+        """
+        coin_ids = set(coin_ids)
+        coins = self.snapshot().by_id
+        if not coin_ids <= coins.keys():
+            coins = self.reload().by_id
+        return {coin_id: coins[coin_id] for coin_id in coin_ids if coin_id in coins}
+
+    def quote_rates(self) -> dict:
+        """
+        Function that finds how the listed coins are converted to the quote currency
+
+        Returns:
+            dict: A dictionary that maps the ID of every coin that can be valued to None if
+            its index is quoted in USDT, or to the ID of the coin of the `<quote>USDT` pair
+            its price is converted with. Coins with an unrecognised quote currency, or
+            whose quote currency pair is not listed, are left out.
+        """
+        snapshot = self.snapshot()
+        rates = {}
+        for coin in snapshot.coins:
+            _, quote = split_symbol(coin.index, coin.abbreviation)
+            if quote == QUOTE_CURRENCY:
+                rates[coin.id] = None
+            elif quote and f'{quote}{QUOTE_CURRENCY}' in snapshot.by_index:
+                rates[coin.id] = snapshot.by_index[f'{quote}{QUOTE_CURRENCY}'].id
+        return rates
+
+
+# coins shared by the requests of the worker
+coin_catalog = CoinCatalog()
+
+
+@event.listens_for(Coin, 'after_insert')
+@event.listens_for(Coin, 'after_update')
+@event.listens_for(Coin, 'after_delete')
+def invalidate_coins(mapper, connection, target):  # pylint: disable=unused-argument
+    """
+    Function that invalidates the coin catalog when a coin is written
+
+    Args:
+        mapper: The mapper of the `Coin` model.
+        connection: The connection the change was flushed on.
+        target(Coin): The written coin.
+    """
+    coin_catalog.invalidate()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def invalidate_coins_on_bulk_write(orm_execute_state):
+    """
+    Function that invalidates the coin catalog on bulk writes to coins, such as the
+    `Coin.query.delete()` of `sql/add_coins.py`, which skip the mapper events
+
+    Args:
+        orm_execute_state(ORMExecuteState): The statement being executed.
+    """
+    if (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is Coin.__mapper__:
+        coin_catalog.invalidate()
+
+
+def list_coins() -> list:
+    """
+    Function that retrieves all coins from the coin catalog
+
+    Returns:
+        list: A list of coins, in id order.
+    """
+    return list(coin_catalog.snapshot().coins)
+
+
+def get_coin_by_index(index: str):
+    """
+    Function that looks a coin up by its symbol at the price provider
+
+    Args:
+        index(str): The symbol of the coin (e.g. 'BTCUSDT').
+
+    Returns:
+        CatalogCoin: The coin, or None if no coin has this symbol.
+    """
+    return coin_catalog.snapshot().by_index.get(index)
@@ -0,0 +1,104 @@
+from datetime import datetime
+from decimal import Decimal
+import csv
+
+from flask import current_app
+from flask.cli import AppGroup
+import click
+
+from service import coins as coin_service
+from service import history as history_service
+from service import ledger as ledger_service
+from service import snapshots as snapshot_service
+from service.poller import PricePoller
+
+
+prices_cli = AppGroup('prices', help='Manage coin prices.')
+ledger_cli = AppGroup('ledger', help='Manage the trade ledger.')
+snapshots_cli = AppGroup('snapshots', help='Manage the daily portfolio snapshots.')
+
+
+@prices_cli.command('poll')
+@click.option('--interval', type=float, default=None,
+              help='Seconds between polls, PRICE_POLLER_INTERVAL by default.')
+@click.option('--once', is_flag=True, help='Poll a single time and exit.')
+def poll_prices(interval, once):
+    """
+    Keeps the prices of every listed coin warm in the price cache.
+
+    Meant to run as its own process next to gunicorn with the 'sqlite'
+    PRICE_CACHE_BACKEND, so that every worker reads the polled prices.
+    """
+    poller = PricePoller(
+        current_app._get_current_object(),  # pylint: disable=protected-access
+        interval=interval or current_app.config['PRICE_POLLER_INTERVAL'],
+        max_backoff=current_app.config['PRICE_POLLER_MAX_BACKOFF'],
+        record_history=current_app.config['PRICE_HISTORY_RECORD'],
+    )
+    if once:
+        prices = poller.poll_once()
+        click.echo(f"Refreshed {len(prices)} prices")
+        return
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        poller.stop()
+
+
+@prices_cli.command('import')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--batch-size', type=int, default=5000, help='Ticks inserted per transaction.')
+def import_prices(file, batch_size):
+    """
+    Bulk imports price ticks from a CSV file.
+
+    The file needs a header with 'symbol', 'timestamp' (ISO 8601, UTC) and
+    'price' columns. Rows of symbols that are not listed as a coin are skipped.
+    """
+    coin_ids = {coin.index: coin.id for coin in coin_service.list_coins()}
+    ticks = (
+        {
+            'coin_id': coin_ids[row['symbol']],
+            'timestamp': datetime.fromisoformat(row['timestamp']),
+            'price': Decimal(row['price']),
+        }
+        for row in csv.DictReader(file)
+        if row['symbol'] in coin_ids
+    )
+    count = history_service.ingest_ticks(ticks, batch_size=batch_size)
+    click.echo(f"Imported {count} price ticks")
+
+
+@ledger_cli.command('rebuild')
+@click.option('--user-id', type=int, default=None, help='Only rebuild the positions of a user.')
+def rebuild_positions(user_id):
+    """
+    Recomputes positions from the trade ledger in bulk.
+
+    Run it after importing trades directly into the database, or to repair
+    positions that drifted from the ledger.
+    """
+    count = ledger_service.rebuild_positions(user_id)
+    click.echo(f"Rebuilt {count} positions")
+
+
+@snapshots_cli.command('rollup')
+@click.option('--from-date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First day to roll up, the last rolled up day by default.')
+@click.option('--to-date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Last day to roll up, yesterday (UTC) by default.')
+@click.option('--batch-size', type=int, default=None,
+              help='Users per transaction, SNAPSHOT_BATCH_SIZE by default.')
+def rollup_snapshots(from_date, to_date, batch_size):
+    """
+    Computes the daily portfolio value of every user into snapshots.
+
+    Resumes from the last rolled up day, so it can run from cron every hour,
+    or be given a range of days to backfill.
+    """
+    days = snapshot_service.rollup_snapshots(
+        from_day=from_date.date() if from_date else None,
+        to_day=to_date.date() if to_date else None,
+        batch_size=batch_size or current_app.config['SNAPSHOT_BATCH_SIZE'],
+    )
+    click.echo(f"Rolled up {days} days")
@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+
+# bind key of the read replica in `SQLALCHEMY_BINDS`
+READ_REPLICA = 'replica'
+
+
+def _connect_args(url, connect_timeout: float, statement_timeout: int) -> dict:
+    """
+    Function that gives the driver arguments of the connection and statement timeouts
+    """
+    backend, driver = url.get_backend_name(), url.get_driver_name()
+    if backend == 'sqlite':
+        # SQLite has no connection to wait for, only locks held by other writers
+        return {'timeout': connect_timeout}
+    if backend == 'mysql':
+        args = {'connect_timeout': int(connect_timeout)}
+        if statement_timeout:
+            # only bounds SELECT statements, writes are left to innodb_lock_wait_timeout
+            args['init_command'] = f'SET SESSION max_execution_time={int(statement_timeout)}'
+        return args
+    if backend == 'postgresql':
+        if driver == 'asyncpg':
+            args = {'timeout': connect_timeout}
+            if statement_timeout:
+                args['server_settings'] = {'statement_timeout': str(int(statement_timeout))}
+            return args
+        args = {'connect_timeout': int(connect_timeout)}
+        if statement_timeout:
+            args['options'] = f'-c statement_timeout={int(statement_timeout)}'
+        return args
+    return {}
+
+
+def engine_options(uri: str, config) -> dict:
+    """
+    Function that builds the engine options of a database from the app settings
+
+    The pool is only sized for database servers, SQLite files are opened by the pool
+    the driver picks (e.g. no pool at all for aiosqlite).
+
+    Args:
+        uri(str): The uri of the database.
+        config: The app settings, see `app.configure_services`.
+
+    Returns:
+        dict: The keyword arguments of `create_engine`.
+    """
+    url = make_url(uri)
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'connect_args': _connect_args(
+            url, config['DB_CONNECT_TIMEOUT'], config['DB_STATEMENT_TIMEOUT']
+        ),
+    }
+    if url.get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+        )
+    return options
+
+
+def configure_database(config):
+    """
+    Function that sets the Flask-SQLAlchemy engine options of the primary database
+    and, if one is configured, of its read replica
+
+    Args:
+        config: The app settings, see `app.configure_services`.
+    """
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        config['SQLALCHEMY_DATABASE_URI'], config
+    )
+    replica = config['DATABASE_REPLICA_URL']
+    if replica:
+        config.setdefault('SQLALCHEMY_BINDS', {})[READ_REPLICA] = {
+            'url': replica, **engine_options(replica, config)
+        }
+
+
+class RoutingSession(Session):  # pylint: disable=too-few-public-methods
+    """
+    A session that sends the reads of `read_replica` blocks to the read replica.
+
+    Everything else, flushes and DML statements included, goes to the engine
+    Flask-SQLAlchemy picks, the primary database of the models. Without a configured
+    replica, reads go there too.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """
+        Function that selects the engine of a statement
+
+        Returns:
+            Engine: The read replica for the reads of a `read_replica` block, the
+            engine of the bind key of the model otherwise.
+        """
+        if (bind is None and self.info.get(READ_REPLICA) and not self._flushing
+                and not getattr(clause, 'is_dml', False)):
+            replica = self._db.engines.get(READ_REPLICA)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def read_replica():
+    """
+    Context manager, or decorator, that sends the queries of the database session to
+    the read replica
+
+    The replica may lag behind the primary, so only use it for reads that can be
+    slightly stale, and not to read back a write of the same request. Generators that
+    run after the block, such as streamed responses, read from the primary.
+    """
+    session = current_app.extensions['sqlalchemy'].session()
+    previous = session.info.get(READ_REPLICA, False)
+    session.info[READ_REPLICA] = True
+    try:
+        yield session
+    finally:
+        session.info[READ_REPLICA] = previous
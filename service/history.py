@@ -0,0 +1,108 @@
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import insert, select
+
+from models import PriceTick, db
+from service.coins import coin_catalog
+
+
+# functions that truncate a timestamp to the start of its bucket, by interval name
+INTERVALS = {
+    'minute': lambda timestamp: timestamp.replace(second=0, microsecond=0),
+    'hour': lambda timestamp: timestamp.replace(minute=0, second=0, microsecond=0),
+    'day': lambda timestamp: timestamp.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+def ingest_ticks(ticks, batch_size: int = 5000) -> int:
+    """
+    Function that bulk inserts price ticks
+
+    The ticks are consumed lazily and inserted with one executemany statement and
+    one transaction per batch, so arbitrarily long streams fit in memory.
+
+    Args:
+        ticks: An iterable of dictionaries with 'coin_id', 'timestamp' and 'price' keys.
+        batch_size(int): The number of ticks inserted per transaction.
+
+    Returns:
+        int: The number of inserted ticks.
+    """
+    count = 0
+    ticks = iter(ticks)
+    while batch := list(islice(ticks, batch_size)):
+        db.session.execute(insert(PriceTick), batch)
+        db.session.commit()
+        count += len(batch)
+    return count
+
+
+def record_prices(prices: dict, timestamp: datetime = None) -> int:
+    """
+    Function that stores a price snapshot as price ticks
+
+    Args:
+        prices(dict): A dictionary that maps a coin index to its price.
+        timestamp(datetime): The time the prices were observed at, now by default.
+
+    Returns:
+        int: The number of inserted ticks.
+    """
+    if not prices:
+        return 0
+    timestamp = timestamp or datetime.utcnow()
+    coins = coin_catalog.snapshot().by_index
+    return ingest_ticks(
+        {'coin_id': coins[index].id, 'timestamp': timestamp, 'price': price}
+        for index, price in prices.items() if index in coins
+    )
+
+
+def ohlc(coin_id: int, interval: str = 'hour', from_date: datetime = None,
+         to_date: datetime = None) -> list:
+    """
+    Function that downsamples the price history of a coin into OHLC candles
+
+    Ticks are streamed from the database in time order and folded into one
+    candle per interval, so memory only grows with the number of candles.
+
+    Args:
+        coin_id(int): The ID of the coin.
+        interval(str): The candle size, one of 'minute', 'hour' or 'day'.
+        from_date(datetime): The lower bound of the tick timestamps, if any.
+        to_date(datetime): The upper bound of the tick timestamps, if any.
+
+    Returns:
+        list: A list of dictionaries with 'time', 'open', 'high', 'low' and 'close' keys,
+        ordered by time.
+
+    Raises:
+        ValueError: If the interval is not supported.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"Unsupported interval '{interval}'")
+    truncate = INTERVALS[interval]
+
+    query = select(PriceTick.timestamp, PriceTick.price).where(PriceTick.coin_id == coin_id)
+    if from_date:
+        query = query.where(PriceTick.timestamp >= from_date)
+    if to_date:
+        query = query.where(PriceTick.timestamp <= to_date)
+    rows = db.session.execute(
+        query.order_by(PriceTick.timestamp).execution_options(yield_per=10000)
+    )
+
+    series = []
+    for timestamp, price in rows:  # pylint: disable=not-an-iterable
+        bucket = truncate(timestamp)
+        if series and series[-1]['time'] == bucket:
+            candle = series[-1]
+            candle['high'] = max(candle['high'], price)
+            candle['low'] = min(candle['low'], price)
+            candle['close'] = price
+        else:
+            series.append({
+                'time': bucket, 'open': price, 'high': price, 'low': price, 'close': price
+            })
+    return series
@@ -0,0 +1,330 @@
+from collections import deque
+from threading import Lock
+from urllib.parse import urlsplit
+import logging
+import os
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from service.metrics import record_upstream
+
+
+logger = logging.getLogger(__name__)
+
+# methods that are safe to send again after a failure
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+# response statuses that are retried, and counted as failures by the circuit breaker
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of calling a host whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker of an upstream host.
+
+    After `failures` failed calls in a row the circuit opens and calls are refused
+    without reaching the host. After `reset_timeout` seconds a single trial call is let
+    through (half-open), which closes the circuit if it succeeds or opens it again.
+
+    Attributes:
+        failures(int): The number of failures in a row that open the circuit.
+        reset_timeout(float): The number of seconds the circuit stays open.
+        state(str): Either 'closed', 'open' or 'half-open'.
+    """
+
+    def __init__(self, failures: int = 5, reset_timeout: float = 30.0, timer=time.monotonic):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failed = 0
+        self._opened_at = 0.0
+        self._timer = timer
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        """
+        Function that checks whether a call may be sent to the host
+
+        Returns:
+            bool: False while the circuit is open, True otherwise.
+        """
+        with self._lock:
+            if self.state == 'open' and self._timer() - self._opened_at >= self.reset_timeout:
+                self.state = 'half-open'
+                return True
+            return self.state == 'closed'
+
+    def record_success(self):
+        """
+        Function that closes the circuit after a successful call
+        """
+        with self._lock:
+            self.state = 'closed'
+            self._failed = 0
+
+    def record_failure(self):
+        """
+        Function that counts a failed call, opening the circuit if there were too many
+        """
+        with self._lock:
+            self._failed += 1
+            if self.state == 'half-open' or self._failed >= self.failures:
+                self.state = 'open'
+                self._opened_at = self._timer()
+
+
+class LatencyStats:
+    """
+    The latency metrics of the calls to an upstream host.
+
+    Attributes:
+        calls(int): The number of calls sent, retries included.
+        errors(int): The number of calls that failed or answered a retried status.
+        retries(int): The number of calls that were retries.
+        rejected(int): The number of calls refused by the open circuit breaker.
+        total(float): The total seconds spent in calls.
+        samples(deque): The latencies in seconds of the most recent calls.
+    """
+
+    def __init__(self, size: int = 1000):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=size)
+        self._lock = Lock()
+
+    def record(self, latency: float, failed: bool = False, retry: bool = False):
+        """
+        Function that records a call
+
+        Args:
+            latency(float): The seconds the call took.
+            failed(bool): Whether the call failed or answered a retried status.
+            retry(bool): Whether the call was a retry.
+        """
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+            self.retries += retry
+            self.total += latency
+            self.samples.append(latency)
+
+    def reject(self):
+        """
+        Function that records a call refused by the circuit breaker
+        """
+        with self._lock:
+            self.rejected += 1
+
+    def to_dict(self) -> dict:
+        """
+        Function that summarises the metrics
+
+        Returns:
+            dict: The counters, and the mean, p95 and max latency in milliseconds of
+            the most recent calls.
+        """
+        with self._lock:
+            ordered = sorted(self.samples)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'mean_ms': round(self.total / self.calls * 1000, 3) if self.calls else 0.0,
+            'p95_ms': round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 3) if ordered else 0.0,
+            'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        }
+
+
+class HttpClient:  # pylint: disable=too-many-instance-attributes
+    """
+    The HTTP client of every outbound call of a worker process.
+
+    Calls share a `requests.Session`, so connections to a host are pooled and kept alive
+    instead of paying a TCP and TLS handshake per call. Idempotent calls that fail to
+    connect, time out or answer a retried status are retried up to `retries` times with
+    exponential backoff and full jitter. Every host has its own circuit breaker and
+    latency metrics.
+
+    Attributes:
+        pool_size(int): The number of connections kept alive per host.
+        retries(int): The number of retries of a failed idempotent call.
+        backoff(float): The base number of seconds to wait before a retry.
+        circuit_failures(int): The number of failures in a row that open a circuit.
+        circuit_reset(float): The number of seconds a circuit stays open.
+    """
+
+    def __init__(self, pool_size: int = 10, retries: int = 2,  # pylint: disable=R0913
+                 backoff: float = 0.1, circuit_failures: int = 5, circuit_reset: float = 30.0,
+                 timer=time.monotonic, sleep=time.sleep):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.circuit_failures = circuit_failures
+        self.circuit_reset = circuit_reset
+        self._timer = timer
+        self._sleep = sleep
+        self._session = None
+        self._pid = None
+        self._breakers = {}
+        self._stats = {}
+        self._lock = Lock()
+
+    def configure(self, pool_size: int = None, retries: int = None,  # pylint: disable=R0913
+                  backoff: float = None, circuit_failures: int = None,
+                  circuit_reset: float = None):
+        """
+        Function that replaces the settings of the client, dropping its pooled connections,
+        circuit breakers and metrics
+
+        Args:
+            pool_size(int): The new number of connections kept alive per host, if given.
+            retries(int): The new number of retries, if given.
+            backoff(float): The new base backoff in seconds, if given.
+            circuit_failures(int): The new number of failures that open a circuit, if given.
+            circuit_reset(float): The new number of seconds a circuit stays open, if given.
+        """
+        with self._lock:
+            if pool_size is not None:
+                self.pool_size = pool_size
+            if retries is not None:
+                self.retries = retries
+            if backoff is not None:
+                self.backoff = backoff
+            if circuit_failures is not None:
+                self.circuit_failures = circuit_failures
+            if circuit_reset is not None:
+                self.circuit_reset = circuit_reset
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._breakers.clear()
+            self._stats.clear()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The pooled session of the worker process, created on first use and again after
+        a fork, so that workers never share sockets.
+        """
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session, self._pid = session, os.getpid()
+            return self._session
+
+    def _host(self, host: str) -> tuple:
+        """
+        Function that gets the circuit breaker and the latency metrics of a host together,
+        so a concurrent `configure` cannot drop one of them in between
+
+        Args:
+            host(str): The host name and port.
+
+        Returns:
+            tuple: The `CircuitBreaker` and the `LatencyStats` of the host.
+        """
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    self.circuit_failures, self.circuit_reset, self._timer
+                )
+                self._stats[host] = LatencyStats()
+            return self._breakers[host], self._stats[host]
+
+    def stats(self) -> dict:
+        """
+        Function that gets the metrics of the calls of the worker
+
+        Returns:
+            dict: The latency metrics and circuit state of every called host, by host.
+        """
+        with self._lock:
+            return {
+                host: {**stats.to_dict(), 'circuit': self._breakers[host].state}
+                for host, stats in self._stats.items()
+            }
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:  # pylint: disable=R0914
+        """
+        Function that sends a request through the pool, with retries and circuit breaking
+
+        Args:
+            method(str): The HTTP method.
+            url(str): The url to call.
+            **kwargs: The arguments of `requests.Session.request`, e.g. `params` or `timeout`.
+
+        Returns:
+            Response: The response. A retried status is returned once retries are exhausted.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker of the host is open.
+            requests.RequestException: If the last attempt failed.
+        """
+        host = urlsplit(url).netloc
+        breaker, stats = self._host(host)
+        attempts = 1 + (self.retries if method.upper() in IDEMPOTENT_METHODS else 0)
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                stats.reject()
+                raise CircuitOpenError(f'The circuit breaker of {host} is open')
+
+            error, response = None, None
+            start = self._timer()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as exception:
+                error = exception
+            failed = error is not None or response.status_code in RETRY_STATUSES
+            latency = self._timer() - start
+            stats.record(latency, failed=failed, retry=attempt > 0)
+            record_upstream(host, latency, failed=failed)
+
+            if not failed:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            # failures other than connecting or timing out, e.g. a broken body, are final
+            retried = error is None or isinstance(error, (requests.ConnectionError,
+                                                          requests.Timeout))
+            if attempt == attempts - 1 or not retried:
+                if error is not None:
+                    raise error
+                return response
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            logger.warning("HTTP - %s %s failed, retrying in %.3fs", method, url, delay)
+            self._sleep(delay)
+        return None  # unreachable, the last attempt returns or raises
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Function that sends a GET request, see `request`
+
+        Args:
+            url(str): The url to call.
+            **kwargs: The arguments of `requests.Session.request`.
+
+        Returns:
+            Response: The response.
+        """
+        return self.request('GET', url, **kwargs)
+
+
+# outbound HTTP calls of the worker
+http_client = HttpClient()
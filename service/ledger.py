@@ -0,0 +1,249 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import DateTime, case, delete, func, insert, literal, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from models import Position, Trade, User, db, format_amount
+from service.balances import validate_amount
+from service.coins import coin_catalog
+from service.prices import price_cache
+from service.valuation import format_value, required_symbols, value_holdings
+
+
+# kinds of trades that add to a position, and that take from it
+INCOMING = ('buy', 'transfer_in')
+OUTGOING = ('sell', 'transfer_out')
+TRADE_KINDS = INCOMING + OUTGOING
+
+# kinds of trades that have a price
+PRICED = ('buy', 'sell')
+
+# unique constraint of the positions, as named in the errors of MySQL and PostgreSQL,
+# and its columns as named in the errors of SQLite
+POSITION_CONSTRAINT = 'uq_position_user_id_coin_id'
+POSITION_COLUMNS = 'position.user_id, position.coin_id'
+
+# error codes of a deadlock, on MySQL and on PostgreSQL
+DEADLOCK_CODES = (1213, '40P01')
+
+
+def _decimal(value, name: str) -> Decimal:
+    """
+    Function that parses a decimal argument, raising a ValueError if it is not a number
+    """
+    try:
+        return Decimal(str(value))
+    except InvalidOperation as error:
+        raise ValueError(f"'{name}' must be a number") from error
+
+
+def _retryable(error) -> bool:
+    """
+    Function that tells whether a failed trade raced another one and can be retried
+
+    Two first trades of the same coin and user may both try to create its position,
+    or, on InnoDB, deadlock on the gap lock taken by `_move_position`.
+    """
+    if isinstance(error, IntegrityError):
+        message = str(error.orig)
+        return POSITION_CONSTRAINT in message or POSITION_COLUMNS in message
+    code = getattr(error.orig, 'pgcode', None) or \
+        next(iter(getattr(error.orig, 'args', ())), None)
+    return code in DEADLOCK_CODES
+
+
+def _move_position(user_id: int, coin_id: int, delta: Decimal, trade: Trade):
+    """
+    Function that applies a trade to the position of its user and coin
+
+    The position row is locked until the end of the transaction, so concurrent trades
+    of the same coin are applied one after the other.
+
+    Raises:
+        ValueError: If the trade takes more than the position holds.
+    """
+    position = db.session.scalars(
+        select(Position)
+        .where(Position.user_id == user_id, Position.coin_id == coin_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).first()
+    quantity = (position.quantity if position is not None else 0) + delta
+    if quantity < 0:
+        raise ValueError("Sadly you can't sell or transfer more than you hold")
+    if position is None:
+        position = Position(user_id=user_id, coin_id=coin_id)
+        db.session.add(position)
+    position.quantity = quantity
+    position.last_trade_id = trade.id
+    position.updated_at = datetime.utcnow()
+    db.session.flush()
+
+
+def record_trade(user_id: int, coin_id: int, kind: str, quantity,  # pylint: disable=R0913
+                 price=None, timestamp: datetime = None) -> Trade:
+    """
+    Function that appends a trade to the ledger and updates the position of its user
+    and coin in the same transaction
+
+    The first trades of a coin recorded concurrently by two workers may both try to
+    create its position, or deadlock while locking it, the one that failed is then
+    retried once.
+
+    Args:
+        user_id(int): The ID of the user who traded.
+        coin_id(int): The ID of the traded coin.
+        kind(str): Either 'buy', 'sell', 'transfer_in' or 'transfer_out'.
+        quantity: The traded amount, anything accepted by `Decimal`.
+        price: The price of one unit, required for buys and sells, ignored for transfers.
+        timestamp(datetime): The time of the trade, now by default.
+
+    Returns:
+        Trade: The recorded trade.
+
+    Raises:
+        ValueError: If the trade is invalid or takes more than the position holds,
+        with an appropriate error message.
+    """
+    if kind not in TRADE_KINDS:
+        raise ValueError(f"'kind' must be one of {', '.join(TRADE_KINDS)}")
+    quantity = validate_amount(_decimal(quantity, 'quantity'))
+    if kind in PRICED:
+        if price is None:
+            raise ValueError("'price' is required for buys and sells")
+        price = _decimal(price, 'price')
+        if not price.is_finite() or price <= 0:
+            raise ValueError("'price' must be positive")
+    else:
+        price = None
+    if not coin_catalog.by_id([coin_id]):
+        raise ValueError(f"Unknown coin '{coin_id}'")
+    if db.session.scalar(select(User.id).where(User.id == user_id)) is None:
+        raise ValueError(f"Unknown user '{user_id}'")
+
+    delta = quantity if kind in INCOMING else -quantity
+    for attempt in range(2):
+        try:
+            trade = Trade(user_id=user_id, coin_id=coin_id, kind=kind, quantity=quantity,
+                          price=price, timestamp=timestamp or datetime.utcnow())
+            db.session.add(trade)
+            db.session.flush()
+            _move_position(user_id, coin_id, delta, trade)
+            db.session.commit()
+            return trade
+        except (IntegrityError, OperationalError) as error:
+            db.session.rollback()
+            if attempt or not _retryable(error):
+                raise
+        except ValueError:
+            db.session.rollback()
+            raise
+    return None
+
+
+def list_trades(user_id: int, cursor: int = None, limit: int = 100) -> tuple:
+    """
+    Function that gets a page of the trades of a user with keyset pagination
+
+    Args:
+        user_id(int): The ID of the user whose trades to retrieve.
+        cursor(int): Only trades with a greater ID are returned, if given.
+        limit(int): The maximum number of trades of the page.
+
+    Returns:
+        tuple: The list of trade dictionaries of the page in ledger order, and the cursor
+        of the next page (None on the last page).
+    """
+    query = select(Trade).where(Trade.user_id == user_id).order_by(Trade.id).limit(limit + 1)
+    if cursor is not None:
+        query = query.where(Trade.id > cursor)
+    trades = [trade.to_dict() for trade in db.session.scalars(query).all()]
+    if len(trades) > limit:
+        return trades[:limit], trades[limit - 1]['id']
+    return trades, None
+
+
+def list_positions(user_id: int) -> dict:
+    """
+    Function that gets the open positions of a user, valued at the latest cached price
+    of their coins
+
+    Positions are read from one row per coin, so the cost does not depend on the
+    length of the trade history.
+
+    Args:
+        user_id(int): The ID of the user whose positions to retrieve.
+
+    Returns:
+        dict: A dictionary with the following keys:
+        - positions: A list of dictionaries with 'coin_id', 'coin', 'quantity' and 'value'
+          (None if the price of the coin is unknown) keys, ordered by coin abbreviation.
+        - total: The total value of the positions with a known price.
+    """
+    rows = db.session.execute(
+        select(Position.coin_id, Position.quantity)
+        .where(Position.user_id == user_id, Position.quantity > 0)
+    ).all()
+    coins = coin_catalog.by_id(row.coin_id for row in rows)
+    positions = sorted(
+        ((coins[row.coin_id], row.quantity) for row in rows if row.coin_id in coins),
+        key=lambda position: position[0].abbreviation or ''
+    )
+    prices = price_cache.get_prices(required_symbols(coin.index for coin, _ in positions))
+    valuation = value_holdings(
+        ((coin.index, quantity) for coin, quantity in positions),
+        prices,
+        bases={coin.index: coin.abbreviation for coin, _ in positions},
+    )
+    return {
+        'positions': [
+            {
+                'coin_id': coin.id,
+                'coin': coin.abbreviation,
+                'quantity': format_amount(quantity),
+                'value': format_value(value),
+            }
+            for (coin, quantity), value in zip(positions, valuation.values)
+        ],
+        'total': format_value(valuation.total),
+    }
+
+
+def rebuild_positions(user_id: int = None) -> int:
+    """
+    Function that recomputes positions from the trade ledger
+
+    The positions are deleted and inserted again from a single aggregate query over the
+    ledger, in one transaction, so the database does the work in bulk. Trades recorded
+    while the rebuild runs may be missed, run it again after them.
+
+    Args:
+        user_id(int): The ID of the user whose positions to rebuild, every user if None.
+
+    Returns:
+        int: The number of rebuilt positions.
+    """
+    signed_quantity = case((Trade.kind.in_(INCOMING), Trade.quantity), else_=-Trade.quantity)
+    totals = (
+        select(
+            Trade.user_id,
+            Trade.coin_id,
+            func.sum(signed_quantity),  # pylint: disable=not-callable
+            func.max(Trade.id),  # pylint: disable=not-callable
+            literal(datetime.utcnow(), DateTime),
+        )
+        .group_by(Trade.user_id, Trade.coin_id)
+    )
+    stale = delete(Position)
+    if user_id is not None:
+        totals = totals.where(Trade.user_id == user_id)
+        stale = stale.where(Position.user_id == user_id)
+    db.session.execute(stale)
+    rebuilt = db.session.execute(
+        insert(Position).from_select(
+            ['user_id', 'coin_id', 'quantity', 'last_trade_id', 'updated_at'], totals
+        )
+    ).rowcount
+    db.session.commit()
+    return rebuilt
@@ -0,0 +1,199 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Full, Queue
+import atexit
+import copy
+import json
+import logging
+import random
+
+
+# format of the text log lines
+TEXT_FORMAT = "%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# handlers installed on the root logger by `configure_logging`, the handlers writing
+# the records and the listener of the 'queue' mode
+_installed = {'handlers': [], 'outputs': [], 'listener': None}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as JSON objects, one per line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Function that formats a log record, merging its arguments into its message
+
+        Args:
+            record(LogRecord): The log record.
+
+        Returns:
+            str: A JSON object with the 'time', 'level', 'logger', 'message', 'process'
+            and 'thread' of the record, and its 'exception' if any.
+        """
+        entry = {
+            'time': f'{self.formatTime(record, DATE_FORMAT)}.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    Keeps a share of the chatty log records, and every record above a level.
+
+    A record is only drawn once, the decision is kept on the record, so that every
+    handler sharing the filter keeps the same sample.
+
+    Attributes:
+        rate(float): The share of the records kept, from 0 to 1.
+        level(int): The highest level that is sampled, INFO by default.
+    """
+
+    def __init__(self, rate: float = 1.0, level: int = logging.INFO, rng=random.random):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+        self._random = rng
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Function that decides whether a record is logged
+
+        Args:
+            record(LogRecord): The log record.
+
+        Returns:
+            bool: True if the record is above the sampled level or sampled in.
+        """
+        sampled = getattr(record, 'sampled', None)
+        if sampled is None:
+            sampled = record.levelno > self.level or self.rate >= 1 \
+                or self._random() < self.rate
+            record.sampled = sampled
+        return sampled
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Hands log records over to a `QueueListener` thread without formatting them.
+
+    The stock `QueueHandler` merges the arguments into the message in the logging
+    thread, this one leaves all formatting to the listener thread, so a log call only
+    costs the request thread a record and a queue put. Records are dropped instead of
+    blocking when the queue is full.
+
+    Attributes:
+        dropped(int): The number of records dropped because the queue was full.
+    """
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Function that gets the record to enqueue, a shallow copy of the logged one
+
+        Args:
+            record(LogRecord): The log record.
+
+        Returns:
+            LogRecord: The record to enqueue.
+        """
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Function that enqueues a record, dropping it if the queue is full
+
+        Args:
+            record(LogRecord): The log record.
+        """
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+def reset_logging():
+    """
+    Function that removes the log handlers installed by `configure_logging`, after the
+    listener of the 'queue' mode, if any, has written the records left in the queue
+    """
+    logger = logging.getLogger()
+    for handler in _installed['handlers']:
+        logger.removeHandler(handler)
+    if _installed['listener'] is not None:
+        _installed['listener'].stop()
+        _installed['listener'] = None
+    for handler in _installed['outputs']:
+        handler.close()
+    _installed['handlers'] = []
+    _installed['outputs'] = []
+
+
+atexit.register(reset_logging)
+
+
+def configure_logging(mode: str = 'sync', fmt: str = 'text',  # pylint: disable=R0913
+                      level: str = 'WARNING', path: str = 'logs.log',
+                      sample_rate: float = 1.0, queue_size: int = 10000):
+    """
+    Function that installs the log handlers of the app on the root logger, replacing the
+    ones installed by a previous call
+
+    Records are written to the console and to a rotating file. In 'sync' mode they are
+    written by the logging thread. In 'queue' mode they are handed to a background
+    thread, so that slow disks don't add to the latency of requests.
+
+    Args:
+        mode(str): Either 'sync' or 'queue'.
+        fmt(str): Either 'text' or 'json' (one JSON object per line).
+        level(str): The lowest level logged.
+        path(str): The path of the log file.
+        sample_rate(float): The share of the INFO and DEBUG records kept, from 0 to 1.
+        queue_size(int): The number of records the queue holds before dropping new ones.
+
+    Returns:
+        QueueListener: The started listener in 'queue' mode, None in 'sync' mode.
+    """
+    reset_logging()
+
+    formatter = JsonFormatter() if fmt == 'json' else \
+        logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    console_log = logging.StreamHandler()
+    file_log = RotatingFileHandler(path, maxBytes=1024 * 1000)
+    outputs = [console_log, file_log]
+    for handler in outputs:
+        handler.setFormatter(formatter)
+
+    listener = None
+    if mode == 'queue':
+        queue_log = LazyQueueHandler(Queue(queue_size))
+        listener = QueueListener(queue_log.queue, *outputs, respect_handler_level=True)
+        listener.start()
+        handlers = [queue_log]
+    else:
+        handlers = outputs
+
+    # a single filter for every handler, so the console and the file keep the same
+    # records; on the root logger itself it would miss the records of other loggers
+    sampler = SamplingFilter(sample_rate)
+    for handler in handlers:
+        handler.addFilter(sampler)
+        logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(level)
+    _installed['handlers'] = handlers
+    _installed['outputs'] = outputs
+    _installed['listener'] = listener
+    return listener
@@ -0,0 +1,335 @@
+from contextlib import contextmanager
+from threading import Lock
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# buckets of the latency histograms, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# buckets of the histogram of the number of queries per request
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# type and help text of every metric, by name
+METRICS = {
+    'cryptex_requests_total': (
+        'counter', 'Requests served, by endpoint, method and status.'),
+    'cryptex_request_duration_seconds': (
+        'histogram', 'Time spent handling a request, by endpoint.'),
+    'cryptex_request_db_queries': (
+        'histogram', 'SQL queries executed by a request, by endpoint.'),
+    'cryptex_request_db_seconds': (
+        'histogram', 'Time spent in SQL queries by a request, by endpoint.'),
+    'cryptex_upstream_request_duration_seconds': (
+        'histogram', 'Time spent in outbound HTTP calls, by host.'),
+    'cryptex_upstream_errors_total': (
+        'counter', 'Outbound HTTP calls that failed or answered a retried status, by host.'),
+    'cryptex_upstream_circuit_open': (
+        'gauge', 'Whether the circuit breaker of a host is open (1) or not (0).'),
+    'cryptex_cache_hits_total': ('counter', 'Cache hits, by cache.'),
+    'cryptex_cache_misses_total': ('counter', 'Cache misses, by cache.'),
+    'cryptex_cache_entries': ('gauge', 'Entries held by a cache.'),
+}
+
+# media type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:  # pylint: disable=too-few-public-methods
+    """
+    A Prometheus histogram with cumulative buckets.
+
+    Attributes:
+        buckets(tuple): The upper bounds of the buckets.
+        counts(list): The number of observations per bucket (not cumulative).
+        total(float): The sum of the observations.
+        count(int): The number of observations.
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        Function that records an observation
+
+        Args:
+            value(float): The observed value.
+        """
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    The metrics of a worker process.
+
+    Every worker keeps its own metrics, so a scrape through a load balancer sees the
+    worker that served it; scrape the workers one by one, or run a single worker per
+    exposed port.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """
+        Function that increments a counter
+
+        Args:
+            name(str): The name of the counter.
+            amount(float): The increment.
+            **labels: The labels of the counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets: tuple = DURATION_BUCKETS, **labels):
+        """
+        Function that records an observation of a histogram
+
+        Args:
+            name(str): The name of the histogram.
+            value(float): The observed value.
+            buckets(tuple): The buckets of the histogram, when it is created.
+            **labels: The labels of the histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def clear(self):
+        """
+        Function that drops every metric
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self, samples=()) -> str:
+        """
+        Function that formats the metrics in the Prometheus text format
+
+        Args:
+            samples: An iterable of (name, labels, value) tuples of metrics collected
+                at scrape time, such as gauges.
+
+        Returns:
+            str: The metrics exposition.
+        """
+        lines = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                lines.setdefault(name, []).append(_sample(name, labels, value))
+            for (name, labels), histogram in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.setdefault(name, []).append(
+                        _sample(f'{name}_bucket', labels + (('le', f'{bound:g}'),), cumulative)
+                    )
+                lines[name] += [
+                    _sample(f'{name}_bucket', labels + (('le', '+Inf'),), histogram.count),
+                    _sample(f'{name}_sum', labels, histogram.total),
+                    _sample(f'{name}_count', labels, histogram.count),
+                ]
+        for name, labels, value in samples:
+            lines.setdefault(name, []).append(_sample(name, tuple(sorted(labels.items())), value))
+
+        output = []
+        for name in sorted(lines):
+            kind, description = METRICS.get(name, ('untyped', name))
+            output += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', *lines[name]]
+        return '\n'.join(output) + '\n'
+
+
+def _sample(name: str, labels: tuple, value) -> str:
+    """
+    Function that formats a sample line of the Prometheus text format
+    """
+    if labels:
+        escaped = (
+            str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            for _, label in labels
+        )
+        pairs = ','.join(f'{key}="{label}"' for (key, _), label in zip(labels, escaped))
+        return f'{name}{{{pairs}}} {value:g}'
+    return f'{name} {value:g}'
+
+
+# metrics of the worker
+registry = MetricsRegistry()
+
+
+class RequestMetrics:  # pylint: disable=too-few-public-methods
+    """
+    Where the time of the current request goes.
+
+    Attributes:
+        start(float): The time the request started at.
+        queries(int): The number of SQL queries executed.
+        query_seconds(float): The time spent in SQL queries.
+        upstream_calls(int): The number of outbound HTTP calls.
+        upstream_seconds(float): The time spent in outbound HTTP calls.
+        timings(dict): The seconds spent in named steps, see `timed`.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.timings = {}
+
+    def server_timing(self, total: float) -> str:
+        """
+        Function that formats the metrics as a `Server-Timing` header
+
+        Args:
+            total(float): The seconds the request took.
+
+        Returns:
+            str: The value of the header, durations being in milliseconds.
+        """
+        entries = [f'db;dur={self.query_seconds * 1000:.1f};desc="{self.queries} queries"']
+        if self.upstream_calls:
+            entries.append(f'upstream;dur={self.upstream_seconds * 1000:.1f};'
+                           f'desc="{self.upstream_calls} calls"')
+        entries += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.timings.items()]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+def current_request():
+    """
+    Function that gets the metrics of the current request
+
+    Returns:
+        RequestMetrics: The metrics, or None outside of an instrumented request.
+    """
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Context manager that adds the time spent in a step of the current request to its
+    `Server-Timing` header
+
+    Args:
+        name(str): The name of the step (e.g. 'render').
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current_request()
+        if metrics is not None:
+            metrics.timings[name] = metrics.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_upstream(host: str, seconds: float, failed: bool = False):
+    """
+    Function that records an outbound HTTP call
+
+    Args:
+        host(str): The host name and port.
+        seconds(float): The time the call took.
+        failed(bool): Whether the call failed or answered a retried status.
+    """
+    registry.observe('cryptex_upstream_request_duration_seconds', seconds, host=host)
+    if failed:
+        registry.inc('cryptex_upstream_errors_total', host=host)
+    metrics = current_request()
+    if metrics is not None:
+        metrics.upstream_calls += 1
+        metrics.upstream_seconds += seconds
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=R0913,W0613
+    """
+    Function that notes when a SQL query starts
+    """
+    conn.info['query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=R0913,W0613
+    """
+    Function that counts a SQL query and its time in the metrics of the current request
+    """
+    seconds = time.perf_counter() - conn.info.pop('query_start', time.perf_counter())
+    metrics = current_request()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.query_seconds += seconds
+
+
+def init_metrics(app, caches: dict = None, http_client=None):
+    """
+    Function that instruments the requests of an app and serves its metrics at `/metrics`
+
+    Every response gets a `Server-Timing` header with the time spent in SQL queries,
+    outbound HTTP calls and the steps measured with `timed`.
+
+    Args:
+        app: The Flask app to instrument.
+        caches(dict): The caches whose usage is exposed, by name, each with a `stats` method.
+        http_client(HttpClient): The HTTP client whose circuit breakers are exposed.
+    """
+    caches = caches or {}
+
+    @app.before_request
+    def start_request():
+        g.request_metrics = RequestMetrics()
+
+    @app.after_request
+    def end_request(response):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return response
+        total = time.perf_counter() - metrics.start
+        endpoint = request.endpoint or 'unknown'
+        registry.inc('cryptex_requests_total', endpoint=endpoint, method=request.method,
+                     status=response.status_code)
+        registry.observe('cryptex_request_duration_seconds', total, endpoint=endpoint)
+        registry.observe('cryptex_request_db_queries', metrics.queries, QUERY_BUCKETS,
+                         endpoint=endpoint)
+        registry.observe('cryptex_request_db_seconds', metrics.query_seconds, endpoint=endpoint)
+        response.headers['Server-Timing'] = metrics.server_timing(total)
+        return response
+
+    def collect():
+        for name, cache in caches.items():
+            stats = cache.stats()
+            yield 'cryptex_cache_hits_total', {'cache': name}, stats['hits']
+            yield 'cryptex_cache_misses_total', {'cache': name}, stats['misses']
+            yield 'cryptex_cache_entries', {'cache': name}, stats['size']
+        if http_client is not None:
+            for host, stats in http_client.stats().items():
+                yield 'cryptex_upstream_circuit_open', {'host': host}, \
+                    int(stats['circuit'] == 'open')
+
+    def metrics_view():
+        return app.response_class(registry.render(collect()), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
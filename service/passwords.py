@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, gen_salt, generate_password_hash
+
+try:
+    import argon2
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:  # argon2-cffi is an optional dependency
+    argon2 = None
+
+
+# the method is the prefix of the hashes it produces and carries its cost parameters:
+#   pbkdf2:<hash>:<iterations>
+#   scrypt:<n>:<r>:<p>
+#   argon2:<time cost>:<memory cost in KiB>:<parallelism>  (needs argon2-cffi)
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+SALT_LENGTH = 16
+
+
+def configured_method() -> str:
+    """
+    Function that gets the password hashing method of the app
+
+    Returns:
+        str: The `PASSWORD_HASH_METHOD` setting, or the default method outside an app.
+    """
+    if has_app_context():
+        return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+    return DEFAULT_METHOD
+
+
+def _argon2_hasher(method: str):
+    if argon2 is None:
+        raise RuntimeError("The 'argon2' password hashing method needs argon2-cffi installed")
+    time_cost, memory_cost, parallelism = (int(value) for value in method.split(':')[1:])
+    return argon2.PasswordHasher(
+        time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism
+    )
+
+
+def _scrypt(password: str, salt: str, n: int, r: int, p: int) -> str:
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt.encode('utf-8'),
+        n=n, r=r, p=p, maxmem=132 * n * r * p
+    ).hex()
+
+
+def hash_password(password: str, method: str = None) -> str:
+    """
+    Function that hashes a password with a salt
+
+    Scrypt hashes use the same format as Werkzeug 2.3 and later, so they can still be
+    verified after upgrading it.
+
+    Args:
+        password(str): The plaintext password.
+        method(str): The hashing method, the configured one by default.
+
+    Returns:
+        str: The password hash, prefixed with its method.
+
+    Raises:
+        ValueError: If the method is not supported.
+    """
+    method = method or configured_method()
+    name = method.split(':', 1)[0]
+    if name == 'pbkdf2':
+        return generate_password_hash(password, method, SALT_LENGTH)
+    if name == 'scrypt':
+        n, r, p = (int(value) for value in method.split(':')[1:])
+        salt = gen_salt(SALT_LENGTH)
+        return f"{method}${salt}${_scrypt(password, salt, n, r, p)}"
+    if name == 'argon2':
+        return _argon2_hasher(method).hash(password)
+    raise ValueError(f"Unsupported password hashing method '{method}'")
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    """
+    Function that checks a password against a hash made by any supported method,
+    including the salted 'sha256' hashes of older versions
+
+    Args:
+        password_hash(str): The stored password hash.
+        password(str): The plaintext password to verify.
+
+    Returns:
+        bool: True if the password is correct, False otherwise.
+    """
+    if not password_hash:
+        return False
+    if password_hash.startswith('$argon2'):
+        if argon2 is None:
+            raise RuntimeError("Verifying argon2 password hashes needs argon2-cffi installed")
+        try:
+            return argon2.PasswordHasher().verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    if password_hash.startswith('scrypt:'):
+        method, salt, digest = password_hash.split('$', 2)
+        n, r, p = (int(value) for value in method.split(':')[1:])
+        return hmac.compare_digest(_scrypt(password, salt, n, r, p), digest)
+    return check_password_hash(password_hash, password)
+
+
+def needs_rehash(password_hash: str, method: str = None) -> bool:
+    """
+    Function that checks whether a password hash was made with another method or
+    other cost parameters than the configured ones
+
+    Args:
+        password_hash(str): The stored password hash.
+        method(str): The wanted hashing method, the configured one by default.
+
+    Returns:
+        bool: True if the password should be hashed again.
+    """
+    method = method or configured_method()
+    if password_hash.startswith('$argon2'):
+        if not method.startswith('argon2:'):
+            return True
+        return _argon2_hasher(method).check_needs_rehash(password_hash)
+    return password_hash.split('$', 1)[0] != method
@@ -0,0 +1,117 @@
+from threading import Event, Thread
+import logging
+
+from service import coins as coin_service
+from service import history as history_service
+from service.prices import price_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+class PricePoller:  # pylint: disable=too-many-instance-attributes
+    """
+    Keeps the prices of every listed coin warm in the price cache.
+
+    The poller refreshes the prices of all rows of the `Coin` table every `interval`
+    seconds. After a failed poll it waits twice as long as before, up to `max_backoff`
+    seconds, and goes back to `interval` after the first successful poll.
+
+    Attributes:
+        app: The Flask app whose coins to poll.
+        cache(PriceCache): The price cache the prices are stored into.
+        interval(float): The number of seconds between successful polls.
+        max_backoff(float): The maximum number of seconds between failed polls.
+        record_history(bool): Whether polled prices are stored as price ticks.
+        failures(int): The number of consecutive failed polls.
+    """
+
+    def __init__(self, app, cache=price_cache, interval: float = 10.0,  # pylint: disable=R0913
+                 max_backoff: float = 300.0, record_history: bool = False):
+        self.app = app
+        self.record_history = record_history
+        self.cache = cache
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self._stop = Event()
+        self._thread = None
+
+    def symbols(self) -> set:
+        """
+        Function that gets the indexes of every listed coin
+
+        Returns:
+            set: The coin indexes.
+        """
+        with self.app.app_context():
+            return {coin.index for coin in coin_service.list_coins()}
+
+    def poll_once(self) -> dict:
+        """
+        Function that refreshes the prices of every listed coin once
+
+        Returns:
+            dict: A dictionary that maps a coin index to its price as a Decimal.
+        """
+        symbols = self.symbols()
+        if not symbols:
+            return {}
+        prices = self.cache.refresh(symbols)
+        if self.record_history:
+            with self.app.app_context():
+                history_service.record_prices(prices)
+        return prices
+
+    def next_delay(self) -> float:
+        """
+        Function that gives the number of seconds to wait before the next poll
+
+        Returns:
+            float: The delay, doubled for every consecutive failure.
+        """
+        if not self.failures:
+            return self.interval
+        return min(self.interval * 2 ** self.failures, self.max_backoff)
+
+    def run_once(self):
+        """
+        Function that polls once and keeps track of consecutive failures
+        """
+        try:
+            prices = self.poll_once()
+            self.failures = 0
+            logger.debug("POLLER - Refreshed %s prices", len(prices))
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.failures += 1
+            logger.exception("POLLER - Poll failed %s time(s) in a row", self.failures)
+
+    def run(self):
+        """
+        Function that polls until the poller is stopped
+        """
+        logger.info("POLLER - Started with interval %ss", self.interval)
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.next_delay())
+        logger.info("POLLER - Stopped")
+
+    def start(self):
+        """
+        Function that starts polling in a background daemon thread
+        """
+        self._stop.clear()
+        self._thread = Thread(target=self.run, name='price-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Function that stops polling and waits for the background thread to end
+
+        Args:
+            timeout(float): The maximum number of seconds to wait.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
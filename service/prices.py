@@ -0,0 +1,396 @@
+from concurrent.futures import Future
+from decimal import Decimal
+from threading import Lock, Thread, local
+import json
+import logging
+import math
+import sqlite3
+import time
+
+from service.http import http_client
+
+
+logger = logging.getLogger(__name__)
+
+# status of the answers of Binance API to a call with a symbol it does not list
+INVALID_SYMBOL_STATUS = 400
+
+
+def fetch_prices(symbols, url: str, timeout: float = 5) -> dict:
+    """
+    Function that retrieves the latest prices for the given symbols from Binance API
+    through the pooled HTTP client of the worker
+
+    Args:
+        symbols: An iterable of coin indexes (e.g. 'BTCUSDT').
+        url(str): The url of the ticker price endpoint.
+        timeout(float): The number of seconds to wait for the response.
+
+    A single symbol Binance does not list fails the whole call with a 400 error, the
+    symbols are then fetched one by one and the unlisted ones are left out.
+
+    Returns:
+        dict: A dictionary that maps a coin index to its price as a Decimal.
+
+    Raises:
+        requests.RequestException: If the call failed or was answered with an error.
+        ValueError: If the answer is not a list of prices.
+    """
+    symbols = sorted(set(symbols))
+    if not symbols:
+        return {}
+    response = _get_prices(symbols, url, timeout)
+    if response.status_code != INVALID_SYMBOL_STATUS or len(symbols) == 1:
+        response.raise_for_status()
+        return parse_prices(response.json())
+
+    prices = {}
+    for symbol in symbols:
+        response = _get_prices([symbol], url, timeout)
+        if response.status_code == INVALID_SYMBOL_STATUS:
+            logger.warning("PRICES - The price API does not list %s", symbol)
+            continue
+        response.raise_for_status()
+        prices.update(parse_prices(response.json()))
+    return prices
+
+
+def _get_prices(symbols: list, url: str, timeout: float):
+    return http_client.get(
+        url,
+        params={'symbols': json.dumps(symbols, separators=(',', ':'))},
+        timeout=timeout
+    )
+
+
+def parse_prices(answer) -> dict:
+    """
+    Function that reads the prices of a ticker price answer of Binance API
+
+    Args:
+        answer: The decoded JSON body of the answer.
+
+    Returns:
+        dict: A dictionary that maps a coin index to its price as a Decimal.
+
+    Raises:
+        ValueError: If the answer is not a list of prices, e.g. a Binance error.
+    """
+    if not isinstance(answer, list):
+        raise ValueError(f'Unexpected answer of the price API: {str(answer)[:200]}')
+    return {index['symbol']: Decimal(index['price']) for index in answer}
+
+
+class MemoryPriceStore:
+    """
+    A price store that keeps prices in the memory of the worker process.
+    """
+
+    def __init__(self):
+        self._prices = {}
+        self._version = 0
+        self._lock = Lock()
+
+    def version(self) -> int:
+        """
+        Function that gets the version of the stored prices
+
+        Returns:
+            int: A number that changes whenever prices are stored.
+        """
+        with self._lock:
+            return self._version
+
+    def get_many(self, symbols) -> dict:
+        """
+        Function that gets the stored prices of the given symbols
+
+        Args:
+            symbols: An iterable of coin indexes.
+
+        Returns:
+            dict: A dictionary that maps every stored symbol to a (price, fetched_at) tuple.
+        """
+        with self._lock:
+            return {symbol: self._prices[symbol] for symbol in symbols if symbol in self._prices}
+
+    def set_many(self, prices: dict, fetched_at: float):
+        """
+        Function that stores prices
+
+        Args:
+            prices(dict): A dictionary that maps a coin index to its price.
+            fetched_at(float): The unix time the prices were fetched at.
+        """
+        with self._lock:
+            for symbol, price in prices.items():
+                self._prices[symbol] = (price, fetched_at)
+            self._version += bool(prices)
+
+
+class SQLitePriceStore:
+    """
+    A price store backed by a SQLite file, shared by every worker process on the host.
+
+    Attributes:
+        path(str): The path of the SQLite file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = local()
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS price '
+                '(symbol TEXT PRIMARY KEY, price TEXT NOT NULL, fetched_at REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS price_version '
+                '(id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)'
+            )
+            connection.execute('INSERT OR IGNORE INTO price_version VALUES (0, 0)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def version(self) -> int:
+        """
+        Function that gets the version of the stored prices, shared by the workers
+
+        Returns:
+            int: A number that changes whenever prices are stored.
+        """
+        return self._connection().execute(
+            'SELECT version FROM price_version WHERE id = 0'
+        ).fetchone()[0]
+
+    def get_many(self, symbols) -> dict:
+        """
+        Function that gets the stored prices of the given symbols
+
+        Args:
+            symbols: An iterable of coin indexes.
+
+        Returns:
+            dict: A dictionary that maps every stored symbol to a (price, fetched_at) tuple.
+        """
+        symbols = list(symbols)
+        if not symbols:
+            return {}
+        rows = self._connection().execute(
+            f'SELECT symbol, price, fetched_at FROM price '
+            f'WHERE symbol IN ({",".join("?" * len(symbols))})',
+            symbols
+        )
+        return {symbol: (Decimal(price), fetched_at) for symbol, price, fetched_at in rows}
+
+    def set_many(self, prices: dict, fetched_at: float):
+        """
+        Function that stores prices
+
+        Args:
+            prices(dict): A dictionary that maps a coin index to its price.
+            fetched_at(float): The unix time the prices were fetched at.
+        """
+        if not prices:
+            return
+        with self._connection() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO price (symbol, price, fetched_at) VALUES (?, ?, ?)',
+                [(symbol, str(price), fetched_at) for symbol, price in prices.items()]
+            )
+            connection.execute('UPDATE price_version SET version = version + 1 WHERE id = 0')
+
+
+class PriceCache:  # pylint: disable=too-many-instance-attributes
+    """
+    A cache of coin prices in front of the upstream price API.
+
+    Prices younger than `ttl` are served from the store. Prices older than that but
+    younger than `ttl + stale_ttl` are still served, while a background thread fetches
+    fresh ones (stale-while-revalidate). Missing or older prices are fetched before
+    returning. Concurrent requests for the same symbols in a worker share a single
+    in-flight upstream request.
+
+    Prices that cannot be fetched are left out, so the holdings of such coins are
+    valued as unknown instead of failing the whole request. Symbols the upstream does
+    not answer for, e.g. delisted coins, are not asked for again for `ttl + stale_ttl`
+    seconds.
+
+    Attributes:
+        store: The price store, either a `MemoryPriceStore` or a `SQLitePriceStore`.
+        fetcher: A callable that takes a set of symbols and returns their prices.
+        ttl(float): The number of seconds a price is fresh.
+        stale_ttl(float): The number of seconds a price is still served after it went stale.
+    """
+
+    def __init__(self, store=None, fetcher=None, ttl: float = 10.0,  # pylint: disable=R0913
+                 stale_ttl: float = 60.0, timer=time.time):
+        self.store = store or MemoryPriceStore()
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._timer = timer
+        self._inflight = {}
+        self._unknown = {}
+        self._lock = Lock()
+
+    def configure(self, store=None, fetcher=None, ttl: float = None, stale_ttl: float = None):
+        """
+        Function that replaces the settings of the cache
+
+        Args:
+            store: The new price store, if given.
+            fetcher: The new upstream fetcher, if given.
+            ttl(float): The new freshness in seconds, if given.
+            stale_ttl(float): The new stale window in seconds, if given.
+        """
+        if store is not None:
+            self.store = store
+        if fetcher is not None:
+            self.fetcher = fetcher
+        if ttl is not None:
+            self.ttl = ttl
+        if stale_ttl is not None:
+            self.stale_ttl = stale_ttl
+
+    def version(self) -> int:
+        """
+        Function that gets the version of the price snapshot of the store
+
+        Returns:
+            int: A number that changes whenever fresh prices are stored.
+        """
+        return self.store.version()
+
+    def get_prices(self, symbols) -> dict:
+        """
+        Function that gets the prices of the given symbols
+
+        Args:
+            symbols: An iterable of coin indexes.
+
+        Returns:
+            dict: A dictionary that maps a coin index to its price as a Decimal.
+        """
+        symbols = set(symbols)
+        if not symbols:
+            return {}
+
+        now = self._timer()
+        prices, stale, missing = {}, set(), set()
+        for symbol, (price, fetched_at) in self.store.get_many(symbols).items():
+            age = now - fetched_at
+            if age < self.ttl + self.stale_ttl:
+                prices[symbol] = price
+                if age >= self.ttl:
+                    stale.add(symbol)
+        with self._lock:
+            missing = {
+                symbol for symbol in symbols - prices.keys()
+                if now - self._unknown.get(symbol, -math.inf) >= self.ttl + self.stale_ttl
+            }
+
+        if stale:
+            self._refresh_in_background(stale)
+        if missing:
+            try:
+                prices.update(self.refresh(missing))
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("PRICES - Fetching %s failed, serving without them",
+                                 sorted(missing))
+        return prices
+
+    def refresh(self, symbols) -> dict:
+        """
+        Function that fetches the prices of the given symbols from upstream and stores them
+
+        Symbols that are already being fetched by another thread are not fetched again,
+        their result is awaited instead.
+
+        Args:
+            symbols: An iterable of coin indexes.
+
+        Returns:
+            dict: A dictionary that maps a coin index to its price as a Decimal.
+        """
+        awaited, owned = {}, set()
+        with self._lock:
+            for symbol in set(symbols):
+                if symbol in self._inflight:
+                    awaited[symbol] = self._inflight[symbol]
+                else:
+                    owned.add(symbol)
+            future = Future()
+            for symbol in owned:
+                self._inflight[symbol] = future
+
+        prices = {}
+        if owned:
+            try:
+                fetched = self.fetcher(owned)
+                fetched_at = self._timer()
+                self.store.set_many(fetched, fetched_at)
+                future.set_result(fetched)
+                self._remember_unknown(owned, fetched, fetched_at)
+            except Exception as error:
+                future.set_exception(error)
+                raise
+            finally:
+                with self._lock:
+                    for symbol in owned:
+                        self._inflight.pop(symbol, None)
+            prices.update(fetched)
+
+        for symbol, pending in awaited.items():
+            result = pending.result()
+            if symbol in result:
+                prices[symbol] = result[symbol]
+        return prices
+
+    def _remember_unknown(self, symbols: set, fetched: dict, fetched_at: float):
+        with self._lock:
+            for symbol in symbols:
+                if symbol in fetched:
+                    self._unknown.pop(symbol, None)
+                else:
+                    self._unknown[symbol] = fetched_at
+
+    def _refresh_in_background(self, symbols):
+        with self._lock:
+            symbols = set(symbols) - self._inflight.keys()
+        if symbols:
+            Thread(target=self._background_refresh, args=(symbols,), daemon=True).start()
+
+    def _background_refresh(self, symbols):
+        try:
+            self.refresh(symbols)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("PRICES - Background refresh failed for %s", sorted(symbols))
+
+
+def create_store(backend: str, path: str = None):
+    """
+    Function that creates a price store
+
+    Args:
+        backend(str): Either 'memory' (per worker) or 'sqlite' (shared by the workers).
+        path(str): The path of the SQLite file of the 'sqlite' backend.
+
+    Returns:
+        The price store.
+    """
+    if backend == 'memory':
+        return MemoryPriceStore()
+    if backend == 'sqlite':
+        return SQLitePriceStore(path)
+    raise ValueError(f"Unknown price cache backend '{backend}'")
+
+
+# prices shared by the requests of the worker
+price_cache = PriceCache()
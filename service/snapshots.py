@@ -0,0 +1,257 @@
+from datetime import date, datetime, time, timedelta
+from threading import Event, Thread
+import logging
+
+from sqlalchemy import (
+    Date, DateTime, and_, case, delete, func, insert, literal, null, or_, select
+)
+
+from models import Balance, PortfolioSnapshot, PriceTick, db
+from service.coins import coin_catalog
+
+
+logger = logging.getLogger(__name__)
+
+DAY = timedelta(days=1)
+
+
+def _user_batches(batch_size: int):
+    """
+    Function that splits the users who have balances into batches of consecutive IDs
+
+    Yields:
+        tuple: The first and last user ID of a batch.
+    """
+    user_ids = db.session.scalars(
+        select(Balance.user_id).distinct().order_by(Balance.user_id)
+    ).all()
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        yield batch[0], batch[-1]
+
+
+def rollup_day(day: date, first_user: int, last_user: int) -> int:
+    """
+    Function that computes the snapshots of a day for a range of user IDs
+
+    The balances are summed per user and coin, valued at the last price tick of their
+    coin before the end of the day and summed per user by two statements, a DELETE of
+    the previous snapshots of the day and an INSERT ... SELECT, in one transaction, so
+    the rows never leave the database and a day can be rolled up again.
+
+    Like `service.valuation`, a coin quoted in another currency than USDT (e.g. ETHBTC)
+    is converted with the last tick of its `<quote>USDT` pair. Holdings without a tick
+    or a conversion are left out of the value, a user none of whose holdings can be
+    valued gets no snapshot for the day.
+
+    Args:
+        day(date): The day to roll up.
+        first_user(int): The lowest user ID of the range.
+        last_user(int): The highest user ID of the range.
+
+    Returns:
+        int: The number of snapshots written.
+    """
+    end = datetime.combine(day + DAY, time.min)
+    rates = coin_catalog.quote_rates()
+    converted = {coin_id: rate for coin_id, rate in rates.items() if rate is not None}
+    rate_coin_id = (case(converted, value=Balance.coin_id) if converted
+                    else null()).label('rate_coin_id')
+    holdings = (
+        select(
+            Balance.user_id,
+            Balance.coin_id,
+            rate_coin_id,
+            func.sum(Balance.amount).label('amount'),  # pylint: disable=not-callable
+        )
+        .where(Balance.user_id.between(first_user, last_user), Balance.date_added < end,
+               Balance.coin_id.in_(rates))
+        .group_by(Balance.user_id, Balance.coin_id)
+        .subquery()
+    )
+    last_ticks = (
+        select(
+            PriceTick.coin_id,
+            func.max(PriceTick.timestamp).label('timestamp'),  # pylint: disable=not-callable
+        )
+        .where(PriceTick.coin_id.in_(set(rates) | set(converted.values())),
+               PriceTick.timestamp < end)
+        .group_by(PriceTick.coin_id)
+        .subquery()
+    )
+    prices = (
+        select(
+            PriceTick.coin_id,
+            func.max(PriceTick.price).label('price'),  # pylint: disable=not-callable
+        )
+        .join(last_ticks, and_(last_ticks.c.coin_id == PriceTick.coin_id,
+                               last_ticks.c.timestamp == PriceTick.timestamp))
+        .group_by(PriceTick.coin_id)
+        .subquery()
+    )
+    quote_prices = prices.alias('quote_prices')
+    values = (
+        select(
+            holdings.c.user_id,
+            literal(day, Date),
+            func.sum(  # pylint: disable=not-callable
+                holdings.c.amount * prices.c.price
+                * func.coalesce(quote_prices.c.price, 1)  # pylint: disable=not-callable
+            ),
+            literal(datetime.utcnow(), DateTime),
+        )
+        .select_from(
+            holdings
+            .join(prices, prices.c.coin_id == holdings.c.coin_id)
+            .outerjoin(quote_prices, quote_prices.c.coin_id == holdings.c.rate_coin_id)
+        )
+        .where(or_(holdings.c.rate_coin_id.is_(None), quote_prices.c.price.is_not(None)))
+        .group_by(holdings.c.user_id)
+    )
+
+    db.session.execute(
+        delete(PortfolioSnapshot).where(
+            PortfolioSnapshot.user_id.between(first_user, last_user),
+            PortfolioSnapshot.day == day,
+        )
+    )
+    written = db.session.execute(
+        insert(PortfolioSnapshot).from_select(
+            ['user_id', 'day', 'value', 'computed_at'], values
+        )
+    ).rowcount
+    db.session.commit()
+    return written
+
+
+def rollup_snapshots(from_day: date = None, to_day: date = None,
+                     batch_size: int = 500) -> int:
+    """
+    Function that computes the daily portfolio snapshots of every user over a range
+    of days, in batches of users
+
+    Without a first day, the rollup resumes from the last day that has snapshots, which
+    is rolled up again in case it was interrupted, or starts from the day of the first
+    balance.
+
+    Args:
+        from_day(date): The first day to roll up, if given.
+        to_day(date): The last day to roll up, yesterday (UTC) by default.
+        batch_size(int): The number of users whose snapshots are written per transaction.
+
+    Returns:
+        int: The number of days rolled up.
+    """
+    to_day = to_day or datetime.utcnow().date() - DAY
+    if from_day is None:
+        from_day = db.session.scalar(
+            select(func.max(PortfolioSnapshot.day))  # pylint: disable=not-callable
+        )
+    if from_day is None:
+        first_balance = db.session.scalar(
+            select(func.min(Balance.date_added))  # pylint: disable=not-callable
+        )
+        if first_balance is None:
+            return 0
+        from_day = first_balance.date()
+
+    days = 0
+    day = from_day
+    batches = list(_user_batches(batch_size)) if day <= to_day else []
+    while day <= to_day:
+        written = sum(rollup_day(day, first, last) for first, last in batches)
+        logger.info("SNAPSHOTS - Rolled up %s with %s snapshots", day, written)
+        days += 1
+        day += DAY
+    return days
+
+
+def snapshot_history(user_id: int, from_day: date = None, to_day: date = None) -> list:
+    """
+    Function that gets the daily snapshots of a user's portfolio
+
+    Args:
+        user_id(int): The ID of the user.
+        from_day(date): The first day, if any.
+        to_day(date): The last day, if any.
+
+    Returns:
+        list: A list of (date, Decimal) tuples, the day and closing value, ordered by day.
+    """
+    query = (
+        select(PortfolioSnapshot.day, PortfolioSnapshot.value)
+        .where(PortfolioSnapshot.user_id == user_id)
+        .order_by(PortfolioSnapshot.day)
+    )
+    if from_day:
+        query = query.where(PortfolioSnapshot.day >= from_day)
+    if to_day:
+        query = query.where(PortfolioSnapshot.day <= to_day)
+    return [tuple(row) for row in db.session.execute(query).all()]
+
+
+class SnapshotScheduler:
+    """
+    Rolls the daily portfolio snapshots up from a background thread of the app.
+
+    Every `interval` seconds the rollup resumes from the last rolled up day, so a day
+    is picked up shortly after it ends. Enable it in a single process, or run
+    `flask snapshots rollup` from cron instead.
+
+    Attributes:
+        app: The Flask app whose database to roll up.
+        interval(float): The number of seconds between two rollups.
+        batch_size(int): The number of users whose snapshots are written per transaction.
+    """
+
+    def __init__(self, app, interval: float = 3600.0, batch_size: int = 500):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = Event()
+        self._thread = None
+
+    def run_once(self) -> int:
+        """
+        Function that rolls up the days since the last rollup, logging failures
+
+        Returns:
+            int: The number of days rolled up, 0 if the rollup failed.
+        """
+        with self.app.app_context():
+            try:
+                return rollup_snapshots(batch_size=self.batch_size)
+            except Exception:  # pylint: disable=broad-exception-caught
+                db.session.rollback()
+                logger.exception("SNAPSHOTS - Rollup failed")
+                return 0
+
+    def run(self):
+        """
+        Function that rolls up until the scheduler is stopped
+        """
+        logger.info("SNAPSHOTS - Scheduler started with interval %ss", self.interval)
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+        logger.info("SNAPSHOTS - Scheduler stopped")
+
+    def start(self):
+        """
+        Function that starts rolling up in a background daemon thread
+        """
+        self._stop.clear()
+        self._thread = Thread(target=self.run, name='snapshot-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Function that stops the scheduler and waits for the background thread to end
+
+        Args:
+            timeout(float): The maximum number of seconds to wait.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
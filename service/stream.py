@@ -0,0 +1,276 @@
+from threading import Event, Lock, Thread
+import json
+import logging
+import time
+
+from models import db, format_amount
+from service import balances as balance_service
+from service.prices import price_cache
+from service.valuation import format_value, required_symbols, unit_prices, value_holdings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    The prices pushed to a single client of the price broadcaster.
+
+    Prices pushed while the client is busy are merged, so a slow client only ever
+    gets the latest price of every coin instead of a growing backlog.
+
+    Attributes:
+        symbols(frozenset): The indexes of the coins the client is interested in.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self._pending = {}
+        self._ready = Event()
+        self._lock = Lock()
+
+    def push(self, prices: dict):
+        """
+        Function that hands prices to the client, keeping only the subscribed symbols
+
+        Args:
+            prices(dict): A dictionary that maps a coin index to its price.
+        """
+        prices = {symbol: price for symbol, price in prices.items() if symbol in self.symbols}
+        if not prices:
+            return
+        with self._lock:
+            self._pending.update(prices)
+            self._ready.set()
+
+    def get(self, timeout: float = None) -> dict:
+        """
+        Function that waits for the prices pushed since the last call
+
+        Args:
+            timeout(float): The maximum number of seconds to wait.
+
+        Returns:
+            dict: The changed prices by coin index, empty if none changed in time.
+        """
+        if not self._ready.wait(timeout):
+            return {}
+        with self._lock:
+            prices, self._pending = self._pending, {}
+            self._ready.clear()
+        return prices
+
+
+class PriceBroadcaster:
+    """
+    Fans the prices of a single price source out to every connected client of a worker.
+
+    While clients are subscribed, a background thread asks the source for the prices
+    of all their coins every `interval` seconds and pushes the prices that changed.
+    The default source is the price cache, so thousands of open dashboards cost the
+    worker one cached lookup per interval, and at most one upstream call per price
+    cache time-to-live. The thread stops when the last client leaves.
+
+    Attributes:
+        source: A callable that takes an iterable of coin indexes and returns their
+            prices by index, e.g. `price_cache.get_prices`.
+        interval(float): The number of seconds between two polls of the source.
+        polls(int): The number of polls of the source.
+    """
+
+    def __init__(self, source=None, interval: float = 1.0):
+        self.source = source or price_cache.get_prices
+        self.interval = interval
+        self.polls = 0
+        self._prices = {}
+        self._subscriptions = set()
+        self._thread = None
+        self._lock = Lock()
+
+    def configure(self, source=None, interval: float = None):
+        """
+        Function that replaces the price source and poll interval of the broadcaster
+
+        Args:
+            source: The new price source, if given.
+            interval(float): The new number of seconds between polls, if given.
+        """
+        with self._lock:
+            if source is not None:
+                self.source = source
+            if interval is not None:
+                self.interval = interval
+            self._prices = {}
+
+    def subscribe(self, symbols) -> Subscription:
+        """
+        Function that registers a client, starting the poll thread if it is the first one
+
+        The client gets the last known prices of its coins right away.
+
+        Args:
+            symbols: An iterable of the coin indexes the client is interested in.
+
+        Returns:
+            Subscription: The subscription to read the prices from.
+        """
+        subscription = Subscription(symbols)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            subscription.push(self._prices)
+            if self._thread is None:
+                self._thread = Thread(target=self.run, name='price-broadcaster', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """
+        Function that unregisters a client
+
+        Args:
+            subscription(Subscription): The subscription of the client.
+        """
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def poll_once(self) -> dict:
+        """
+        Function that gets the prices of the coins of every client from the source
+        with a single call, and pushes the changed prices to the clients
+
+        Returns:
+            dict: The changed prices by coin index.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        symbols = set().union(*(subscription.symbols for subscription in subscriptions))
+        if not symbols:
+            return {}
+        prices = self.source(symbols)
+        self.polls += 1
+        with self._lock:
+            changed = {
+                symbol: price for symbol, price in prices.items()
+                if self._prices.get(symbol) != price
+            }
+            self._prices.update(changed)
+            # clients that subscribed during the poll got the previous prices
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.push(changed)
+        return changed
+
+    def run(self):
+        """
+        Function that polls the source until no client is subscribed
+        """
+        logger.info("STREAM - Broadcaster started")
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    self._thread = None
+                    break
+            try:
+                self.poll_once()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("STREAM - Price poll failed")
+            time.sleep(self.interval)
+        logger.info("STREAM - Broadcaster stopped")
+
+
+# price fan-out shared by the streams of the worker
+price_broadcaster = PriceBroadcaster()
+
+
+def portfolio_event(holdings: list, prices: dict) -> str:
+    """
+    Function that formats the valued holdings of a user as a server-sent event
+
+    Args:
+        holdings(list): The (coin, amount, balances) tuples of `holding_amounts`.
+        prices(dict): The known prices by coin index.
+
+    Returns:
+        str: A 'portfolio' event whose data is a JSON object with the unit prices by coin
+        abbreviation, the holdings with their value and the total value of the holdings.
+        Coins without a known price have a null value and are left out of the total.
+    """
+    bases = {coin.index: coin.abbreviation for coin, _, _ in holdings}
+    units = unit_prices(bases, prices, bases=bases)
+    valuation = value_holdings(
+        ((coin.index, amount) for coin, amount, _ in holdings), prices, bases=bases
+    )
+    data = {
+        'prices': {
+            coin.abbreviation: str(units[coin.index])
+            for coin, _, _ in holdings if units[coin.index] is not None
+        },
+        'holdings': [
+            {
+                'coin_id': coin.id,
+                'coin': coin.abbreviation,
+                'amount': format_amount(amount),
+                'balances': balances,
+                'value': format_value(value),
+            }
+            for (coin, amount, balances), value in zip(holdings, valuation.values)
+        ],
+        'total': format_value(valuation.total),
+    }
+    return f'event: portfolio\ndata: {json.dumps(data)}\n\n'
+
+
+def stream_portfolio(user_id: int, broadcaster: PriceBroadcaster = price_broadcaster,
+                     heartbeat: float = 15.0, reload: float = 60.0):
+    """
+    Function that streams the holdings of a user, valued at the latest prices, as
+    server-sent events
+
+    A first event is sent right away, then one whenever the price of a held coin
+    changes or the holdings of the user change. Prices come from the shared broadcaster.
+    The holdings are queried again after a write to the balances of the user made by
+    this worker, and every `reload` seconds for the writes made by other workers.
+    A comment is sent when nothing happened for `heartbeat` seconds, so that closed
+    connections are noticed. Must run within an app context.
+
+    Args:
+        user_id(int): The id of the user whose holdings to stream.
+        broadcaster(PriceBroadcaster): The broadcaster of the prices.
+        heartbeat(float): The number of seconds between two comments on a quiet stream.
+        reload(float): The maximum number of seconds between two holdings queries.
+
+    Yields:
+        str: A server-sent event or comment.
+    """
+    version, holdings, subscription = None, None, None
+    prices = {}
+    loaded_at = last_sent = 0.0
+    try:
+        while True:
+            changed = subscription.get(broadcaster.interval) if subscription else {}
+            prices.update(changed)
+            if (balance_service.balance_versions.get(user_id) != version
+                    or time.monotonic() - loaded_at >= reload):
+                version = balance_service.balance_versions.get(user_id)
+                loaded_at = time.monotonic()
+                loaded = balance_service.holding_amounts(user_id)
+                # release the connection while the stream waits
+                db.session.close()
+                if loaded != holdings:
+                    holdings = loaded
+                    if subscription is not None:
+                        broadcaster.unsubscribe(subscription)
+                    subscription = broadcaster.subscribe(
+                        required_symbols(coin.index for coin, _, _ in holdings)
+                    )
+                    prices.update(subscription.get(0))
+                    changed = True
+            if changed:
+                last_sent = time.monotonic()
+                yield portfolio_event(holdings, prices)
+            elif time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield ': keep-alive\n\n'
+    finally:
+        if subscription is not None:
+            broadcaster.unsubscribe(subscription)
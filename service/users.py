@@ -0,0 +1,228 @@
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import User, db
+from service.cache import TTLCache
+
+
+# users resolved by the Flask-Login user loader, keyed by user ID
+user_cache = TTLCache()
+
+
+def user_url(user_id: int) -> str:
+    """
+    Function that builds the API url of a user
+
+    The url is what Flask-Login keeps in the session as the user's id, so it has
+    to stay the same no matter if the user was resolved over HTTP or in-process.
+
+    Args:
+        user_id(int): The ID of the user.
+
+    Returns:
+        str: The url of the user's API endpoint.
+    """
+    return f"{request.url_root}api/v1/users/{user_id}"
+
+
+def get_user(user_id: int):
+    """
+    Function that gets a user by ID
+
+    Args:
+        user_id(int): The ID of the user to retrieve.
+
+    Returns:
+        User: The user object, or None if no user is found.
+    """
+    return db.session.get(User, user_id)
+
+
+def load_user(user_id: int):
+    """
+    Function that gets the dictionary representation of a user through the user cache
+
+    Used by the Flask-Login user loader on every authenticated request, so the
+    database is only hit once per user and time-to-live.
+
+    Args:
+        user_id(int): The ID of the user to retrieve.
+
+    Returns:
+        dict: The dictionary representation of the user, or None if no user is found.
+    """
+    def fetch():
+        user = get_user(user_id)
+        return user.to_dict() if user is not None else None
+
+    return user_cache.get_or_set(user_id, fetch)
+
+
+# key of the users a session changed or deleted in its transaction, in `Session.info`
+PENDING_USERS = 'users'
+
+# pending key of the bulk writes that don't tell which users they change
+_EVERY_USER = object()
+
+
+def _pending_users(session) -> set:
+    """
+    Function that gets the users to drop from the user cache when a session commits
+    """
+    return session.info.setdefault(PENDING_USERS, set())
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user(mapper, connection, target):  # pylint: disable=unused-argument
+    """
+    Function that marks a changed or deleted user to be dropped from the user cache
+    once the transaction commits
+
+    Dropping it at flush would let a concurrent request cache the user it still
+    reads from before the commit. Changes made by other worker processes are only
+    picked up once the cached entry expires.
+
+    Args:
+        mapper: The mapper of the `User` model.
+        connection: The connection the change was flushed on.
+        target(User): The changed or deleted user.
+    """
+    _pending_users(object_session(target)).add(target.id)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def invalidate_users_on_bulk_write(orm_execute_state):
+    """
+    Function that marks every user to be dropped from the user cache on bulk updates
+    and deletes of users, which skip the mapper events and don't tell which users
+    they change
+
+    Args:
+        orm_execute_state(ORMExecuteState): The statement being executed.
+    """
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and orm_execute_state.bind_mapper is User.__mapper__:
+        _pending_users(orm_execute_state.session).add(_EVERY_USER)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_users(session):
+    """
+    Function that drops the users the committed transaction changed from the user cache
+
+    Args:
+        session(Session): The session that committed.
+    """
+    pending = session.info.pop(PENDING_USERS, set())
+    if _EVERY_USER in pending:
+        user_cache.clear()
+        return
+    for user_id in pending:
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def forget_pending_users(session, transaction):
+    """
+    Function that forgets the users to drop once the whole transaction of a session
+    ended without committing them, e.g. rolled back
+
+    Args:
+        session(Session): The session whose transaction ended.
+        transaction(SessionTransaction): The transaction that ended.
+    """
+    if transaction.parent is None:
+        session.info.pop(PENDING_USERS, None)
+
+
+def find_user(email: str):
+    """
+    Function that gets a user by email address
+
+    Args:
+        email(str): The email address of the user to retrieve.
+
+    Returns:
+        User: The user object, or None if no user is found.
+    """
+    return User.query.filter_by(email=email).first()
+
+
+def create_user(email: str, password: str):
+    """
+    Function that creates a new user with a hashed password
+
+    Args:
+        email(str): The email address of the new user.
+        password(str): The plaintext password of the new user.
+
+    Returns:
+        User: The newly created user object.
+    """
+    user = User(email=email)
+    user.hash_password(password)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def check_password(user, password: str) -> bool:
+    """
+    Function that verifies the password of a user, rehashing it if its hash is outdated
+
+    The plaintext password is only known on login, so that is when hashes made with an
+    older method or cost are upgraded to the `PASSWORD_HASH_METHOD` setting.
+
+    Args:
+        user(User): The user to verify the password of.
+        password(str): The plaintext password to verify.
+
+    Returns:
+        bool: True if the password is correct, False otherwise.
+    """
+    if not user.verify_password(password):
+        return False
+    if user.needs_rehash():
+        user.hash_password(password)
+        db.session.commit()
+    return True
+
+
+def authenticate(email: str, password: str):
+    """
+    Function that checks user credentials with a single user lookup
+
+    Args:
+        email(str): The email address of the user.
+        password(str): The plaintext password to verify.
+
+    Returns:
+        User: The user object if the credentials are valid, None otherwise.
+    """
+    user = find_user(email)
+    if user is not None and check_password(user, password):
+        return user
+    return None
+
+
+def login_or_register(email: str, password: str):
+    """
+    Function that logs in an existing user or registers a new one
+
+    If a user with the given email already exists, the password is verified
+    against it. Otherwise, a new user is created with the given credentials.
+
+    Args:
+        email(str): The email address of the user.
+        password(str): The plaintext password of the user.
+
+    Returns:
+        tuple: The user object (None if the password is wrong) and a boolean
+        indicating whether the user was created.
+    """
+    user = find_user(email)
+    if user is not None:
+        return (user if check_password(user, password) else None), False
+    return create_user(email, password), True
@@ -0,0 +1,191 @@
+from dataclasses import dataclass
+from decimal import Decimal, localcontext
+
+
+# the currency every value is expressed in
+QUOTE_CURRENCY = 'USDT'
+
+# quote currencies of the price provider, which all have a pair with USDT, matched
+# at the end of a coin index whose base currency is unknown
+QUOTE_CURRENCIES = ('FDUSD', 'USDT', 'USDC', 'TUSD', 'BTC', 'ETH', 'BNB', 'EUR')
+
+# currencies through which two currencies without a pair are converted, after USDT
+BRIDGE_CURRENCIES = ('BTC', 'ETH', 'BNB')
+
+# precision of the valuation arithmetic, enough for amounts and prices to multiply
+# exactly (amounts have at most 13 digits, prices at most 20)
+PRECISION = 50
+
+
+@dataclass(frozen=True)
+class Valuation:
+    """
+    The values of a batch of holdings.
+
+    Attributes:
+        values(list): The value of every holding in the quote currency, in the order of
+            the holdings, None for the holdings whose price is unknown.
+        total(Decimal): The sum of the known values.
+        missing(frozenset): The coin indexes that could not be valued.
+    """
+    values: list
+    total: Decimal
+    missing: frozenset
+
+
+def split_symbol(index: str, base: str = None) -> tuple:
+    """
+    Function that splits a coin index into its base and quote currencies
+
+    Args:
+        index(str): The symbol of the coin at the price provider (e.g. 'ETHBTC').
+        base(str): The base currency (the coin abbreviation), if known.
+
+    Returns:
+        tuple: The base and quote currencies (e.g. ('ETH', 'BTC')), the quote being
+        None if it is not recognised.
+    """
+    if base and index.startswith(base) and len(index) > len(base):
+        return base, index[len(base):]
+    for quote in QUOTE_CURRENCIES:
+        if index.endswith(quote) and len(index) > len(quote):
+            return index[:-len(quote)], quote
+    return index, None
+
+
+def required_symbols(indexes, target: str = QUOTE_CURRENCY) -> set:
+    """
+    Function that gives the symbols whose prices are needed to value coins
+
+    Besides the coins themselves, these are the pairs of their quote currencies with
+    the target currency. Unrecognised quote currencies get no pair, as the price
+    provider rejects a whole request if one of its symbols is not listed.
+
+    Args:
+        indexes: An iterable of coin indexes.
+        target(str): The currency of the values.
+
+    Returns:
+        set: The symbols to fetch.
+    """
+    symbols = set(indexes)
+    quotes = {split_symbol(index)[1] for index in symbols} - {target, None}
+    return symbols | {f'{quote}{target}' for quote in quotes}
+
+
+def _pair_rate(prices: dict, source: str, target: str):
+    """
+    Function that gives the rate of a currency to another from their direct or inverse pair
+    """
+    if source == target:
+        return Decimal(1)
+    if f'{source}{target}' in prices:
+        return prices[f'{source}{target}']
+    inverse = prices.get(f'{target}{source}')
+    return 1 / inverse if inverse else None
+
+
+def conversion_rate(prices: dict, source: str, target: str = QUOTE_CURRENCY):
+    """
+    Function that gives the rate of a currency to another, triangulated through a
+    bridge currency or the quote currency when the two currencies have no pair
+
+    Args:
+        prices(dict): A price snapshot that maps a symbol to its price.
+        source(str): The currency to convert.
+        target(str): The currency to convert to.
+
+    Returns:
+        Decimal: The price of one unit of the source currency in the target currency,
+        or None if the snapshot has no path between them.
+    """
+    with localcontext() as context:
+        context.prec = PRECISION
+        rate = _pair_rate(prices, source, target)
+        if rate is not None:
+            return rate
+        for bridge in (QUOTE_CURRENCY, *BRIDGE_CURRENCIES):
+            if bridge in (source, target):
+                continue
+            to_bridge = _pair_rate(prices, source, bridge)
+            from_bridge = _pair_rate(prices, bridge, target)
+            if to_bridge is not None and from_bridge is not None:
+                return to_bridge * from_bridge
+    return None
+
+
+def unit_prices(indexes, prices: dict, target: str = QUOTE_CURRENCY, bases: dict = None) -> dict:
+    """
+    Function that prices one unit of every coin in the target currency
+
+    The conversion rate of every quote currency is computed once for the batch.
+
+    Args:
+        indexes: An iterable of coin indexes.
+        prices(dict): A price snapshot that maps a symbol to its price.
+        target(str): The currency of the prices.
+        bases(dict): The base currency (the abbreviation) of the coins by index, if known.
+
+    Returns:
+        dict: The price of every coin index, None if it is unknown.
+    """
+    bases = bases or {}
+    rates = {}
+    result = {}
+    with localcontext() as context:
+        context.prec = PRECISION
+        for index in set(indexes):
+            price = prices.get(index)
+            quote = split_symbol(index, bases.get(index))[1]
+            if price is None or quote is None:
+                result[index] = None
+                continue
+            if quote not in rates:
+                rates[quote] = conversion_rate(prices, quote, target)
+            rate = rates[quote]
+            result[index] = None if rate is None else price * rate
+    return result
+
+
+def value_holdings(holdings, prices: dict, target: str = QUOTE_CURRENCY,
+                   bases: dict = None) -> Valuation:
+    """
+    Function that values a batch of holdings at a price snapshot in a single pass
+
+    Coins are priced once per index, then every holding costs one multiplication.
+    Values are exact, conversions through an inverse pair aside, and are only rounded
+    when formatted.
+
+    Args:
+        holdings: An iterable of (index, amount) tuples, with a Decimal amount.
+        prices(dict): A price snapshot that maps a symbol to its price.
+        target(str): The currency of the values.
+        bases(dict): The base currency (the abbreviation) of the coins by index, if known.
+
+    Returns:
+        Valuation: The value of every holding, their total and the unvalued indexes.
+    """
+    holdings = list(holdings)
+    units = unit_prices({index for index, _ in holdings}, prices, target, bases)
+    with localcontext() as context:
+        context.prec = PRECISION
+        values = [
+            None if units[index] is None else units[index] * amount
+            for index, amount in holdings
+        ]
+        total = sum((value for value in values if value is not None), Decimal(0))
+    missing = frozenset(index for index, unit in units.items() if unit is None)
+    return Valuation(values=values, total=total, missing=missing)
+
+
+def format_value(value):
+    """
+    Function that formats a value with thousands separators and 2 decimals
+
+    Args:
+        value(Decimal): The value, if known.
+
+    Returns:
+        str: The formatted value (e.g. '1,234.50'), or None if the value is unknown.
+    """
+    return None if value is None else f'{value:,.2f}'
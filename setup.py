@@ -21,6 +21,11 @@ setup(
         'flask-migrate',
         'flask-restful',
         'sqlalchemy',
-        'jinja2'
+        'jinja2',
+        'numpy',
     ],
+    extras_require={
+        'argon2': ['argon2-cffi'],
+        'asgi': ['starlette', 'httpx', 'uvicorn', 'aiosqlite', 'aiomysql'],
+    },
 )
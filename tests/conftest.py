@@ -1,11 +1,17 @@
+from decimal import Decimal
+from functools import partial
 from os import environ
 import pytest
 from dotenv import load_dotenv
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash
 from flask_login import login_user
-from models import User, db
+from models import User, Coin, Balance, db
 
 from app import create_test_app
+from benchmarks.common import PriceStubServer
+from service.coins import coin_catalog
+from service.prices import fetch_prices, price_cache
 
 
 @pytest.fixture(scope='session', name='app')
@@ -13,7 +19,7 @@ def fixture_app():
     """
     Fixture that initializes app for testing
     """
-    app_test = create_test_app()
+    app_test = create_test_app({'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000'})
     app_test.config["TESTING"] = True
     load_dotenv()
     app_test.config['SECRET_KEY'] = environ.get('SECRET_KEY')
@@ -51,3 +57,64 @@ def authenticated_user(app):
         login_user(user)
         # return the user
         return user
+
+
+@pytest.fixture(name='price_api')
+def fixture_price_api():
+    """
+    Fixture that serves a local stand-in for the Binance ticker price API
+    """
+    with PriceStubServer() as stub:
+        yield stub
+
+
+@pytest.fixture()
+def query_counter(app):  # pylint: disable=unused-argument
+    """
+    Fixture that records the SQL statements executed on the database
+    """
+    statements = []
+
+    def record(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture(name='listed_coins')
+def fixture_listed_coins(app):  # pylint: disable=unused-argument
+    """
+    Fixture that makes sure a couple of coins are listed
+    """
+    coins = {'BTCUSDT': 'BTC', 'DOGEUSDT': 'DOGE'}
+    for index, abbreviation in coins.items():
+        if Coin.query.filter_by(index=index).first() is None:
+            db.session.add(Coin(index=index, abbreviation=abbreviation))
+    db.session.commit()
+    return Coin.query.filter(Coin.index.in_(coins)).order_by(Coin.id).all()
+
+
+@pytest.fixture(name='user_with_balances')
+def fixture_user_with_balances(listed_coins, price_api, monkeypatch):
+    """
+    Fixture that creates a user with 20 balances, valued by the local price API
+    """
+    monkeypatch.setattr(price_cache, 'fetcher', partial(fetch_prices, url=price_api.url))
+    user = User(email='balances@example.com')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add_all([
+        Balance(user_id=user.id, coin_id=listed_coins[number % 2].id, amount=Decimal('1.5'))
+        for number in range(20)
+    ])
+    db.session.commit()
+    user_id = user.id
+    db.session.expunge_all()
+    # the coin catalog is warm in a running worker
+    coin_catalog.snapshot()
+    yield user_id
+    Balance.query.filter_by(user_id=user_id).delete()
+    User.query.filter_by(id=user_id).delete()
+    db.session.commit()
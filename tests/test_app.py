@@ -1,3 +1,20 @@
+from decimal import Decimal
+import time
+
+import pytest
+import requests
+
+from models import Balance, Coin
+from service.prices import MemoryPriceStore, price_cache
+
+
+def fail_fetch(symbols):
+    """
+    Function that fails like a price API that is down
+    """
+    raise requests.ConnectionError(symbols)
+
+
 class TestRegister:
     """
     Class to that make a unit tests for a
@@ -99,3 +116,105 @@ class TestLogout:
         """Log out the user"""
         response = client.get('/logout', follow_redirects=True)
         assert response.status_code == 200
+
+
+class TestHome:
+    """
+    Class that makes unit tests for the
+    home page
+    """
+    def test_home_balances_view(self, app, client, user_with_balances):
+        """Test that the home page shows a card per balance"""
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        # a fresh app context, so the user is not the one cached by earlier requests
+        with app.app_context():
+            response = client.get('/')
+        assert response.status_code == 200
+        assert response.data.count(b'Value:') == 20
+
+    def test_home_holdings_view(self, app, client, user_with_balances):
+        """Test that the holdings view of the home page shows a card per coin"""
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        with app.app_context():
+            response = client.get('/?view=holdings')
+        assert response.status_code == 200
+        assert response.data.count(b'Value:') == 2
+        assert b'Total:' in response.data
+
+    @pytest.mark.parametrize('view, cards', [('balances', 20), ('holdings', 2)])
+    def test_home_cards_revalued_live(  # pylint: disable=R0913
+            self, app, client, user_with_balances, view, cards):
+        """Test that every card carries the coin and raw amount the live prices revalue"""
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        with app.app_context():
+            response = client.get(f'/?view={view}')
+        amount = '1.5' if view == 'balances' else '15'
+        assert response.data.count(f'data-coin="BTC" data-amount="{amount}"'.encode()) \
+            == cards // 2
+        assert response.data.count(f'data-coin="DOGE" data-amount="{amount}"'.encode()) \
+            == cards // 2
+
+    @pytest.mark.parametrize('view, cards', [('balances', 20), ('holdings', 2)])
+    def test_home_unknown_values(  # pylint: disable=R0913
+            self, app, client, user_with_balances, monkeypatch, view, cards):
+        """Test that cards whose price is unknown show a placeholder instead of None"""
+        monkeypatch.setattr(price_cache, 'store', MemoryPriceStore())
+        monkeypatch.setattr(price_cache, 'fetcher', fail_fetch)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        with app.app_context():
+            response = client.get(f'/?view={view}')
+        assert response.status_code == 200
+        assert response.data.count('<span class="coin-value">—</span>'.encode()) == cards
+        assert b'>None<' not in response.data
+
+    def test_home_refresh_skips_database_and_template(  # pylint: disable=R0913
+            self, app, client, user_with_balances, query_counter, monkeypatch):
+        """Test that refreshing the home page serves the cached portfolio grid"""
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        with app.app_context():
+            first = client.get('/')
+        query_counter.clear()
+        renders = []
+        monkeypatch.setattr('views.views.render_portfolio', renders.append)
+        with app.app_context():
+            second = client.get('/')
+        assert second.data == first.data
+        assert not renders
+        assert not query_counter
+
+    def test_home_refreshed_on_balance_writes(self, app, client, user_with_balances):
+        """Test that balances written through the API show on the next refresh"""
+        coin_id = Coin.query.filter_by(index='BTCUSDT').first().id
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        with app.app_context():
+            assert client.get('/').data.count(b'Value:') == 20
+            client.post('/api/v1/balances', json={
+                'user_id': user_with_balances, 'coin_id': coin_id, 'amount': '2'
+            })
+            assert client.get('/').data.count(b'Value:') == 21
+
+            balance_id = Balance.query.filter_by(
+                user_id=user_with_balances, amount=Decimal('2')
+            ).first().id
+            client.put(f'/api/v1/balances/{balance_id}', json={
+                'coin_id': coin_id, 'amount': '3.25'
+            })
+            assert b'Amount: 3.25' in client.get('/').data
+
+            client.delete(f'/api/v1/balances/{balance_id}')
+            assert client.get('/').data.count(b'Value:') == 20
+
+    def test_home_refreshed_on_price_changes(self, app, client, user_with_balances):
+        """Test that new prices show on the next refresh"""
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        with app.app_context():
+            assert b'>123,456.00<' not in client.get('/').data
+            price_cache.store.set_many({'BTCUSDT': Decimal('82304')}, time.time())
+            assert b'>123,456.00<' in client.get('/').data
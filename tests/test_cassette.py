@@ -0,0 +1,108 @@
+from decimal import Decimal
+from functools import partial
+import os
+
+import pytest
+
+from service import cassette as cassette_service
+from service.cassette import PriceCassette, RecordingFetcher, ReplayFetcher
+from service.prices import MemoryPriceStore, fetch_prices, price_cache
+
+
+# ticker answers recorded at 0, 10 and 20 seconds
+TICKER_CASSETTE = os.path.join(os.path.dirname(__file__), 'cassettes', 'ticker.json')
+
+
+def fake_clock(*times):
+    """
+    Function that gives a clock returning the given times one after the other
+    """
+    return iter(times).__next__
+
+
+class TestCassette:
+    """
+    Tests recording the price API to a cassette and replaying it
+    """
+
+    @pytest.mark.parametrize('name', ['ticker.json', 'ticker.json.gz'])
+    def test_record_and_load(self, tmp_path, price_api, name):
+        """Test that the answers of the price API are recorded and saved compactly"""
+        recorder = RecordingFetcher(partial(fetch_prices, url=price_api.url),
+                                    clock=fake_clock(100.0, 105.0, 112.5))
+        for symbols in ({'BTCUSDT'}, {'BTCUSDT', 'DOGEUSDT'}, {'BTCUSDT'}):
+            assert recorder(symbols) == {symbol: price_api.price(symbol) for symbol in symbols}
+        path = str(tmp_path / name)
+        recorder.cassette.save(path)
+
+        cassette = PriceCassette.load(path)
+        assert cassette.calls == [0.0, 5.0, 12.5]
+        # the price of the stub never changes, so it is only kept once
+        assert cassette.prices == {
+            'BTCUSDT': [(0.0, price_api.price('BTCUSDT'))],
+            'DOGEUSDT': [(5.0, price_api.price('DOGEUSDT'))],
+        }
+
+    def test_load_unknown_version(self, tmp_path):
+        """Test that a cassette of another format version is rejected"""
+        path = tmp_path / 'ticker.json'
+        path.write_text('{"version": 99, "calls": [], "prices": {}}', encoding='utf-8')
+        with pytest.raises(ValueError, match="version '99'"):
+            PriceCassette.load(str(path))
+
+    def test_replay_in_time(self):
+        """Test that a replay follows the recording at the given speed"""
+        replay = ReplayFetcher(PriceCassette.load(TICKER_CASSETTE), speed=4,
+                               clock=fake_clock(50.0, 50.0, 52.5, 60.0))
+        symbols = {'BTCUSDT', 'DOGEUSDT'}
+        assert replay(symbols) == {'BTCUSDT': Decimal('27000.5'), 'DOGEUSDT': Decimal('0.0625')}
+        assert replay(symbols) == {'BTCUSDT': Decimal('27100'), 'DOGEUSDT': Decimal('0.0625')}
+        # the last recorded prices are kept once the recording is over
+        assert replay(symbols) == {'BTCUSDT': Decimal('27100'), 'DOGEUSDT': Decimal('0.07')}
+
+    def test_replay_steps(self):
+        """Test that a replay without speed serves the next recorded call every time"""
+        replay = ReplayFetcher(PriceCassette.load(TICKER_CASSETTE), speed=0)
+        assert [replay({'DOGEUSDT', 'ETHUSDT'}) for _ in range(4)] == [
+            {'DOGEUSDT': Decimal('0.0625')},
+            {'DOGEUSDT': Decimal('0.0625')},
+            {'DOGEUSDT': Decimal('0.07')},
+            {'DOGEUSDT': Decimal('0.07')},
+        ]
+        replay.rewind()
+        assert replay({'BTCUSDT'}) == {'BTCUSDT': Decimal('27000.5')}
+
+    def test_cassette_fetcher(self, tmp_path, monkeypatch):
+        """Test that the configured mode records until exit or replays"""
+        saved = []
+        monkeypatch.setattr(cassette_service.atexit, 'register',
+                            lambda save, path: saved.append(path))
+        monkeypatch.setattr(cassette_service, '_recorders', {})
+        path = str(tmp_path / 'ticker.json')
+        recorder = cassette_service.cassette_fetcher(lambda symbols: {}, path, mode='record')
+        assert isinstance(recorder, RecordingFetcher)
+        assert saved == [path]
+        # configuring the services again keeps recording with a single save
+        fetcher = partial(fetch_prices, url='http://localhost/')
+        assert cassette_service.cassette_fetcher(fetcher, path, mode='record') is recorder
+        assert recorder.fetcher is fetcher
+        assert saved == [path]
+
+        replay = cassette_service.cassette_fetcher(None, TICKER_CASSETTE, speed=0)
+        assert replay({'BTCUSDT'}) == {'BTCUSDT': Decimal('27000.5')}
+        with pytest.raises(ValueError, match="mode 'live'"):
+            cassette_service.cassette_fetcher(None, path, mode='live')
+
+    def test_balances_valued_offline(self, client, user_with_balances, price_api,
+                                     monkeypatch):
+        """Test that balances are valued from a replayed cassette without the price API"""
+        monkeypatch.setattr(price_cache, 'store', MemoryPriceStore())
+        monkeypatch.setattr(price_cache, 'fetcher',
+                            ReplayFetcher(PriceCassette.load(TICKER_CASSETTE), speed=0))
+
+        response = client.get(f'/api/v1/balances/{user_with_balances}')
+        assert response.status_code == 200
+        assert {balance['value'] for balance in response.json} == {'40,500.75', '0.09'}
+        response = client.get(f'/api/v1/balances/{user_with_balances}/holdings')
+        assert response.json['total'] == '405,008.44'
+        assert price_api.calls == 0
@@ -0,0 +1,165 @@
+from decimal import Decimal
+from os import environ
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app import create_test_app
+from models import User, Coin, Balance, db
+from service.coins import coin_catalog
+from service.database import READ_REPLICA, engine_options, read_replica
+from service.prices import MemoryPriceStore, price_cache
+
+
+DB_SETTINGS = {
+    'DB_POOL_SIZE': 7,
+    'DB_MAX_OVERFLOW': 3,
+    'DB_POOL_TIMEOUT': 5,
+    'DB_POOL_RECYCLE': 600,
+    'DB_POOL_PRE_PING': True,
+    'DB_CONNECT_TIMEOUT': 2,
+    'DB_STATEMENT_TIMEOUT': 1500,
+}
+
+
+@pytest.fixture(name='replica_app')
+def fixture_replica_app(app, tmp_path):  # pylint: disable=unused-argument
+    """
+    Fixture that initializes an app whose primary database and read replica are two
+    SQLite files, both with the tables of the models
+    """
+    replica_app = create_test_app({
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+        'DATABASE_REPLICA_URL': f"sqlite:///{tmp_path / 'replica.db'}",
+    })
+    replica_app.config['TESTING'] = True
+    replica_app.config['SECRET_KEY'] = environ.get('SECRET_KEY')
+    with replica_app.app_context():
+        db.create_all()
+        db.metadatas[None].create_all(bind=db.engines[READ_REPLICA])
+        yield replica_app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    # the bind only exists in this app, and the catalog may hold the coins of the replica
+    db.metadatas.pop(READ_REPLICA, None)
+    coin_catalog.invalidate()
+
+
+def indexes(session) -> list:
+    """
+    Function that gets the indexes of the coins a session reads
+    """
+    return session.scalars(select(Coin.index).order_by(Coin.index)).all()
+
+
+class TestEngineOptions:
+    """
+    Tests the engine options built from the settings
+    """
+
+    def test_server_options(self):
+        """Test that a database server gets a sized pool and both timeouts"""
+        options = engine_options('mysql+pymysql://user:secret@db/CRYPTEX', DB_SETTINGS)
+        assert options == {
+            'pool_pre_ping': True,
+            'pool_size': 7,
+            'max_overflow': 3,
+            'pool_timeout': 5,
+            'pool_recycle': 600,
+            'connect_args': {
+                'connect_timeout': 2,
+                'init_command': 'SET SESSION max_execution_time=1500',
+            },
+        }
+        options = engine_options('postgresql+asyncpg://user:secret@db/cryptex', DB_SETTINGS)
+        assert options['connect_args'] == {
+            'timeout': 2, 'server_settings': {'statement_timeout': '1500'}
+        }
+
+    def test_sqlite_options(self):
+        """Test that a SQLite file keeps the pool of its driver"""
+        options = engine_options('sqlite:///app.db', {**DB_SETTINGS, 'DB_STATEMENT_TIMEOUT': 0})
+        assert options == {'pool_pre_ping': True, 'connect_args': {'timeout': 2}}
+
+    def test_replica_bind(self, replica_app):
+        """Test that the replica is a bind with the same engine options"""
+        assert set(db.engines) == {None, READ_REPLICA}
+        assert replica_app.config['SQLALCHEMY_BINDS'][READ_REPLICA]['pool_pre_ping']
+        assert db.engines[READ_REPLICA].url.database.endswith('replica.db')
+
+
+class TestReadReplica:
+    """
+    Tests the routing of the queries between the primary database and the read replica
+    """
+
+    def test_reads_go_to_replica(self, replica_app):  # pylint: disable=unused-argument
+        """Test that only the reads of a read_replica block go to the replica"""
+        with Session(db.engines[READ_REPLICA]) as replica:
+            replica.add(Coin(index='REPLUSDT', abbreviation='REPL'))
+            replica.commit()
+        db.session.add(Coin(index='PRIMUSDT', abbreviation='PRIM'))
+        db.session.commit()
+
+        assert indexes(db.session) == ['PRIMUSDT']
+        with read_replica():
+            assert indexes(db.session) == ['REPLUSDT']
+            assert Coin.query.filter_by(index='REPLUSDT').first().abbreviation == 'REPL'
+        assert indexes(db.session) == ['PRIMUSDT']
+
+    def test_writes_go_to_primary(self, replica_app):  # pylint: disable=unused-argument
+        """Test that flushes and DML statements of a read_replica block go to the primary"""
+        with read_replica():
+            db.session.add(Coin(index='NEWUSDT', abbreviation='NEW'))
+            db.session.commit()
+            db.session.execute(
+                update(Coin).where(Coin.index == 'NEWUSDT').values(abbreviation='RENAMED')
+            )
+            db.session.commit()
+
+        assert db.session.scalars(select(Coin.abbreviation)).all() == ['RENAMED']
+        with Session(db.engines[READ_REPLICA]) as replica:
+            assert indexes(replica) == []
+
+    def test_catalog_reads_primary(self, replica_app):  # pylint: disable=unused-argument
+        """Test that the coin catalog is loaded from the primary in a read_replica block"""
+        with Session(db.engines[READ_REPLICA]) as replica:
+            replica.add(Coin(index='REPLUSDT', abbreviation='REPL'))
+            replica.commit()
+        db.session.add(Coin(index='PRIMUSDT', abbreviation='PRIM'))
+        db.session.commit()
+
+        coin_catalog.invalidate()
+        with read_replica():
+            assert list(coin_catalog.snapshot().by_index) == ['PRIMUSDT']
+
+    def test_without_replica(self, app):  # pylint: disable=unused-argument
+        """Test that reads go to the primary when no replica is configured"""
+        db.session.add(Coin(index='SOLOUSDT', abbreviation='SOLO'))
+        db.session.flush()
+        with read_replica():
+            assert 'SOLOUSDT' in indexes(db.session)
+        db.session.rollback()
+
+    def test_balance_api_reads_replica(self, replica_app, monkeypatch):
+        """Test that the balances of the REST API are read from the replica"""
+        monkeypatch.setattr(price_cache, 'store', MemoryPriceStore())
+        monkeypatch.setattr(price_cache, 'fetcher',
+                            lambda symbols: {symbol: Decimal(2) for symbol in symbols})
+        with Session(db.engines[READ_REPLICA]) as replica:
+            user = User(email='replica@example.com')
+            coin = Coin(index='REPLUSDT', abbreviation='REPL')
+            replica.add_all([user, coin])
+            replica.flush()
+            replica.add(Balance(user_id=user.id, coin_id=coin.id, amount=Decimal('1.5')))
+            replica.commit()
+            user_id = user.id
+
+        response = replica_app.test_client().get(f'/api/v1/balances/{user_id}')
+        assert response.status_code == 200
+        assert [(balance['amount'], balance['value']) for balance in response.json] == \
+            [('1.5', '3.00')]
+        assert db.session.get(User, user_id) is None
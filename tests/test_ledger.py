@@ -0,0 +1,219 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from models import User, Position, Trade, db
+from service import ledger as ledger_service
+from service.prices import MemoryPriceStore, price_cache
+
+
+@pytest.fixture(name='trader')
+def fixture_trader(listed_coins, monkeypatch):  # pylint: disable=unused-argument
+    """
+    Fixture that creates a user without trades, whose coins are all priced at 2
+    """
+    monkeypatch.setattr(price_cache, 'store', MemoryPriceStore())
+    monkeypatch.setattr(price_cache, 'fetcher',
+                        lambda symbols: {symbol: Decimal(2) for symbol in symbols})
+    user = User(email='trader@example.com')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    yield user_id
+    db.session.rollback()
+    Position.query.filter_by(user_id=user_id).delete()
+    Trade.query.filter_by(user_id=user_id).delete()
+    User.query.filter_by(id=user_id).delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def positions(user_id: int) -> dict:
+    """
+    Function that gets the position quantities of a user by coin ID
+    """
+    return {
+        position.coin_id: position.quantity
+        for position in Position.query.filter_by(user_id=user_id)
+    }
+
+
+class TestLedger:
+    """
+    Tests the trade ledger and the positions maintained from it
+    """
+
+    def test_trades_move_positions(self, trader, listed_coins):
+        """Test that every trade updates the position of its coin"""
+        btc, doge = (coin.id for coin in listed_coins)
+        ledger_service.record_trade(trader, btc, 'buy', '1.5', price='100')
+        ledger_service.record_trade(trader, btc, 'transfer_in', '0.25')
+        trade = ledger_service.record_trade(trader, btc, 'sell', '0.75', price='120')
+        ledger_service.record_trade(trader, doge, 'buy', '10', price='0.1')
+
+        assert positions(trader) == {btc: Decimal('1.0'), doge: Decimal('10')}
+        position = Position.query.filter_by(user_id=trader, coin_id=btc).one()
+        assert position.last_trade_id == trade.id
+        assert trade.to_dict()['kind'] == 'sell'
+        assert Decimal(trade.to_dict()['price']) == 120
+        assert Trade.query.filter_by(user_id=trader).count() == 4
+
+    def test_overdraw_is_rejected(self, trader, listed_coins):
+        """Test that a trade taking more than the position holds is not recorded"""
+        btc = listed_coins[0].id
+        ledger_service.record_trade(trader, btc, 'buy', '1', price='100')
+        with pytest.raises(ValueError, match='more than you hold'):
+            ledger_service.record_trade(trader, btc, 'transfer_out', '1.5')
+        with pytest.raises(ValueError, match='more than you hold'):
+            ledger_service.record_trade(trader, listed_coins[1].id, 'sell', '1', price='1')
+
+        assert positions(trader) == {btc: Decimal('1')}
+        assert Trade.query.filter_by(user_id=trader).count() == 1
+
+    @pytest.mark.parametrize('kind, quantity, price, coin_id, message', [
+        ('gift', '1', None, None, "'kind' must be one of"),
+        ('buy', '1', None, None, "'price' is required"),
+        ('sell', '1', '-2', None, "'price' must be positive"),
+        ('buy', 'many', '1', None, "'quantity' must be a number"),
+        ('buy', '0.000000001', '1', None, '7 values after comma'),
+        ('transfer_in', '1', None, 999999, "Unknown coin '999999'"),
+    ])
+    def test_invalid_trades(self, trader, listed_coins,  # pylint: disable=R0913
+                            kind, quantity, price, coin_id, message):
+        """Test that invalid trades are rejected with a message"""
+        with pytest.raises(ValueError, match=message):
+            ledger_service.record_trade(
+                trader, coin_id or listed_coins[0].id, kind, quantity, price=price
+            )
+        assert Trade.query.filter_by(user_id=trader).count() == 0
+
+    def test_unknown_user(self, trader, listed_coins):
+        """Test that a trade of a user who does not exist is not recorded"""
+        with pytest.raises(ValueError, match=f"Unknown user '{trader + 1000}'"):
+            ledger_service.record_trade(trader + 1000, listed_coins[0].id, 'transfer_in', '1')
+        assert Trade.query.filter_by(user_id=trader + 1000).count() == 0
+
+    @pytest.mark.parametrize('error, retried', [
+        (IntegrityError('INSERT', {}, Exception(
+            'UNIQUE constraint failed: position.user_id, position.coin_id')), True),
+        (OperationalError('SELECT', {}, Exception(1213, 'Deadlock found')), True),
+        (IntegrityError('INSERT', {}, Exception(
+            'NOT NULL constraint failed: position.quantity')), False),
+        (OperationalError('SELECT', {}, Exception(1205, 'Lock wait timeout')), False),
+    ])
+    def test_race_retried(self, trader, listed_coins,  # pylint: disable=R0913
+                          monkeypatch, error, retried):
+        """Test that only a trade losing the race for its position is retried"""
+        move_position, calls = ledger_service._move_position, []  # pylint: disable=W0212
+
+        def racing_move_position(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise error
+            move_position(*args)
+
+        monkeypatch.setattr(ledger_service, '_move_position', racing_move_position)
+        btc = listed_coins[0].id
+        if retried:
+            ledger_service.record_trade(trader, btc, 'transfer_in', '1')
+            assert positions(trader) == {btc: Decimal('1')}
+        else:
+            with pytest.raises(type(error)):
+                ledger_service.record_trade(trader, btc, 'transfer_in', '1')
+            assert positions(trader) == {}
+        assert len(calls) == (2 if retried else 1)
+        assert Trade.query.filter_by(user_id=trader).count() == (1 if retried else 0)
+
+    def test_positions_read_one_row_per_coin(self, trader, listed_coins, query_counter):
+        """Test that positions are valued without reading the trade history"""
+        btc, doge = (coin.id for coin in listed_coins)
+        for _ in range(10):
+            ledger_service.record_trade(trader, btc, 'buy', '0.5', price='100')
+        ledger_service.record_trade(trader, doge, 'buy', '4', price='0.1')
+        ledger_service.record_trade(trader, doge, 'sell', '4', price='0.2')
+        query_counter.clear()
+
+        result = ledger_service.list_positions(trader)
+        assert result == {
+            'positions': [{'coin_id': btc, 'coin': 'BTC', 'quantity': '5', 'value': '10.00'}],
+            'total': '10.00',
+        }
+        assert [statement for statement in query_counter if 'trade' in statement] == []
+        assert len(query_counter) == 1
+
+    def test_rebuild_positions(self, trader, listed_coins):
+        """Test that rebuilt positions match the incrementally maintained ones"""
+        btc, doge = (coin.id for coin in listed_coins)
+        ledger_service.record_trade(trader, btc, 'buy', '2', price='100')
+        ledger_service.record_trade(trader, btc, 'sell', '0.5', price='100')
+        last = ledger_service.record_trade(trader, doge, 'transfer_in', '3')
+        expected = positions(trader)
+        Position.query.filter_by(user_id=trader, coin_id=btc).update({'quantity': 42})
+        Position.query.filter_by(user_id=trader, coin_id=doge).delete()
+        db.session.commit()
+
+        assert ledger_service.rebuild_positions(trader) == 2
+        db.session.expire_all()
+        assert positions(trader) == expected
+        position = Position.query.filter_by(user_id=trader, coin_id=doge).one()
+        assert position.last_trade_id == last.id
+
+    def test_rebuild_command(self, app, trader, listed_coins):
+        """Test that the rebuild command recomputes every position"""
+        ledger_service.record_trade(trader, listed_coins[0].id, 'buy', '1', price='100')
+        Position.query.filter_by(user_id=trader).delete()
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['ledger', 'rebuild'])
+        assert result.exit_code == 0
+        assert 'Rebuilt' in result.output
+        assert positions(trader) == {listed_coins[0].id: Decimal('1')}
+
+
+class TestLedgerApi:
+    """
+    Tests the trade and position endpoints
+    """
+
+    def test_record_and_list(self, client, trader, listed_coins):
+        """Test that trades are recorded, listed in pages and reflected in positions"""
+        btc = listed_coins[0].id
+        for kind, quantity in (('buy', '3'), ('sell', '1'), ('buy', '0.5')):
+            response = client.post('/api/v1/trades', json={
+                'user_id': trader, 'coin_id': btc, 'kind': kind,
+                'quantity': quantity, 'price': '100',
+                'timestamp': datetime(2026, 1, 2).isoformat(),
+            })
+            assert response.status_code == 201
+            assert response.json['timestamp'] == '2026-01-02T00:00:00'
+
+        response = client.get(f'/api/v1/trades/{trader}?limit=2')
+        assert [trade['kind'] for trade in response.json] == ['buy', 'sell']
+        cursor = response.headers['X-Next-Cursor']
+        response = client.get(f'/api/v1/trades/{trader}?limit=2&cursor={cursor}')
+        assert [trade['quantity'] for trade in response.json] == ['0.5']
+        assert 'X-Next-Cursor' not in response.headers
+
+        response = client.get(f'/api/v1/positions/{trader}')
+        assert response.status_code == 200
+        assert response.json['positions'][0]['quantity'] == '2.5'
+        assert response.json['total'] == '5.00'
+
+    def test_invalid_trades(self, client, trader, listed_coins):
+        """Test that missing arguments and invalid trades are rejected"""
+        response = client.post('/api/v1/trades', json={'user_id': trader, 'kind': 'buy'})
+        assert response.status_code == 422
+        response = client.post('/api/v1/trades', json={
+            'user_id': trader, 'coin_id': listed_coins[0].id, 'kind': 'sell',
+            'quantity': '1', 'price': '100',
+        })
+        assert response.status_code == 400
+        assert 'more than you hold' in response.json['message']
+        response = client.post('/api/v1/trades', json={
+            'user_id': trader + 1000, 'coin_id': listed_coins[0].id, 'kind': 'transfer_in',
+            'quantity': '1',
+        })
+        assert response.status_code == 400
+        assert 'Unknown user' in response.json['message']
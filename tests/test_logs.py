@@ -0,0 +1,114 @@
+from functools import partial
+import json
+import logging
+
+from service import logs
+
+
+class TestLogging:
+    """
+    Tests the structured, sampled and queued logging
+    """
+
+    @staticmethod
+    def make_record(level: int = logging.INFO, msg: str = "VIEW - Balances found: '%s'",
+                    args: tuple = (3,)) -> logging.LogRecord:
+        """Function that builds a log record"""
+        return logging.LogRecord('app', level, __file__, 1, msg, args, None)
+
+    def test_json_formatter(self):
+        """Test that a record is formatted as a JSON object with its arguments merged"""
+        entry = json.loads(logs.JsonFormatter().format(self.make_record()))
+        assert entry['level'] == 'INFO'
+        assert entry['logger'] == 'app'
+        assert entry['message'] == "VIEW - Balances found: '3'"
+        assert {'time', 'process', 'thread'} <= set(entry)
+        assert 'exception' not in entry
+
+    def test_json_formatter_exception(self):
+        """Test that the traceback of a logged exception is kept"""
+        error = ValueError('boom')
+        record = logging.LogRecord('app', logging.ERROR, __file__, 1, 'failed', (),
+                                   (ValueError, error, None))
+        entry = json.loads(logs.JsonFormatter().format(record))
+        assert 'ValueError: boom' in entry['exception']
+
+    def test_sampling_filter(self):
+        """Test that INFO records are sampled and warnings always kept"""
+        draws = iter([0.05, 0.5])
+        sampler = logs.SamplingFilter(0.1, rng=lambda: next(draws))
+        assert sampler.filter(self.make_record())
+        assert not sampler.filter(self.make_record())
+        assert sampler.filter(self.make_record(logging.WARNING))
+        assert not logs.SamplingFilter(0).filter(self.make_record(logging.DEBUG))
+        assert logs.SamplingFilter(1, rng=None).filter(self.make_record())
+
+    def test_sync_handlers_keep_one_sample(self, tmp_path, monkeypatch):
+        """Test that the console and the file of the sync mode keep the same records"""
+        draws = iter([0.0, 0.9, 0.0, 0.9])
+        monkeypatch.setattr(logs, 'SamplingFilter',
+                            partial(logs.SamplingFilter, rng=lambda: next(draws)))
+        root = logging.getLogger()
+        level = root.level
+        try:
+            logs.configure_logging(level='INFO', path=str(tmp_path / 'app.log'),
+                                   sample_rate=0.5)
+            handlers = logs._installed['handlers']  # pylint: disable=protected-access
+            kept = [[handler.filter(record) for handler in handlers]
+                    for record in (self.make_record() for _ in range(4))]
+            assert kept == [[True, True], [False, False], [True, True], [False, False]]
+        finally:
+            logs.reset_logging()
+            root.setLevel(level)
+
+    def test_queue_handler_is_lazy(self):
+        """Test that records are queued without merging their arguments"""
+        handler = logs.LazyQueueHandler(logs.Queue(10))
+        handler.handle(self.make_record())
+        queued = handler.queue.get_nowait()
+        assert queued.msg == "VIEW - Balances found: '%s'"
+        assert queued.args == (3,)
+        assert queued.getMessage() == "VIEW - Balances found: '3'"
+
+    def test_queue_handler_drops_when_full(self):
+        """Test that records are dropped instead of blocking when the queue is full"""
+        handler = logs.LazyQueueHandler(logs.Queue(2))
+        for _ in range(5):
+            handler.handle(self.make_record())
+        assert handler.queue.qsize() == 2
+        assert handler.dropped == 3
+
+    def test_configure_queue_json(self, tmp_path):
+        """Test that the queue mode writes JSON lines from the listener thread"""
+        root = logging.getLogger()
+        level = root.level
+        path = tmp_path / 'app.log'
+        try:
+            listener = logs.configure_logging(mode='queue', fmt='json', level='INFO',
+                                              path=str(path))
+            assert listener is not None
+            assert sum(isinstance(handler, logs.LazyQueueHandler) for handler in root.handlers) == 1
+            logging.getLogger('app').info("REST - Portfolio stream of user '%s' opened", 7)
+            logging.getLogger('app').debug("REST - not logged")
+            logs.reset_logging()
+            lines = path.read_text().splitlines()
+            assert len(lines) == 1
+            assert json.loads(lines[0])['message'] == "REST - Portfolio stream of user '7' opened"
+        finally:
+            logs.reset_logging()
+            root.setLevel(level)
+
+    def test_configure_replaces_handlers(self, tmp_path):
+        """Test that configuring again replaces the handlers installed before"""
+        root = logging.getLogger()
+        level = root.level
+        try:
+            before = set(root.handlers)
+            logs.configure_logging(path=str(tmp_path / 'app.log'))
+            first = set(root.handlers) - before
+            assert logs.configure_logging(path=str(tmp_path / 'app.log')) is None
+            assert len(set(root.handlers) - before) == 2
+            assert not first & set(root.handlers)
+        finally:
+            logs.reset_logging()
+            root.setLevel(level)
@@ -0,0 +1,122 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+import requests
+from sqlalchemy import func, select
+
+from models import Balance, Coin, db
+from service import aio
+from service import balances as balance_service
+from service.prices import MemoryPriceStore, PriceCache, fetch_prices, parse_prices, price_cache
+
+
+@pytest.fixture(name='delisted_balance')
+def fixture_delisted_balance(user_with_balances, price_api, monkeypatch):
+    """
+    Fixture that adds a balance of a coin the price API does not list to the user
+    with balances
+    """
+    monkeypatch.setattr(price_cache, 'store', MemoryPriceStore())
+    price_api.invalid = {'GONEUSDT'}
+    coin = Coin(index='GONEUSDT', abbreviation='GONE')
+    db.session.add(coin)
+    db.session.flush()
+    db.session.add(Balance(user_id=user_with_balances, coin_id=coin.id, amount=Decimal('3')))
+    db.session.commit()
+    coin_id = coin.id
+    yield user_with_balances
+    Balance.query.filter_by(coin_id=coin_id).delete()
+    Coin.query.filter_by(id=coin_id).delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+class TestPriceApiErrors:
+    """
+    Tests the answers of the price API that are errors
+    """
+
+    def test_error_status_raised(self, price_api):
+        """Test that an error answer of the price API is raised, not read as prices"""
+        price_api.invalid = {'NOPEUSDT'}
+        with pytest.raises(requests.HTTPError, match='400'):
+            fetch_prices(['NOPEUSDT'], url=price_api.url)
+
+    def test_unexpected_answer(self):
+        """Test that an answer which is not a list of prices is rejected"""
+        with pytest.raises(ValueError, match='Invalid symbol'):
+            parse_prices({'code': -1121, 'msg': 'Invalid symbol.'})
+
+    def test_async_error_status_raised(self, price_api):
+        """Test that the async fetch raises error answers of the price API too"""
+        httpx = pytest.importorskip('httpx')
+        price_api.invalid = {'NOPEUSDT'}
+
+        async def main():
+            async with httpx.AsyncClient() as client:
+                return await aio.fetch_prices(client, ['NOPEUSDT'], url=price_api.url)
+
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(main())
+
+    def test_unlisted_symbol_left_out(self, price_api):
+        """Test that the symbols of a batch failed by an unlisted one are fetched alone"""
+        price_api.invalid = {'NOPEUSDT'}
+        assert fetch_prices(['BTCUSDT', 'NOPEUSDT', 'DOGEUSDT'], url=price_api.url) == {
+            'BTCUSDT': price_api.price('BTCUSDT'), 'DOGEUSDT': price_api.price('DOGEUSDT'),
+        }
+        assert price_api.calls == 4
+
+    def test_async_unlisted_symbol_left_out(self, price_api):
+        """Test that the async fetch leaves unlisted symbols out too"""
+        httpx = pytest.importorskip('httpx')
+        price_api.invalid = {'NOPEUSDT'}
+
+        async def main():
+            async with httpx.AsyncClient() as client:
+                return await aio.fetch_prices(client, ['BTCUSDT', 'NOPEUSDT'], url=price_api.url)
+
+        assert asyncio.run(main()) == {'BTCUSDT': price_api.price('BTCUSDT')}
+
+
+class TestMissingPrices:
+    """
+    Tests valuing balances whose prices cannot be fetched
+    """
+
+    def test_balances_of_delisted_coin(self, client, delisted_balance, price_api):
+        """Test that a delisted coin is valued as unknown and not asked for again"""
+        response = client.get(f'/api/v1/balances/{delisted_balance}')
+        assert response.status_code == 200
+        values = {balance['coin']: balance['value'] for balance in response.json}
+        assert values['GONE'] is None
+        assert values['BTC'] == f"{price_api.price('BTCUSDT') * Decimal('1.5'):,.2f}"
+        calls = price_api.calls
+
+        holdings = balance_service.list_holdings(delisted_balance)
+        assert [holding['value'] for holding in holdings['holdings']
+                if holding['coin'] == 'GONE'] == [None]
+        assert price_api.calls == calls
+
+    def test_balances_of_removed_coin(self, client, user_with_balances):
+        """Test that the holdings leave out balances of coins that are no longer listed"""
+        removed = db.session.scalar(select(func.max(Coin.id))) + 1000  # pylint: disable=E1102
+        db.session.add(Balance(user_id=user_with_balances, coin_id=removed, amount=Decimal('1')))
+        db.session.commit()
+
+        holdings = balance_service.list_holdings(user_with_balances)
+        assert [holding['coin'] for holding in holdings['holdings']] == ['BTC', 'DOGE']
+        response = client.get(f'/api/v1/balances/{user_with_balances}/holdings')
+        assert response.status_code == 200
+        assert response.json == holdings
+
+    def test_upstream_failure(self):
+        """Test that prices which cannot be fetched are left out instead of raising"""
+        def fail(symbols):
+            raise requests.ConnectionError(symbols)
+
+        cache = PriceCache(fetcher=fail)
+        assert not cache.get_prices({'BTCUSDT'})
+        with pytest.raises(requests.ConnectionError):
+            cache.refresh({'BTCUSDT'})
@@ -0,0 +1,970 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+import json
+import time
+
+import pytest
+import requests
+from requests import Response
+from requests.adapters import BaseAdapter
+from werkzeug.security import generate_password_hash
+
+from models import User, Coin, Balance, PriceTick, db
+from service import users as user_service
+from service import balances as balance_service
+from service import bulk as bulk_service
+from service import coins as coin_service
+from service import history as history_service
+from service import metrics
+from service import passwords
+from service import stream as stream_service
+from service import valuation
+from service.cache import TTLCache
+from service.http import HttpClient, CircuitOpenError, http_client
+from service.poller import PricePoller
+from service.stream import PriceBroadcaster
+from service.prices import (
+    PriceCache, MemoryPriceStore, SQLitePriceStore, fetch_prices, price_cache
+)
+
+
+class FakeTimer:  # pylint: disable=too-few-public-methods
+    """
+    A clock that only moves when told to
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    """
+    Class that makes unit tests for the
+    per-worker TTL/LRU cache
+    """
+    def test_cache_hit_and_miss(self):
+        """Test that lookups are counted as hits and misses"""
+        cache = TTLCache()
+        assert cache.get('key') is None
+        cache.set('key', 'value')
+        assert cache.get('key') == 'value'
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    def test_cache_expires(self):
+        """Test that entries are dropped after their time-to-live"""
+        timer = FakeTimer()
+        cache = TTLCache(ttl=10, timer=timer)
+        cache.set('key', 'value')
+        timer.now = 9
+        assert cache.get('key') == 'value'
+        timer.now = 10
+        assert cache.get('key') is None
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test that a full cache evicts the least recently used entry"""
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+
+class TestUserLoader:
+    """
+    Class that makes unit tests for the
+    cached user loader
+    """
+    def test_load_user_is_cached(self, app):  # pylint: disable=unused-argument
+        """Test that a user is only queried on the first load"""
+        user = User(email='cache@example.com')
+        user.hash_password('password')
+        db.session.add(user)
+        db.session.commit()
+        user_service.user_cache.clear()
+
+        misses = user_service.user_cache.misses
+        assert user_service.load_user(user.id)['email'] == 'cache@example.com'
+        assert user_service.load_user(user.id)['email'] == 'cache@example.com'
+        assert user_service.user_cache.misses == misses + 1
+
+    def test_load_user_invalidated_on_change(self, user_with_balances):
+        """Test that deactivating a user drops it from the cache"""
+        user = db.session.get(User, user_with_balances)
+        user_service.user_cache.clear()
+        assert user_service.load_user(user.id)['is_active'] is True
+        user.is_active = False
+        db.session.commit()
+        assert user_service.load_user(user.id)['is_active'] is False
+
+    def test_load_user_invalidated_on_commit(self, user_with_balances):
+        """Test that a user is only dropped once its change commits, bulk writes included"""
+        user = db.session.get(User, user_with_balances)
+        user_service.user_cache.clear()
+        user_service.load_user(user.id)
+        user.is_active = False
+        db.session.flush()
+        assert user_service.user_cache.get(user.id)['is_active'] is True
+        db.session.rollback()
+        assert user_service.user_cache.get(user.id)['is_active'] is True
+
+        User.query.filter_by(id=user.id).update({'is_active': False})
+        db.session.commit()
+        assert user_service.load_user(user.id)['is_active'] is False
+
+
+class TestPasswords:
+    """
+    Class that makes unit tests for the
+    configurable password hashing
+    """
+    @pytest.mark.parametrize('method', [
+        'pbkdf2:sha256:1000', 'scrypt:1024:8:1', 'argon2:1:1024:1'
+    ])
+    def test_round_trip(self, method):
+        """Test that every method verifies its own hashes"""
+        if method.startswith('argon2') and passwords.argon2 is None:
+            pytest.skip('argon2-cffi is not installed')
+        password_hash = passwords.hash_password('password', method)
+        assert passwords.verify_password(password_hash, 'password')
+        assert not passwords.verify_password(password_hash, 'wrong')
+        assert not passwords.needs_rehash(password_hash, method)
+
+    def test_needs_rehash_on_cost_change(self):
+        """Test that a hash made with another cost or method is outdated"""
+        password_hash = passwords.hash_password('password', 'pbkdf2:sha256:1000')
+        assert passwords.needs_rehash(password_hash, 'pbkdf2:sha256:2000')
+        assert passwords.needs_rehash(password_hash, 'scrypt:1024:8:1')
+
+    def test_unsupported_method(self):
+        """Test that an unknown method is rejected"""
+        with pytest.raises(ValueError):
+            passwords.hash_password('password', 'md5')
+
+    def test_legacy_hash_rehashed_on_login(self, app):  # pylint: disable=unused-argument
+        """Test that a legacy sha256 hash is upgraded on a successful login only"""
+        user = User(
+            email='legacy@example.com',
+            password_hash=generate_password_hash('password', 'sha256')
+        )
+        db.session.add(user)
+        db.session.commit()
+
+        assert user_service.authenticate('legacy@example.com', 'wrong') is None
+        assert user.password_hash.startswith('sha256$')
+
+        assert user_service.authenticate('legacy@example.com', 'password') is not None
+        assert user.password_hash.startswith(app.config['PASSWORD_HASH_METHOD'] + '$')
+        assert user_service.authenticate('legacy@example.com', 'password') is not None
+
+    def test_login_single_lookup(self, app, query_counter):
+        """Test that logging in through the API looks the user up once"""
+        with app.test_client() as client:
+            client.post('/api/v1/users', json={
+                'email': 'lookup@example.com', 'password': 'password'
+            })
+            query_counter.clear()
+            response = client.post('/api/v1/users', json={
+                'email': 'lookup@example.com', 'password': 'password'
+            })
+        assert response.status_code == 200
+        assert len([query for query in query_counter if query.startswith('SELECT')]) == 1
+
+
+class TestCoinCatalog:
+    """
+    Class that makes unit tests for the
+    coin catalog
+    """
+    def test_lookups_without_queries(self, listed_coins, query_counter):
+        """Test that coin lookups are served from memory once the catalog is loaded"""
+        coin_service.list_coins()
+        query_counter.clear()
+
+        assert [coin.id for coin in coin_service.list_coins()] == \
+            sorted(coin.id for coin in Coin.query.all())
+        query_counter.clear()
+        assert coin_service.get_coin_by_index('BTCUSDT').id == listed_coins[0].id
+        assert coin_service.coin_catalog.by_id([listed_coins[1].id])
+        assert not query_counter
+
+    def test_invalidated_on_write(self, listed_coins):  # pylint: disable=unused-argument
+        """Test that adding and bulk deleting coins bump the version and reload the catalog"""
+        version = coin_service.coin_catalog.version
+        db.session.add(Coin(index='TMPUSDT', abbreviation='TMP'))
+        db.session.commit()
+        assert coin_service.coin_catalog.version > version
+        assert coin_service.get_coin_by_index('TMPUSDT').abbreviation == 'TMP'
+
+        version = coin_service.coin_catalog.version
+        Coin.query.filter_by(index='TMPUSDT').delete()
+        db.session.commit()
+        assert coin_service.coin_catalog.version > version
+        assert coin_service.get_coin_by_index('TMPUSDT') is None
+
+    def test_reloaded_after_ttl(self, app, listed_coins):  # pylint: disable=unused-argument
+        """Test that changes made by other processes are picked up after the time-to-live"""
+        timer = FakeTimer()
+        catalog = coin_service.CoinCatalog(ttl=60, timer=timer)
+        snapshot = catalog.snapshot()
+        assert catalog.snapshot() is snapshot
+        timer.now += 60
+        reloaded = catalog.snapshot()
+        assert reloaded is not snapshot
+        assert reloaded.etag == snapshot.etag
+        assert reloaded.last_modified == snapshot.last_modified
+
+    def test_coin_api_conditional(self, client, listed_coins):  # pylint: disable=unused-argument
+        """Test that the coin list is revalidated with its ETag"""
+        response = client.get('/api/v1/coins')
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'public, max-age=60'
+        assert response.last_modified is not None
+        etag = response.headers['ETag']
+
+        response = client.get('/api/v1/coins', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+        db.session.add(Coin(index='NEWUSDT', abbreviation='NEW'))
+        db.session.commit()
+        response = client.get('/api/v1/coins', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        Coin.query.filter_by(index='NEWUSDT').delete()
+        db.session.commit()
+
+
+class FakeFetcher:  # pylint: disable=too-few-public-methods
+    """
+    An upstream price API that counts its calls
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.price = Decimal('1')
+
+    def __call__(self, symbols):
+        self.calls.append(set(symbols))
+        time.sleep(self.delay)
+        return {symbol: self.price for symbol in symbols}
+
+
+class FakeAdapter(BaseAdapter):
+    """
+    A transport adapter that answers with queued status codes or errors
+    """
+    def __init__(self, outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.sent = 0
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ,unused-argument
+        self.sent += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = Response()
+        response.status_code = outcome
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class TestHttpClient:
+    """
+    Class that makes unit tests for the
+    pooled HTTP client
+    """
+    @staticmethod
+    def client(outcomes, **kwargs):
+        """Creates a client whose calls to http://fake are answered by a fake adapter"""
+        timer = FakeTimer()
+        client = HttpClient(timer=timer, sleep=lambda delay: None, **kwargs)
+        adapter = FakeAdapter(outcomes)
+        client.session.mount('http://fake', adapter)
+        return client, adapter, timer
+
+    def test_keep_alive(self, price_api):
+        """Test that the price fetches of a worker reuse a pooled connection"""
+        http_client.configure()
+        for _ in range(3):
+            fetch_prices(['BTCUSDT'], url=price_api.url)
+        assert price_api.calls == 3
+        assert len(price_api.connections) == 1
+        assert http_client.stats()[urlsplit(price_api.url).netloc]['calls'] == 3
+
+    def test_retries_with_backoff(self):
+        """Test that failed idempotent calls are retried until one succeeds"""
+        client, adapter, _ = self.client([503, requests.ConnectionError(), 200], retries=2)
+        assert client.get('http://fake/price').status_code == 200
+        assert adapter.sent == 3
+        assert client.stats()['fake'] | {'mean_ms': 0, 'p95_ms': 0, 'max_ms': 0} == {
+            'calls': 3, 'errors': 2, 'retries': 2, 'rejected': 0, 'circuit': 'closed',
+            'mean_ms': 0, 'p95_ms': 0, 'max_ms': 0,
+        }
+
+    def test_no_retry_of_post(self):
+        """Test that non-idempotent calls are sent once"""
+        client, adapter, _ = self.client([503, 200], retries=2)
+        assert client.request('POST', 'http://fake/users').status_code == 503
+        assert adapter.sent == 1
+
+    def test_last_error_raised(self):
+        """Test that the error of the last attempt is raised"""
+        client, _, _ = self.client([requests.Timeout(), requests.Timeout()], retries=1)
+        with pytest.raises(requests.Timeout):
+            client.get('http://fake/price')
+
+    def test_circuit_breaker(self):
+        """Test that the circuit opens after failures and closes after a good trial call"""
+        client, adapter, timer = self.client(
+            [500, 500, 500, 200], retries=0, circuit_failures=2, circuit_reset=30
+        )
+        client.get('http://fake/price')
+        client.get('http://fake/price')
+        with pytest.raises(CircuitOpenError):
+            client.get('http://fake/price')
+        assert adapter.sent == 2
+        assert client.stats()['fake']['circuit'] == 'open'
+
+        timer.now += 30
+        assert client.get('http://fake/price').status_code == 500
+        assert client.stats()['fake']['circuit'] == 'open'
+        timer.now += 30
+        assert client.get('http://fake/price').status_code == 200
+        assert client.stats()['fake']['circuit'] == 'closed'
+        assert client.stats()['fake']['rejected'] == 1
+
+    def test_half_open_trial_broken_body(self):
+        """Test that a trial call failing with any request error opens the circuit again"""
+        client, adapter, timer = self.client(
+            [500, requests.exceptions.ChunkedEncodingError(), 200],
+            retries=2, circuit_failures=1, circuit_reset=30
+        )
+        client.request('POST', 'http://fake/price')
+        timer.now += 30
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            client.get('http://fake/price')
+        assert adapter.sent == 2
+        assert client.stats()['fake']['circuit'] == 'open'
+        timer.now += 30
+        assert client.get('http://fake/price').status_code == 200
+
+
+class TestPriceCache:
+    """
+    Class that makes unit tests for the
+    price cache
+    """
+    def test_fresh_prices_are_cached(self):
+        """Test that fresh prices are not fetched again"""
+        fetcher = FakeFetcher()
+        cache = PriceCache(fetcher=fetcher, ttl=10)
+        assert cache.get_prices(['BTCUSDT']) == {'BTCUSDT': Decimal('1')}
+        assert cache.get_prices(['BTCUSDT']) == {'BTCUSDT': Decimal('1')}
+        assert len(fetcher.calls) == 1
+
+    def test_stale_prices_are_served_while_revalidating(self):
+        """Test that stale prices are returned and refreshed in the background"""
+        timer = FakeTimer()
+        fetcher = FakeFetcher()
+        cache = PriceCache(fetcher=fetcher, ttl=10, stale_ttl=60, timer=timer)
+        cache.get_prices(['BTCUSDT'])
+        fetcher.price = Decimal('2')
+        timer.now = 30
+        assert cache.get_prices(['BTCUSDT']) == {'BTCUSDT': Decimal('1')}
+        for _ in range(100):
+            if cache.get_prices(['BTCUSDT']) == {'BTCUSDT': Decimal('2')}:
+                break
+            time.sleep(0.01)
+        assert cache.get_prices(['BTCUSDT']) == {'BTCUSDT': Decimal('2')}
+        assert len(fetcher.calls) == 2
+
+    def test_expired_prices_are_fetched(self):
+        """Test that prices past the stale window are fetched before returning"""
+        timer = FakeTimer()
+        fetcher = FakeFetcher()
+        cache = PriceCache(fetcher=fetcher, ttl=10, stale_ttl=60, timer=timer)
+        cache.get_prices(['BTCUSDT'])
+        fetcher.price = Decimal('2')
+        timer.now = 70
+        assert cache.get_prices(['BTCUSDT']) == {'BTCUSDT': Decimal('2')}
+
+    def test_concurrent_requests_are_coalesced(self):
+        """Test that concurrent requests for the same symbols share one upstream call"""
+        fetcher = FakeFetcher(delay=0.2)
+        cache = PriceCache(fetcher=fetcher)
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(
+                lambda _: cache.get_prices(['BTCUSDT', 'DOGEUSDT']), range(8)
+            ))
+        assert len(fetcher.calls) == 1
+        assert all(result == results[0] for result in results)
+
+    def test_sqlite_store_is_shared(self, tmp_path):
+        """Test that prices stored by one SQLite store are seen by another"""
+        path = str(tmp_path / 'prices.sqlite3')
+        SQLitePriceStore(path).set_many({'BTCUSDT': Decimal('27000.5')}, 100.0)
+        assert SQLitePriceStore(path).get_many(['BTCUSDT', 'DOGEUSDT']) == {
+            'BTCUSDT': (Decimal('27000.5'), 100.0)
+        }
+
+    def test_store_versions(self, tmp_path):
+        """Test that storing prices bumps the version of both stores, shared by SQLite"""
+        path = str(tmp_path / 'prices.sqlite3')
+        for store, other in ((MemoryPriceStore(), None), (SQLitePriceStore(path), path)):
+            version = store.version()
+            store.set_many({}, 100.0)
+            assert store.version() == version
+            store.set_many({'BTCUSDT': Decimal('27000.5')}, 100.0)
+            assert store.version() > version
+            if other:
+                assert SQLitePriceStore(other).version() == store.version()
+
+
+class TestPricePoller:
+    """
+    Class that makes unit tests for the
+    background price poller
+    """
+    @pytest.mark.usefixtures('listed_coins')
+    def test_poll_prices_of_every_coin(self, app, price_api):
+        """Test that a poll stores the price of every listed coin"""
+        cache = PriceCache(fetcher=partial(fetch_prices, url=price_api.url))
+
+        PricePoller(app, cache=cache).poll_once()
+
+        assert price_api.calls == 1
+        assert cache.get_prices(['BTCUSDT', 'DOGEUSDT']) == {
+            'BTCUSDT': price_api.price('BTCUSDT'),
+            'DOGEUSDT': price_api.price('DOGEUSDT'),
+        }
+        assert price_api.calls == 1
+
+    @pytest.mark.usefixtures('listed_coins')
+    def test_poller_thread(self, app, price_api):
+        """Test that a started poller keeps polling until it is stopped"""
+        cache = PriceCache(fetcher=partial(fetch_prices, url=price_api.url))
+        poller = PricePoller(app, cache=cache, interval=0.01)
+        poller.start()
+        for _ in range(100):
+            if price_api.calls >= 3:
+                break
+            time.sleep(0.01)
+        poller.stop(timeout=1)
+        assert price_api.calls >= 3
+
+    @pytest.mark.usefixtures('listed_coins')
+    def test_poller_backs_off(self, app):
+        """Test that the delay doubles after every failed poll"""
+        def failing(symbols):
+            raise ConnectionError(symbols)
+
+        poller = PricePoller(app, cache=PriceCache(fetcher=failing), interval=1, max_backoff=5)
+        assert poller.next_delay() == 1
+        for failures, delay in [(1, 2), (2, 4), (3, 5)]:
+            poller.run_once()
+            assert poller.failures == failures
+            assert poller.next_delay() == delay
+
+
+class TestPriceHistory:
+    """
+    Class that makes unit tests for the
+    price history ingestion and downsampling
+    """
+    def test_ingest_and_downsample(self, listed_coins):
+        """Test that ingested ticks are folded into OHLC candles"""
+        coin = listed_coins[0]
+        start = datetime(2023, 1, 1)
+        prices = [5, 7, 3, 6, 10, 8]
+        count = history_service.ingest_ticks(
+            (
+                {'coin_id': coin.id, 'timestamp': start + timedelta(minutes=20 * number),
+                 'price': Decimal(price)}
+                for number, price in enumerate(prices)
+            ),
+            batch_size=4
+        )
+        assert count == 6
+
+        series = history_service.ohlc(coin.id, 'hour', start, start + timedelta(days=1))
+        assert [
+            (candle['time'], candle['open'], candle['high'], candle['low'], candle['close'])
+            for candle in series
+        ] == [
+            (start, 5, 7, 3, 3),
+            (start + timedelta(hours=1), 6, 10, 6, 8),
+        ]
+
+    def test_price_history_api(self, client, listed_coins):
+        """Test that the price history endpoint returns daily candles"""
+        coin = listed_coins[0]
+        response = client.get(
+            f'/api/v1/coins/{coin.id}/history?interval=day'
+            '&from_date=2023-01-01&to_date=2023-01-02'
+        )
+        assert response.status_code == 200
+        assert response.json == [{
+            'time': '2023-01-01T00:00:00',
+            'open': '5.00000000', 'high': '10.00000000',
+            'low': '3.00000000', 'close': '8.00000000',
+        }]
+
+    def test_price_history_api_invalid_interval(self, client, listed_coins):
+        """Test that an unsupported interval is rejected"""
+        response = client.get(f'/api/v1/coins/{listed_coins[0].id}/history?interval=week')
+        assert response.status_code == 400
+
+
+class TestPortfolioHistory:
+    """
+    Class that makes unit tests for the
+    historical portfolio valuation
+    """
+    def test_portfolio_history_api(self, client):
+        """Test that balances are valued at the last price known at every point"""
+        user = User(email='portfolio@example.com')
+        coin = Coin(index='ETHUSDT', abbreviation='ETH')
+        db.session.add_all([user, coin])
+        db.session.flush()
+        db.session.add_all([
+            PriceTick(coin_id=coin.id, timestamp=datetime(2022, 12, 31, 23), price=10),
+            PriceTick(coin_id=coin.id, timestamp=datetime(2023, 1, 1, 2), price=20),
+            Balance(user_id=user.id, coin_id=coin.id, amount=1,
+                    date_added=datetime(2022, 12, 31)),
+            Balance(user_id=user.id, coin_id=coin.id, amount=2,
+                    date_added=datetime(2023, 1, 1, 1, 30)),
+            Balance(user_id=user.id, coin_id=coin.id, amount=4,
+                    date_added=datetime(2023, 1, 2)),
+        ])
+        db.session.commit()
+
+        response = client.get(
+            f'/api/v1/portfolio/{user.id}/history?interval=hour'
+            '&from_date=2023-01-01T00:00&to_date=2023-01-01T03:00'
+        )
+        assert response.status_code == 200
+        assert response.json == [
+            {'time': '2023-01-01T00:00:00', 'value': 10.0},
+            {'time': '2023-01-01T01:00:00', 'value': 10.0},
+            {'time': '2023-01-01T02:00:00', 'value': 60.0},
+            {'time': '2023-01-01T03:00:00', 'value': 60.0},
+        ]
+
+    def test_portfolio_history_api_without_balances(self, client):
+        """Test that a user without balances is worth nothing"""
+        response = client.get(
+            '/api/v1/portfolio/999/history?interval=day'
+            '&from_date=2023-01-01&to_date=2023-01-02'
+        )
+        assert response.json == [
+            {'time': '2023-01-01T00:00:00', 'value': 0.0},
+            {'time': '2023-01-02T00:00:00', 'value': 0.0},
+        ]
+
+
+class TestBalances:
+    """
+    Class that makes unit tests for the
+    balance listing
+    """
+    def test_list_balances_single_query(self, user_with_balances, price_api, query_counter):
+        """Test that listing balances takes one query whatever the number of balances"""
+        query_counter.clear()
+
+        balances = balance_service.list_balances(user_with_balances)
+
+        assert len(query_counter) == 1
+        assert len(balances) == 20
+        assert balances[0]['amount'] == '1.5'
+        assert balances[0]['value'] == f"{price_api.price('BTCUSDT') * Decimal('1.5'):,.2f}"
+
+    def test_balance_api(self, client, user_with_balances):
+        """Test that the balance endpoint lists the balances of a user"""
+        response = client.get(f'/api/v1/balances/{user_with_balances}')
+        assert response.status_code == 200
+        assert response.json == balance_service.list_balances(user_with_balances)
+
+    def test_list_holdings_grouped_by_coin(self, user_with_balances, price_api, query_counter):
+        """Test that holdings sum the balances per coin in a single query"""
+        query_counter.clear()
+
+        result = balance_service.list_holdings(user_with_balances)
+
+        assert len(query_counter) == 1
+        assert [
+            (holding['coin'], holding['amount'], holding['balances'])
+            for holding in result['holdings']
+        ] == [('BTC', '15', 10), ('DOGE', '15', 10)]
+        total = (price_api.price('BTCUSDT') + price_api.price('DOGEUSDT')) * 15
+        assert result['total'] == f'{total:,.2f}'
+
+    def test_holdings_api(self, client, user_with_balances):
+        """Test that the holdings endpoint returns the holdings of a user"""
+        response = client.get(f'/api/v1/balances/{user_with_balances}/holdings')
+        assert response.status_code == 200
+        assert len(response.json['holdings']) == 2
+
+    def test_balance_api_keyset_pagination(self, client, user_with_balances):
+        """Test that following the cursors walks through every balance once"""
+        ids, cursor, pages = [], '', 0
+        while cursor is not None:
+            response = client.get(
+                f'/api/v1/balances/{user_with_balances}?limit=8&cursor={cursor}'
+            )
+            assert response.status_code == 200
+            ids += [balance['id'] for balance in response.json]
+            cursor = response.headers.get('X-Next-Cursor')
+            pages += 1
+        assert pages == 3
+        assert ids == sorted(ids)
+        assert len(set(ids)) == 20
+
+    def test_balance_api_invalid_limit(self, client, user_with_balances):
+        """Test that an out of range page size is rejected"""
+        response = client.get(f'/api/v1/balances/{user_with_balances}?limit=0')
+        assert response.status_code == 400
+
+    def test_balance_api_stream(self, client, user_with_balances):
+        """Test that the balances can be streamed as JSON lines"""
+        response = client.get(f'/api/v1/balances/{user_with_balances}?stream=1')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert lines == balance_service.list_balances(user_with_balances)
+
+
+class TestBalanceVersions:
+    """
+    Class that makes unit tests for the
+    balance versions keying the cached portfolio grids
+    """
+    def test_bumped_on_writes(self, user_with_balances):
+        """Test that writing balances bumps the version of their user only"""
+        coin_id = Coin.query.filter_by(index='BTCUSDT').first().id
+        versions = balance_service.balance_versions
+        version, other = versions.get(user_with_balances), versions.get(-1)
+        balance = balance_service.create_balance(user_with_balances, coin_id, '1')
+        assert versions.get(user_with_balances) != version
+        version = versions.get(user_with_balances)
+        balance_service.update_balance(balance.id, coin_id, '2')
+        assert versions.get(user_with_balances) != version
+        assert versions.get(-1) == other
+
+    def test_bumped_on_commit(self, user_with_balances):
+        """Test that versions are only bumped once the written balances are committed"""
+        versions = balance_service.balance_versions
+        version = versions.get(user_with_balances)
+        balance = Balance.query.filter_by(user_id=user_with_balances).first()
+        balance.amount = Decimal('2')
+        db.session.flush()
+        assert versions.get(user_with_balances) == version
+        db.session.rollback()
+        db.session.commit()
+        assert versions.get(user_with_balances) == version
+
+        balance.amount = Decimal('2')
+        db.session.flush()
+        db.session.commit()
+        assert versions.get(user_with_balances) != version
+
+    def test_bumped_on_bulk_writes(self, user_with_balances):
+        """Test that bulk imports bump their users and bulk deletes every user"""
+        versions = balance_service.balance_versions
+        version, other = versions.get(user_with_balances), versions.get(-1)
+        bulk_service.import_balances(
+            bulk_service.read_csv(['coin,amount', 'BTC,1']), user_id=user_with_balances
+        )
+        assert versions.get(user_with_balances) != version
+        assert versions.get(-1) == other
+        Balance.query.filter_by(user_id=user_with_balances, amount=1).delete()
+        db.session.commit()
+        assert versions.get(-1) != other
+
+    def test_delete_bumps_its_user(self, user_with_balances):
+        """Test that deleting a balance bumps the version of its user only"""
+        versions = balance_service.balance_versions
+        version, other = versions.get(user_with_balances), versions.get(-1)
+        assert balance_service.delete_balance(
+            Balance.query.filter_by(user_id=user_with_balances).first().id
+        ) == 1
+        assert versions.get(user_with_balances) != version
+        assert versions.get(-1) == other
+        assert balance_service.delete_balance(-1) == 0
+
+
+class TestBulkBalances:
+    """
+    Class that makes unit tests for the
+    bulk balance import and export
+    """
+    @pytest.mark.parametrize('amount, valid', [
+        ('1.5', True), ('0.0000001', True), ('100000', True),
+        ('0.00000001', False), ('100000.1', False), ('0', False), ('NaN', False),
+    ])
+    def test_validate_amount(self, amount, valid):
+        """Test that amounts are validated with the rules of the balance form"""
+        if valid:
+            assert balance_service.validate_amount(Decimal(amount)) == Decimal(amount)
+        else:
+            with pytest.raises(ValueError):
+                balance_service.validate_amount(Decimal(amount))
+
+    def test_import_csv_in_batches(self, app, client, user_with_balances, query_counter):
+        """Test that valid rows are inserted in batches and invalid rows are reported"""
+        body = '\n'.join([
+            'user_id,coin,amount,date_added',
+            f'{user_with_balances},BTC,1,2023-01-01',
+            f'{user_with_balances},BTC,2,',
+            f'{user_with_balances},XRP,3,',
+            f'{user_with_balances},DOGE,0.123456789,',
+            f'{user_with_balances},DOGE,4,yesterday',
+            f'{user_with_balances},DOGE,5,',
+            f'{user_with_balances},DOGE,6,',
+            f'{user_with_balances},DOGE,7,',
+            '0,DOGE,8,',
+        ])
+        app.config['BALANCES_IMPORT_BATCH_SIZE'] = 2
+        query_counter.clear()
+        try:
+            response = client.post(
+                '/api/v1/balances/bulk', data=body, content_type='text/csv'
+            )
+        finally:
+            app.config['BALANCES_IMPORT_BATCH_SIZE'] = 1000
+
+        assert response.status_code == 201
+        assert response.json['imported'] == 5
+        assert response.json['failed'] == 4
+        assert [error['line'] for error in response.json['errors']] == [4, 5, 6, 10]
+        assert 'XRP' in response.json['errors'][0]['error']
+        assert len([query for query in query_counter if query.startswith('INSERT')]) == 3
+        assert Balance.query.filter_by(user_id=user_with_balances).count() == 25
+
+    def test_import_jsonl_for_user(self, client, user_with_balances):
+        """Test that JSON lines rows default to the user of the request"""
+        coin = Coin.query.filter_by(abbreviation='BTC').first()
+        body = '\n'.join([
+            json.dumps({'coin_id': coin.id, 'amount': '0.5'}),
+            '',
+            '{not json',
+        ])
+        response = client.post(
+            f'/api/v1/balances/bulk?user_id={user_with_balances}',
+            data=body, content_type='application/x-ndjson'
+        )
+        assert response.status_code == 201
+        assert response.json['imported'] == 1
+        assert response.json['errors'][0]['line'] == 3
+        assert Balance.query.filter_by(user_id=user_with_balances).count() == 21
+
+    def test_import_unsupported_media_type(self, client):
+        """Test that bodies of other formats are rejected"""
+        response = client.post('/api/v1/balances/bulk', data='{}', content_type='text/plain')
+        assert response.status_code == 415
+
+    @pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+    def test_export_round_trip(self, client, user_with_balances, fmt):
+        """Test that an export can be imported back"""
+        response = client.get(f'/api/v1/balances/bulk?user_id={user_with_balances}&format={fmt}')
+        assert response.status_code == 200
+        assert response.mimetype == bulk_service.MEDIA_TYPES[fmt]
+        lines = response.data.decode().splitlines()
+        assert len(lines) == 20 + (fmt == 'csv')
+
+        response = client.post(
+            '/api/v1/balances/bulk', data=response.data,
+            content_type=bulk_service.MEDIA_TYPES[fmt]
+        )
+        assert response.json == {'imported': 20, 'failed': 0, 'errors': []}
+        assert Balance.query.filter_by(user_id=user_with_balances).count() == 40
+
+
+class TestPriceStream:
+    """
+    Class that makes unit tests for the
+    price broadcaster and the server-sent portfolio events
+    """
+    def test_one_source_poll_for_every_client(self):
+        """Test that all subscribed clients share the polls of a single price source"""
+        source = FakeFetcher()
+        broadcaster = PriceBroadcaster(source, interval=0.05)
+        subscriptions = [
+            broadcaster.subscribe(['BTCUSDT'] if number % 2 else ['DOGEUSDT'])
+            for number in range(1000)
+        ]
+        assert all(subscription.get(2) for subscription in subscriptions)
+        assert len(source.calls) < 10
+        assert source.calls[-1] == {'BTCUSDT', 'DOGEUSDT'}
+
+        source.price = Decimal('2')
+        assert subscriptions[1].get(2) == {'BTCUSDT': Decimal('2')}
+        assert subscriptions[0].get(2) == {'DOGEUSDT': Decimal('2')}
+        # unchanged prices are not pushed again
+        assert subscriptions[0].get(0.2) == {}
+
+        for subscription in subscriptions:
+            broadcaster.unsubscribe(subscription)
+        time.sleep(0.2)
+        polls = broadcaster.polls
+        time.sleep(0.2)
+        assert broadcaster.polls == polls
+
+    def test_portfolio_events(self, app, client, user_with_balances):
+        """Test that the stream pushes the valued holdings, then every price change"""
+        source = FakeFetcher()
+        stream_service.price_broadcaster.configure(source=source, interval=0.01)
+        response = client.get(f'/api/v1/balances/{user_with_balances}/stream')
+        assert response.mimetype == 'text/event-stream'
+        events = (
+            json.loads(chunk.decode().split('data: ', 1)[1])
+            for chunk in response.response if chunk.startswith(b'event: portfolio')
+        )
+        try:
+            event = next(events)
+            while event['total'] != '30.00':  # until the first poll
+                event = next(events)
+            assert event['prices'] == {'BTC': '1', 'DOGE': '1'}
+            assert [holding['value'] for holding in event['holdings']] == ['15.00', '15.00']
+
+            source.price = Decimal('2')
+            assert next(events)['total'] == '60.00'
+
+            coin_id = Coin.query.filter_by(index='BTCUSDT').first().id
+            with app.app_context():
+                balance_service.create_balance(user_with_balances, coin_id, '5')
+            assert next(events)['total'] == '70.00'
+        finally:
+            response.close()
+        assert not stream_service.price_broadcaster._subscriptions  # pylint: disable=W0212
+
+
+class TestValuation:
+    """
+    Class that makes unit tests for the
+    portfolio valuation
+    """
+    PRICES = {
+        'BTCUSDT': Decimal('30000'),
+        'ETHBTC': Decimal('0.05'),
+        'BTCEUR': Decimal('25000'),
+        'ADAEUR': Decimal('0.5'),
+        'DOGEUSDT': Decimal('0.07'),
+    }
+
+    @pytest.mark.parametrize('index, base, expected', [
+        ('BTCUSDT', None, ('BTC', 'USDT')),
+        ('ETHBTC', None, ('ETH', 'BTC')),
+        ('USDCFDUSD', None, ('USDC', 'FDUSD')),
+        ('XYZTRY', 'XYZ', ('XYZ', 'TRY')),
+        ('XYZTRY', None, ('XYZTRY', None)),
+    ])
+    def test_split_symbol(self, index, base, expected):
+        """Test that coin indexes are split into their base and quote currencies"""
+        assert valuation.split_symbol(index, base) == expected
+
+    def test_required_symbols(self):
+        """Test that the pairs of the quote currencies with USDT are fetched too"""
+        assert valuation.required_symbols(['DOGEUSDT', 'ETHBTC', 'XYZTRY']) == \
+            {'DOGEUSDT', 'ETHBTC', 'XYZTRY', 'BTCUSDT'}
+
+    def test_triangulation(self):
+        """Test that coins quoted in another currency are converted through a bridge"""
+        result = valuation.value_holdings(
+            [('ETHBTC', Decimal('2')), ('ADAEUR', Decimal('10')), ('DOGEUSDT', Decimal('3'))],
+            self.PRICES,
+        )
+        # ETH: 0.05 BTC at 30000, ADA: 0.5 EUR at 30000 / 25000 (through BTC)
+        assert result.values == [Decimal('3000'), Decimal('6'), Decimal('0.21')]
+        assert result.total == Decimal('3006.21')
+        assert not result.missing
+
+    def test_missing_prices(self):
+        """Test that holdings without a price are left unvalued instead of failing"""
+        result = valuation.value_holdings(
+            [('XRPUSDT', Decimal('5')), ('DOGEUSDT', Decimal('1')), ('XYZTRY', Decimal('1'))],
+            {**self.PRICES, 'XYZTRY': Decimal('1')},
+        )
+        assert result.values == [None, Decimal('0.07'), None]
+        assert result.total == Decimal('0.07')
+        assert result.missing == {'XRPUSDT', 'XYZTRY'}
+
+    def test_exact_totals(self):
+        """Test that large batches add up exactly, unlike binary floats"""
+        holdings = [('DOGEUSDT', Decimal('0.1'))] * 10000
+        result = valuation.value_holdings(holdings, self.PRICES)
+        assert result.total == Decimal('70')
+        assert sum(0.07 * 0.1 for _ in holdings) != 70
+
+    def test_api_with_missing_price(self, client, user_with_balances, monkeypatch):
+        """Test that balances of coins without a price are served with a null value"""
+        monkeypatch.setattr(price_cache, 'get_prices', lambda symbols: {
+            'BTCUSDT': Decimal('2')
+        })
+        balances = client.get(f'/api/v1/balances/{user_with_balances}').json
+        assert {balance['value'] for balance in balances} == {'3.00', None}
+        holdings = client.get(f'/api/v1/balances/{user_with_balances}/holdings').json
+        assert [holding['value'] for holding in holdings['holdings']] == ['30.00', None]
+        assert holdings['total'] == '30.00'
+
+
+class TestMetrics:
+    """
+    Class that makes unit tests for the
+    request instrumentation
+    """
+    def test_registry_exposition(self):
+        """Test that histograms and counters are rendered in the Prometheus text format"""
+        registry = metrics.MetricsRegistry()
+        registry.observe('cryptex_request_duration_seconds', 0.02, endpoint='home')
+        registry.observe('cryptex_request_duration_seconds', 3, endpoint='home')
+        registry.inc('cryptex_requests_total', endpoint='say "hi"', method='GET', status=200)
+        text = registry.render([('cryptex_cache_entries', {'cache': 'users'}, 4)])
+        assert '# TYPE cryptex_request_duration_seconds histogram' in text
+        assert 'cryptex_request_duration_seconds_bucket{endpoint="home",le="0.01"} 0' in text
+        assert 'cryptex_request_duration_seconds_bucket{endpoint="home",le="0.025"} 1' in text
+        assert 'cryptex_request_duration_seconds_bucket{endpoint="home",le="+Inf"} 2' in text
+        assert 'cryptex_request_duration_seconds_sum{endpoint="home"} 3.02' in text
+        assert 'cryptex_requests_total{endpoint="say \\"hi\\"",method="GET",status="200"} 1' \
+            in text
+        assert 'cryptex_cache_entries{cache="users"} 4' in text
+
+    def test_server_timing(self, app, client, user_with_balances, monkeypatch):
+        """Test that the home page reports its database, upstream and render time"""
+        monkeypatch.setattr(price_cache, 'store', MemoryPriceStore())
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_with_balances)
+        with app.app_context():
+            response = client.get('/')
+        timing = response.headers['Server-Timing']
+        assert 'queries"' in timing
+        assert 'upstream;dur=' in timing
+        assert 'portfolio;dur=' in timing and 'render;dur=' in timing
+        assert timing.endswith(tuple(f'{digit}' for digit in range(10)))
+
+    def test_metrics_endpoint(self, client, user_with_balances, price_api, monkeypatch):
+        """Test that request latency, query counts and upstream latency are exposed"""
+        monkeypatch.setattr(price_cache, 'store', MemoryPriceStore())
+        metrics.registry.clear()
+        client.get(f'/api/v1/balances/{user_with_balances}')
+        response = client.get('/metrics')
+        assert response.content_type == metrics.CONTENT_TYPE
+        text = response.get_data(as_text=True)
+        host = urlsplit(price_api.url).netloc
+        assert 'cryptex_requests_total{endpoint="balanceapi",method="GET",status="200"} 1' \
+            in text
+        assert 'cryptex_request_db_queries_count{endpoint="balanceapi"} 1' in text
+        assert f'cryptex_upstream_request_duration_seconds_count{{host="{host}"}} 1' in text
+        assert f'cryptex_upstream_circuit_open{{host="{host}"}} 0' in text
+        assert 'cryptex_cache_hits_total{cache="users"}' in text
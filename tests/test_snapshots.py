@@ -0,0 +1,156 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from models import User, Coin, Balance, PortfolioSnapshot, PriceTick, db
+from service import portfolio as portfolio_service
+from service import snapshots as snapshot_service
+
+
+@pytest.fixture(name='history')
+def fixture_history(app):  # pylint: disable=unused-argument
+    """
+    Fixture that creates two users with balances and price ticks of their coins
+    over the first days of March 2025
+    """
+    coins = [Coin(index='SNAPAUSDT', abbreviation='SNAPA'),
+             Coin(index='SNAPBUSDT', abbreviation='SNAPB')]
+    users = [User(email='snapshots1@example.com'), User(email='snapshots2@example.com')]
+    db.session.add_all(coins + users)
+    db.session.flush()
+    first, second = coins
+    db.session.add_all([
+        Balance(user_id=users[0].id, coin_id=first.id, amount=Decimal('2'),
+                date_added=datetime(2025, 3, 1, 10)),
+        Balance(user_id=users[0].id, coin_id=second.id, amount=Decimal('10'),
+                date_added=datetime(2025, 3, 2, 12)),
+        Balance(user_id=users[1].id, coin_id=first.id, amount=Decimal('1'),
+                date_added=datetime(2025, 3, 2)),
+        PriceTick(coin_id=first.id, timestamp=datetime(2025, 3, 1, 9), price=Decimal('100')),
+        PriceTick(coin_id=first.id, timestamp=datetime(2025, 3, 2, 18), price=Decimal('110')),
+        PriceTick(coin_id=second.id, timestamp=datetime(2025, 3, 1), price=Decimal('0.5')),
+    ])
+    db.session.commit()
+    user_ids = [user.id for user in users]
+    coin_ids = [coin.id for coin in coins]
+    yield user_ids, coin_ids
+    PortfolioSnapshot.query.delete()
+    Balance.query.filter(Balance.user_id.in_(user_ids)).delete()
+    PriceTick.query.filter(PriceTick.coin_id.in_(coin_ids)).delete()
+    User.query.filter(User.id.in_(user_ids)).delete()
+    Coin.query.filter(Coin.id.in_(coin_ids)).delete()
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def values(user_id: int) -> list:
+    """
+    Function that gets the snapshots of a user as (day, float value) tuples
+    """
+    return [(day, float(value)) for day, value in snapshot_service.snapshot_history(user_id)]
+
+
+class TestSnapshots:
+    """
+    Tests the daily portfolio snapshot rollup
+    """
+
+    def test_rollup(self, history):
+        """Test that every day holds the closing value of the balances of each user"""
+        (first, second), _ = history
+        days = snapshot_service.rollup_snapshots(date(2025, 3, 1), date(2025, 3, 3),
+                                                 batch_size=1)
+        assert days == 3
+        assert values(first) == [
+            (date(2025, 3, 1), 200.0), (date(2025, 3, 2), 225.0), (date(2025, 3, 3), 225.0)
+        ]
+        # the balance of the second user was added at the end of the first day
+        assert values(second) == [(date(2025, 3, 2), 110.0), (date(2025, 3, 3), 110.0)]
+
+    def test_rollup_converts_quotes(self, history, listed_coins):
+        """Test that coins quoted in BTC are converted and priceless coins left out"""
+        (first, second), _ = history
+        btc = listed_coins[0].id
+        coins = [Coin(index='SNAPCBTC', abbreviation='SNAPC'),
+                 Coin(index='SNAPDUSDT', abbreviation='SNAPD')]
+        db.session.add_all(coins)
+        db.session.flush()
+        quoted, priceless = (coin.id for coin in coins)
+        db.session.add_all([
+            Balance(user_id=first, coin_id=quoted, amount=Decimal('2'),
+                    date_added=datetime(2025, 3, 1)),
+            Balance(user_id=second, coin_id=priceless, amount=Decimal('5'),
+                    date_added=datetime(2025, 3, 1)),
+            PriceTick(coin_id=quoted, timestamp=datetime(2025, 3, 1, 1), price=Decimal('0.01')),
+            PriceTick(coin_id=btc, timestamp=datetime(2025, 3, 1, 2), price=Decimal('30000')),
+        ])
+        db.session.commit()
+        try:
+            snapshot_service.rollup_snapshots(date(2025, 3, 1), date(2025, 3, 1))
+            # 2 SNAPA at 100 USDT and 2 SNAPC at 0.01 BTC of 30000 USDT
+            assert values(first) == [(date(2025, 3, 1), 800.0)]
+            # the only coin of the second user on that day has no price
+            assert values(second) == []
+            # the value history of the portfolio agrees with its snapshot
+            close = datetime(2025, 3, 1, 23)
+            assert portfolio_service.value_history(first, close, close) == [(close, 800.0)]
+            assert portfolio_service.value_history(second, close, close) == [(close, 0.0)]
+        finally:
+            PortfolioSnapshot.query.delete()
+            Balance.query.filter(Balance.coin_id.in_([quoted, priceless])).delete()
+            PriceTick.query.filter_by(coin_id=quoted).delete()
+            PriceTick.query.filter_by(coin_id=btc, timestamp=datetime(2025, 3, 1, 2)).delete()
+            Coin.query.filter(Coin.id.in_([quoted, priceless])).delete()
+            db.session.commit()
+
+    def test_rollup_resumes(self, history):
+        """Test that a rollup resumes from the last rolled up day, which it recomputes"""
+        (first, _), (coin_id, _) = history
+        assert snapshot_service.rollup_snapshots(date(2025, 3, 1), date(2025, 3, 2)) == 2
+        # a tick stored late changes the close of the last rolled up day
+        db.session.add(PriceTick(coin_id=coin_id, timestamp=datetime(2025, 3, 2, 23),
+                                 price=Decimal('120')))
+        db.session.commit()
+
+        assert snapshot_service.rollup_snapshots(to_day=date(2025, 3, 4)) == 3
+        assert values(first) == [
+            (date(2025, 3, 1), 200.0), (date(2025, 3, 2), 245.0),
+            (date(2025, 3, 3), 245.0), (date(2025, 3, 4), 245.0),
+        ]
+        assert PortfolioSnapshot.query.filter_by(user_id=first).count() == 4
+
+    def test_rollup_without_balances(self, app):  # pylint: disable=unused-argument
+        """Test that nothing is rolled up after the last day"""
+        assert snapshot_service.rollup_snapshots(date(2025, 3, 2), date(2025, 3, 1)) == 0
+
+    def test_rollup_command_and_api(self, app, client, history):
+        """Test that the command rolls up a range of days served by the API"""
+        (first, _), _ = history
+        result = app.test_cli_runner().invoke(args=[
+            'snapshots', 'rollup', '--from-date', '2025-03-01', '--to-date', '2025-03-03'
+        ])
+        assert result.exit_code == 0
+        assert 'Rolled up 3 days' in result.output
+
+        response = client.get(
+            f'/api/v1/portfolio/{first}/daily?from_date=2025-03-02&to_date=2025-03-03'
+        )
+        assert response.status_code == 200
+        assert response.json == [
+            {'day': '2025-03-02', 'value': '225.00'},
+            {'day': '2025-03-03', 'value': '225.00'},
+        ]
+
+    def test_scheduler(self, app, monkeypatch):
+        """Test that the scheduler rolls up and survives failed rollups"""
+        scheduler = snapshot_service.SnapshotScheduler(app, interval=60, batch_size=10)
+        monkeypatch.setattr(snapshot_service, 'rollup_snapshots',
+                            lambda batch_size: batch_size)
+        assert scheduler.run_once() == 10
+
+        def fail(batch_size):
+            raise RuntimeError(f'Rollup of {batch_size} users failed')
+
+        monkeypatch.setattr(snapshot_service, 'rollup_snapshots', fail)
+        assert scheduler.run_once() == 0
@@ -2,6 +2,8 @@ from flask_wtf import FlaskForm
 from wtforms import SubmitField, PasswordField, EmailField, SelectField, DecimalField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
 
+from service import balances as balance_service
+
 
 class RegistrationForm(FlaskForm):
     """
@@ -55,18 +57,14 @@ class BalanceForm(FlaskForm):
     def validate_amount(self, amount):
         """
         Function that validates balance amount added by a user.
-        It checks if the number of digits after the decimal point is within the
-        supported range and if the amount is within the allowed range. If the
-        validation fails, a ValidationError is raised with an appropriate error message.
+        The rules are shared with the bulk balance import, see
+        `service.balances.validate_amount`. If the validation fails, a
+        ValidationError is raised with an appropriate error message.
 
         Args:
             amount: The amount of a coin user wants to create a balance of.
         """
-        try:  # pylint: disable=W0707
-            digits_len = abs(amount.data.as_tuple().exponent)
-            if digits_len > 7:
-                raise ValueError("Sadly we only support only 7 values after comma")
-            if amount.data > 100000 or amount.data < 0.0000001:
-                raise ValueError("Sadly we only support values from range 0.0000001 to 100000")
+        try:
+            balance_service.validate_amount(amount.data)
         except ValueError as error:
             raise ValidationError(str(error)) from error
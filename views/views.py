@@ -1,38 +1,105 @@
-import requests
 from flask import (
     render_template,
     flash,
     Blueprint,
     redirect,
     request,
+    session,
     url_for,
     current_app,
+    abort,
 )
 from flask_login import login_user, login_required, logout_user, current_user
+from markupsafe import Markup
 
 from views.forms import RegistrationForm, LoginForm, BalanceForm
-from models import Balance
 from service import login_manager, CustomUser
+from service import users as user_service
+from service import coins as coin_service
+from service import balances as balance_service
+from service.metrics import timed
+from service.prices import price_cache
 
 
 blueprint = Blueprint('blueprint', __name__)
 
 
 @login_manager.user_loader
-def load_user(user_url):
+def load_user(user_id):
     """
     This function is used by Flask-Login to load the current user object from the user ID that
-    is stored in the session. This function takes a user URL as an argument and returns a
-    CustomUser object that is created by calling the create_from_api class method of the
-    CustomUser class.
+    is stored in the session. The user is resolved in-process through the user cache of the
+    user service, so only the first request of a user within the cache time-to-live hits
+    the database. Sessions created before the ID was stored keep the user URL instead,
+    which ends with the ID.
 
     Args:
-    user_url(str): The URL of the current user.
+    user_id(str): The ID (or the URL) of the current user.
 
     Returns:
-    CustomUser: A CustomUser object representing the current user.
+    CustomUser: A CustomUser object representing the current user, or None if the user
+    does not exist.
     """
-    return CustomUser.create_from_api(user_url)
+    try:
+        user_id = int(user_id.rstrip('/').rsplit('/', 1)[-1])
+    except ValueError:
+        return None
+    user = user_service.load_user(user_id)
+    if user is None:
+        return None
+    return CustomUser.create_from_dict(user, user_service.user_url(user_id))
+
+
+def coin_choices():
+    """
+    Function that builds the choices of the coin select field of the balance form
+
+    Returns:
+        list: A list of (id, abbreviation) tuples, one per coin.
+    """
+    return [(coin.id, coin.abbreviation) for coin in coin_service.list_coins()]
+
+
+def count_balance_write():
+    """
+    Function that counts a balance written by the user in the session. The count is
+    part of the key of the cached portfolio grid, so the next page shows the change
+    even if it is served by another worker, whose balance versions did not change.
+    """
+    session['balance_writes'] = session.get('balance_writes', 0) + 1
+
+
+def render_portfolio(context: dict, cursor: int = None) -> str:
+    """
+    Function that searches the balances of the current user and renders
+    the portfolio grid of the home page
+
+    Args:
+        context(dict): The 'from_date', 'to_date' and 'view' selected by the user.
+        cursor(int): The cursor of the page of balances to render, if any.
+
+    Returns:
+        str: The rendered 'portfolio.html' fragment.
+    """
+    current_app.logger.info("VIEW - Balance search start")
+    if context['view'] == 'holdings':
+        context.update(balance_service.list_holdings(
+            current_user.id,
+            from_date=context['from_date'],
+            to_date=context['to_date'],
+        ))
+        current_app.logger.info("VIEW - Holdings found: '%s'", len(context['holdings']))
+    else:
+        context['balances'], context['next_cursor'] = balance_service.page_balances(
+            current_user.id,
+            from_date=context['from_date'],
+            to_date=context['to_date'],
+            cursor=cursor,
+            limit=current_app.config['BALANCES_PAGE_SIZE'],
+        )
+        current_app.logger.info("VIEW - Balances found: '%s'", len(context['balances']))
+    current_app.logger.info("VIEW - Balance search end")
+    return render_template('portfolio.html', context=context)
 
 
 @blueprint.route('/', methods=['GET', 'POST'])
@@ -41,14 +108,26 @@ def home():
     Function that renders the home page of the application.
 
     If the user is authenticated, this function retrieves the balances of the user
-    from the API, according to the dates selected by the user in the search form.
-    The balances are displayed in a table in the template.
+    from the balance service, according to the dates selected by the user in the search form.
+    The balances are displayed in a table in the template, `BALANCES_PAGE_SIZE` at a time,
+    the page being selected by the 'cursor' parameter. With the 'holdings' view
+    (`?view=holdings`), the balances are summed per coin instead.
+
+    The rendered grid ('portfolio.html') is cached per user, balance version, price
+    snapshot version and page (see `count_balance_write`), so refreshing the page skips
+    both the database and the template until the balances of the user or the prices change.
 
     Returns:
         A rendered template ('home.html') with the following context variables:
             - from_date: A string with the 'from' date selected by the user.
             - to_date: A string with the 'to' date selected by the user.
-            - balances: A list of dictionaries with the balances of the user.
+            - view: Either 'balances' or 'holdings'.
+            - portfolio: The rendered portfolio grid, whose template gets:
+            - balances: A list of dictionaries with a page of the balances of the user.
+            - next_cursor: The cursor of the next page of balances, None on the last page.
+            - holdings: A list of dictionaries with the holdings of the user per coin
+              (holdings view only).
+            - total: The total value of the holdings (holdings view only).
 
         Each dictionary contains the following keys:
             * coin_abbreviation: A string with the abbreviation of the coin.
@@ -59,26 +138,36 @@ def home():
     current_app.logger.info("VIEW - Request from user - home page")
     from_date = request.form.get('from-date')
     to_date = request.form.get('to-date')
+    view = 'holdings' if request.args.get('view') == 'holdings' else 'balances'
     context = {
         "from_date": from_date,
         "to_date": to_date,
+        "view": view,
     }
-    current_app.logger.info(f"VIEW - Filters {context}")
+    current_app.logger.info("VIEW - Filters from_date: %s, to_date: %s, view: %s",
+                            from_date, to_date, view)
     if current_user.is_authenticated:
-        current_app.logger.info("VIEW - Balance search start")
-        response = requests.get(
-            timeout=5,
-            url=f'{request.url_root}api/v1/balances/{current_user.id}',
-            json={
-                "from_date": from_date,
-                "to_date": to_date,
-            }
+        try:
+            cursor = int(request.values.get('cursor'))
+        except (TypeError, ValueError):
+            cursor = None
+        key = (
+            current_user.id,
+            balance_service.balance_versions.get(current_user.id),
+            session.get('balance_writes', 0),
+            price_cache.version(),
+            view,
+            from_date,
+            to_date,
+            cursor,
         )
-        if response.status_code == 200:
-            context['balances'] = response.json()
-            current_app.logger.info(f"VIEW - Balances found: '{len(context['balances'])}'")
-        current_app.logger.info("VIEW - Balance search end")
-    return render_template('home.html', context=context)
+        with timed('portfolio'):
+            context['portfolio'] = Markup(balance_service.portfolio_cache.get_or_set(
+                key,
+                lambda: render_portfolio(dict(context), cursor),
+            ))
+    with timed('render'):
+        return render_template('home.html', context=context)
 
 
 @blueprint.route('/add-balance', methods=['GET', 'POST'])
@@ -88,39 +177,25 @@ def add_balance():
     Function that renders a form for user to add balance for a specific coin(crypto).
 
     Returns:
-        If form submission is valid and API response status code is 201, then redirects to home page
+        If form submission is valid, then creates the balance and redirects to home page
         Otherwise, re-renders the same form with error message.
 
     """
     form = BalanceForm()
-
-    coins = requests.get(url=f'{request.url_root}api/v1/coins', timeout=5)
-
-    if coins.status_code == 200:
-        available_coins = [
-            (coin['id'], coin['abbreviation'])
-            for coin in coins.json()
-        ]
-        form.coin.choices = available_coins
+    form.coin.choices = coin_choices()
 
     if form.validate_on_submit():
         current_app.logger.info("VIEW - Add Balance request started")
-        response = requests.post(
-            timeout=5,
-            url=f'{request.url_root}api/v1/balances',
-            json={
-                'user_id': current_user.id,
-                'coin_id': int(form.coin.data),
-                'amount': str(form.amount.data)
-            }
+        balance_service.create_balance(
+            current_user.id,
+            int(form.coin.data),
+            form.amount.data
         )
-        if response.status_code == 201:
-            flash('Coin Added Successfully!')
-            current_app.logger.info("VIEW - Add Balance successful")
-            current_app.logger.info("VIEW - Add Balance request ended")
-            return redirect(url_for('blueprint.home'))
-        current_app.logger.info("VIEW - Add Balance request failed")
-        flash('Something went wrong, please try again!')
+        count_balance_write()
+        flash('Coin Added Successfully!')
+        current_app.logger.info("VIEW - Add Balance successful")
+        current_app.logger.info("VIEW - Add Balance request ended")
+        return redirect(url_for('blueprint.home'))
     return render_template('balance.html', form=form)
 
 
@@ -142,30 +217,23 @@ def edit_balance(balance_id):
         the user to the edit balance page with an error message.
     """
     form = BalanceForm()
-    balance = Balance.query.get(balance_id)
-    coins = requests.get(url=f'{request.url_root}api/v1/coins', timeout=5)
-
-    if coins.status_code == 200:
-        available_coins = [
-            (coin['id'], coin['abbreviation'])
-            for coin in coins.json()
-        ]
-        form.coin.choices = available_coins
+    balance = balance_service.get_balance(balance_id)
+    if balance is None:
+        abort(404)
+    form.coin.choices = coin_choices()
 
     if form.validate_on_submit():
         current_app.logger.info("VIEW - Edit Balance request started")
-        response = requests.put(
-            timeout=5,
-            url=f'{request.url_root}api/v1/balances/{balance_id}',
-            json={
-                'coin_id': int(form.coin.data),
-                'amount': str(form.amount.data)
-            }
+        updated = balance_service.update_balance(
+            balance_id,
+            coin_id=int(form.coin.data),
+            amount=form.amount.data
         )
-        if response.status_code == 201:
+        if updated is not None:
+            count_balance_write()
             flash('Balance Updated Successfully!')
-            current_app.logger.info(f"VIEW - Edit Balance with"
-                                    f" id '{balance.id}' - updated successfully")
+            current_app.logger.info("VIEW - Edit Balance with id '%s' - updated successfully",
+                                    balance.id)
             current_app.logger.info("VIEW - Edit Balance request ended")
             return redirect(url_for('blueprint.home'))
         current_app.logger.info("VIEW - Edit Balance request failed")
@@ -187,11 +255,8 @@ def delete_balance(balance_id: int):
     Returns:
         redirect: Redirects to the home page after the balance has been deleted.
     """
-    response = requests.delete(
-        timeout=5,
-        url=f'{request.url_root}api/v1/balances/{balance_id}'
-    )
-    if response.status_code == 204:
+    if balance_service.delete_balance(balance_id):
+        count_balance_write()
         current_app.logger.info("VIEW - Balance delete successful")
         flash("Balance deleted")
 
@@ -221,16 +286,15 @@ def register():
     email = form.email.data
     if form.validate_on_submit():
         current_app.logger.info("VIEW - Register request started")
-        response = requests.post(
-            timeout=5,
-            url=f'{request.url_root}api/v1/users',
-            json={'email': form.email.data, 'password': form.password.data}
-        )
-        if response.status_code in [200, 201]:
+        user, _ = user_service.login_or_register(form.email.data, form.password.data)
+        if user is not None:
             flash('User Registered Successfully!')
-            login_user(CustomUser.create_from_api(response.headers.get('Location')))
-            current_app.logger.info(f"VIEW - User with "
-                                    f"id '{current_user.id}' - registered successfully")
+            login_user(CustomUser.create_from_dict(
+                user.to_dict(),
+                user_service.user_url(user.id)
+            ))
+            current_app.logger.info("VIEW - User with id '%s' - registered successfully",
+                                    current_user.id)
             current_app.logger.info("VIEW - Register request ended")
             return redirect(url_for('blueprint.home'))
         current_app.logger.info("VIEW - Register request failed")
@@ -259,16 +323,16 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         current_app.logger.info("VIEW - Login request started")
-        response = requests.post(
-            timeout=5,
-            url=f'{request.url_root}api/v1/users',
-            json={'email': form.email.data, 'password': form.password.data}
-        )
-        if response.status_code == 200:
+        user = user_service.authenticate(form.email.data, form.password.data)
+        if user is not None:
             flash('User Logged Successfully!')
-            login_user(CustomUser.create_from_api(response.headers.get('Location')))
+            login_user(CustomUser.create_from_dict(
+                user.to_dict(),
+                user_service.user_url(user.id)
+            ))
 
-            current_app.logger.info(f"VIEW - User with id '{current_user.id}' - login successfully")
+            current_app.logger.info("VIEW - User with id '%s' - login successfully",
+                                    current_user.id)
             current_app.logger.info("VIEW - Login request ended")
 
             return redirect(url_for('blueprint.home'))